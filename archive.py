@@ -0,0 +1,138 @@
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class Archive:
+    """Append-only SQLite archive of every detected SMS with full-text and prefix indexes.
+
+    Messages are indexed with FTS5 (falling back to LIKE scans when the
+    SQLite build lacks it); numbers and ranges use B-tree indexes queried as
+    prefix ranges, so lookups stay in the milliseconds on millions of rows.
+    Calls may come from worker threads; they are serialised on one connection.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS sms ("
+            " id INTEGER PRIMARY KEY,"
+            " key TEXT NOT NULL UNIQUE,"
+            " received REAL NOT NULL,"
+            " timestamp TEXT,"
+            " number TEXT NOT NULL,"
+            " range TEXT NOT NULL,"
+            " revenue TEXT,"
+            " message TEXT,"
+            " otp TEXT,"
+            " service TEXT);"
+            "CREATE INDEX IF NOT EXISTS sms_number ON sms (number);"
+            "CREATE INDEX IF NOT EXISTS sms_range ON sms (range);"
+            "CREATE INDEX IF NOT EXISTS sms_received ON sms (received);"
+        )
+        try:
+            self.db.executescript(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS sms_fts USING fts5(message, content='sms', content_rowid='id');"
+                "CREATE TRIGGER IF NOT EXISTS sms_fts_insert AFTER INSERT ON sms BEGIN"
+                " INSERT INTO sms_fts (rowid, message) VALUES (new.id, new.message); END;"
+                "CREATE TRIGGER IF NOT EXISTS sms_fts_delete AFTER DELETE ON sms BEGIN"
+                " INSERT INTO sms_fts (sms_fts, rowid, message) VALUES ('delete', old.id, old.message); END;"
+            )
+            self.fts = True
+        except sqlite3.OperationalError as e:
+            logger.warning("FTS5 unavailable, text search will scan the archive: %s", e)
+            self.fts = False
+        self.db.commit()
+
+    @staticmethod
+    def key_for(sms):
+        """Return the de-duplication key of an SMS (range, number, portal timestamp and text)."""
+        key = f"{sms.range}\x00{sms.number}\x00{sms.timestamp}\x00{sms.message}"
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def unarchived(self, sms_batch):
+        """Return the SMS of a batch that are not in the archive yet."""
+        with self.lock:
+            return [
+                sms for sms in sms_batch
+                if self.db.execute("SELECT 1 FROM sms WHERE key = ?", (self.key_for(sms),)).fetchone() is None
+            ]
+
+    def append(self, sms_batch):
+        """Archive a batch of SMS in one transaction, ignoring ones already archived; returns how many were new."""
+        now = time.time()
+        with self.lock, self.db:
+            cursor = self.db.executemany(
+                "INSERT OR IGNORE INTO sms (key, received, timestamp, number, range, revenue, message, otp, service)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (self.key_for(sms), now, sms.timestamp, sms.number, sms.range, str(sms.revenue),
+                     sms.message, sms.otp, sms.service)
+                    for sms in sms_batch
+                ],
+            )
+        return cursor.rowcount
+
+    @staticmethod
+    def _prefix_bounds(prefix):
+        """Return the [low, high) string range covering every value starting with prefix."""
+        return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+    def search(self, query, limit=10):
+        """Search by number prefix ("+225..." or digits), range prefix ("range:NAME") or message text.
+
+        Returns matching rows as dicts, newest first.
+        """
+        with self.lock:
+            return self._search(query, limit)
+
+    def _search(self, query, limit):
+        query = query.strip()
+        columns = "SELECT sms.timestamp, sms.number, sms.range, sms.revenue, sms.message, sms.otp, sms.service FROM sms"
+        if re.fullmatch(r"\+?\d+", query):
+            low, high = self._prefix_bounds(query.lstrip("+"))
+            rows = self.db.execute(
+                f"{columns} WHERE number >= ? AND number < ? ORDER BY id DESC LIMIT ?", (low, high, limit)
+            ).fetchall()
+        elif query.lower().startswith("range:"):
+            name = query[6:].strip()
+            # An exact range name walks the (range, id) index newest first; otherwise scan the prefix
+            rows = self.db.execute(f"{columns} WHERE range = ? ORDER BY id DESC LIMIT ?", (name, limit)).fetchall()
+            if not rows and name:
+                low, high = self._prefix_bounds(name)
+                rows = self.db.execute(
+                    f"{columns} WHERE range >= ? AND range < ? ORDER BY id DESC LIMIT ?", (low, high, limit)
+                ).fetchall()
+        elif self.fts:
+            terms = re.findall(r"\w+", query)
+            if not terms:
+                return []
+            match = " ".join(f'"{term}"*' for term in terms)
+            rows = self.db.execute(
+                f"{columns} WHERE id IN (SELECT rowid FROM sms_fts WHERE sms_fts MATCH ? ORDER BY rowid DESC LIMIT ?)"
+                " ORDER BY id DESC",
+                (match, limit),
+            ).fetchall()
+        else:
+            rows = self.db.execute(
+                f"{columns} WHERE message LIKE ? ORDER BY id DESC LIMIT ?", (f"%{query}%", limit)
+            ).fetchall()
+        fields = ("timestamp", "number", "range", "revenue", "message", "otp", "service")
+        return [dict(zip(fields, row)) for row in rows]
+
+    def prune(self, retention_seconds):
+        """Delete archived SMS older than the retention period; returns how many were removed."""
+        with self.lock, self.db:
+            cursor = self.db.execute("DELETE FROM sms WHERE received < ?", (time.time() - retention_seconds,))
+        return cursor.rowcount
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,195 @@
+"""Historical backfill of past days into the number tracker and the SMS archive.
+
+Walks a date range one portal day at a time (payload_4 for the day's ranges,
+payload_5 for their numbers, payload_6 for their messages) with bounded
+concurrency at housekeeping priority. Messages go to the archive and numbers
+to the tracker without any per-SMS notification; the poller then skips
+archived SMS, so nothing backfilled is ever notified. With --summary, one
+Telegram message per run reports what was found. Progress is checkpointed
+per (day, range), so an interrupted run resumes where it stopped.
+
+Run it while the poller is stopped, since both write the tracker file.
+
+    python backfill.py --from 2025-01-01 --to 2025-01-31 --summary
+"""
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import main
+from archive import Archive
+from logconfig import setup_logging
+from models import SMS, TrackedNumber, dump_tracker, load_tracker
+from otp import extract_otps
+from scheduler import HOUSEKEEPING, scheduler
+from transport import create_session
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_CONCURRENCY = int(os.getenv("BACKFILL_CONCURRENCY", "4"))
+BACKFILL_CHECKPOINT_FILE = os.getenv("BACKFILL_CHECKPOINT_FILE", "backfill_checkpoint.json")
+# The tracker and checkpoint are saved together every this many (day, range) units
+BACKFILL_CHECKPOINT_EVERY = int(os.getenv("BACKFILL_CHECKPOINT_EVERY", "10"))
+
+def portal_date(day):
+    return day.strftime("%m/%d/%Y")
+
+def message_time(timestamp):
+    """Epoch seconds of a portal message timestamp, or None when it cannot be parsed."""
+    try:
+        return datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").timestamp()
+    except ValueError:
+        return None
+
+class Checkpoint:
+    """Which (day, range) units of a backfill run are stored, with per-day totals.
+
+    A checkpoint only applies to the date range it was written for; starting
+    a different range starts over.
+    """
+
+    def __init__(self, path, start, end):
+        self.path = path
+        data = main.load_from_json(path)
+        if data.get("start") != start or data.get("end") != end:
+            data = {"start": start, "end": end, "done": {}, "summary": {}}
+        self.data = data
+
+    def is_done(self, day, range_name):
+        return range_name in self.data["done"].get(day, [])
+
+    def mark(self, day, range_name, sms_count, otp_count):
+        self.data["done"].setdefault(day, []).append(range_name)
+        totals = self.data["summary"].setdefault(day, {"ranges": 0, "sms": 0, "otps": 0})
+        totals["ranges"] += 1
+        totals["sms"] += sms_count
+        totals["otps"] += otp_count
+
+    def save(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=4)
+        os.replace(temp_path, self.path)
+
+async def backfill_range(session, csrf_token, day, range_name, number_tracker, archive):
+    """Store one range's messages of one day; returns the SMS that were not archived before."""
+    from_date, to_date = portal_date(day), portal_date(day + timedelta(days=1))
+    response = await scheduler.call(HOUSEKEEPING, "numbers", functools.partial(
+        main.payload_5, session, csrf_token, to_date, range_name, from_date
+    ))
+    numbers = await main.parse_offloaded(main.parse_numbers, response.text)
+    responses = await scheduler.map(HOUSEKEEPING, "messages", [
+        functools.partial(main.payload_6, session, csrf_token, to_date, n.number, range_name, from_date)
+        for n in numbers
+    ])
+
+    tracked_numbers = number_tracker.setdefault(range_name, {})
+    batch = []
+    for number_data, response in zip(numbers, responses):
+        entry = tracked_numbers.get(number_data.number)
+        if entry is None:
+            entry = tracked_numbers[number_data.number] = TrackedNumber(number_data.number_id)
+        for msg in await main.parse_offloaded(main.parse_message, response.text):
+            batch.append(SMS(msg.timestamp, number_data.number, msg.message, range_name, msg.revenue))
+            seen = message_time(msg.timestamp)
+            if seen and (entry.last_seen is None or seen > entry.last_seen):
+                entry.last_seen = seen
+
+    extract_otps(batch)
+    # Archive reads and writes are SQLite/FTS5 work; with several ranges in flight they must not block the loop
+    new_sms = await asyncio.to_thread(archive.unarchived, batch)
+    await asyncio.to_thread(archive.append, batch)
+    return new_sms
+
+def format_summary(checkpoint, elapsed):
+    summary = checkpoint.data["summary"]
+    lines = [f"📚 *Backfill {checkpoint.data['start']} → {checkpoint.data['end']}* ({elapsed:.0f}s)\n"]
+    for day in sorted(summary):
+        totals = summary[day]
+        lines.append(f"`{day}`: {totals['sms']} new SMS, {totals['otps']} codes in {totals['ranges']} ranges")
+    lines.append(f"\nTotal: {sum(t['sms'] for t in summary.values())} new SMS")
+    return "\n".join(lines)
+
+async def send_summary(text):
+    from telegram import Bot
+
+    async with Bot(os.getenv("BOT_TOKEN"), base_url=main.TELEGRAM_BASE_URL) as bot:
+        await bot.send_message(chat_id=os.getenv("CHAT_ID"), text=text, parse_mode="Markdown")
+
+async def run_backfill(start, end, summary=False, concurrency=BACKFILL_CONCURRENCY):
+    started = time.monotonic()
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    checkpoint = Checkpoint(BACKFILL_CHECKPOINT_FILE, start.isoformat(), end.isoformat())
+    number_tracker = load_tracker(main.load_from_json(main.NUMBER_TRACKER_FILE))
+    archive = Archive(main.ARCHIVE_FILE)
+
+    with create_session() as session:
+        tokens = await main.upstream(HOUSEKEEPING, main.payload_1, session)
+        await main.upstream(HOUSEKEEPING, main.payload_2, session, tokens["_token"])
+        _, csrf_token = await main.upstream(HOUSEKEEPING, main.payload_3, session)
+
+        # Ranges with SMS on each day
+        responses = await asyncio.gather(*(
+            main.upstream(HOUSEKEEPING, main.payload_4, session, csrf_token, portal_date(day), portal_date(day + timedelta(days=1)))
+            for day in days
+        ))
+        units = []
+        for day, response in zip(days, responses):
+            for range_stats in await main.parse_offloaded(main.parse_statistics, response.text):
+                if not checkpoint.is_done(day.isoformat(), range_stats.range_name):
+                    units.append((day, range_stats.range_name))
+        logger.info("Backfilling %s ranges over %s days (%s already done)", len(units), len(days),
+                    sum(len(done) for done in checkpoint.data["done"].values()))
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run_unit(day, range_name):
+            async with semaphore:
+                return day, range_name, await backfill_range(session, csrf_token, day, range_name, number_tracker, archive)
+
+        completed = 0
+        for unit in asyncio.as_completed([run_unit(day, range_name) for day, range_name in units]):
+            try:
+                day, range_name, new_sms = await unit
+            except Exception as e:
+                logger.error("Backfill unit failed, it will be retried on the next run: %s", e)
+                continue
+            checkpoint.mark(day.isoformat(), range_name, len(new_sms), sum(1 for sms in new_sms if sms.otp))
+            completed += 1
+            if completed % BACKFILL_CHECKPOINT_EVERY == 0:
+                await asyncio.to_thread(main.save_to_json, dump_tracker(number_tracker), main.NUMBER_TRACKER_FILE)
+                await asyncio.to_thread(checkpoint.save)
+                logger.info("Backfill progress: %s/%s ranges", completed, len(units))
+
+    await asyncio.to_thread(main.save_to_json, dump_tracker(number_tracker), main.NUMBER_TRACKER_FILE)
+    await asyncio.to_thread(checkpoint.save)
+    archive.close()
+    text = format_summary(checkpoint, time.monotonic() - started)
+    logger.info("Backfill finished: %s/%s ranges stored\n%s", completed, len(units), text)
+    if summary:
+        await send_summary(text)
+    return completed == len(units)
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--from", dest="start", required=True, type=datetime.fromisoformat, help="first day (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="end", type=datetime.fromisoformat, help="last day (YYYY-MM-DD, default yesterday)")
+    parser.add_argument("--summary", action="store_true", help="send one Telegram summary of the run")
+    parser.add_argument("--concurrency", type=int, default=BACKFILL_CONCURRENCY, help="ranges processed at once")
+    args = parser.parse_args(argv)
+
+    start = args.start.date()
+    end = args.end.date() if args.end else datetime.now().date() - timedelta(days=1)
+    if end < start:
+        parser.error("--to is before --from")
+    setup_logging()
+    return 0 if asyncio.run(run_backfill(start, end, args.summary, args.concurrency)) else 1
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
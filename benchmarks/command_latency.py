@@ -0,0 +1,134 @@
+"""Telegram command latency benchmark: long polling vs webhook.
+
+Runs the poller (main.main) against the local portal and Bot API stand-ins
+while SMS keep landing, sends /start commands to the bot either through
+getUpdates (polling) or by pushing them to the embedded webhook listener,
+and reports the time until the bot's reply reaches the Bot API.
+
+    python -m benchmarks.command_latency --commands 20
+"""
+import argparse
+import asyncio
+import importlib
+import os
+import socket
+import sys
+import tempfile
+import time
+
+from benchmarks.harness import FakeBotAPI, FakePortal, percentile
+
+OPERATOR_CHAT_ID = 42
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def sms_load(portal, interval):
+    i = 0
+    while True:
+        portal.inject(f"LOAD {i % 10}", f"4460000{i:05d}", f"Your code is {400000 + i}")
+        i += 1
+        await asyncio.sleep(interval)
+
+async def run_mode(mode, portal, botapi, args):
+    main = importlib.import_module("main")
+    portal.reset()
+    botapi.reset()
+    if mode == "webhook":
+        main.TELEGRAM_WEBHOOK_URL = f"http://127.0.0.1:{args.webhook_port}"
+        main.TELEGRAM_WEBHOOK_LISTEN = "127.0.0.1"
+        main.TELEGRAM_WEBHOOK_PORT = args.webhook_port
+        main.TELEGRAM_WEBHOOK_SECRET = "bench-secret"
+    else:
+        main.TELEGRAM_WEBHOOK_URL = ""
+
+    poller = asyncio.create_task(main.main())
+    load = None
+    try:
+        deadline = time.monotonic() + args.startup_timeout
+        while portal.request_count("/portal/sms/received/getsms") < 2 or (mode == "webhook" and not botapi.webhook):
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{mode}: poller did not start")
+            await asyncio.sleep(0.05)
+        load = asyncio.create_task(sms_load(portal, args.sms_interval))
+
+        latencies = []
+        for _ in range(args.commands):
+            update = botapi.command_update("/start", chat_id=OPERATOR_CHAT_ID)
+            replies_before = sum(1 for _, chat_id, _ in botapi.sent if str(chat_id) == str(OPERATOR_CHAT_ID))
+            sent_at = time.monotonic()
+            if mode == "webhook":
+                await asyncio.to_thread(botapi.push_update, update)
+            else:
+                botapi.queue_update(update)
+            reply_deadline = sent_at + args.reply_timeout
+            while time.monotonic() < reply_deadline:
+                replies = [t for t, chat_id, _ in botapi.sent if str(chat_id) == str(OPERATOR_CHAT_ID)]
+                if len(replies) > replies_before:
+                    latencies.append(replies[-1] - sent_at)
+                    break
+                await asyncio.sleep(0.005)
+            await asyncio.sleep(args.command_gap)
+    finally:
+        if load:
+            load.cancel()
+        poller.cancel()
+        try:
+            await poller
+        except (asyncio.CancelledError, Exception):
+            pass
+
+    return {
+        "mode": mode,
+        "commands": args.commands,
+        "replied": len(latencies),
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "max_ms": max(latencies) * 1000 if latencies else float("nan"),
+        "getUpdates": botapi.calls.get("getUpdates", 0),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", action="append", choices=["polling", "webhook"])
+    parser.add_argument("--commands", type=int, default=20)
+    parser.add_argument("--command-gap", type=float, default=0.5)
+    parser.add_argument("--sms-interval", type=float, default=0.2)
+    parser.add_argument("--reply-timeout", type=float, default=15.0)
+    parser.add_argument("--startup-timeout", type=float, default=30.0)
+    parser.add_argument("--webhook-port", type=int, default=None)
+    args = parser.parse_args(argv)
+    args.webhook_port = args.webhook_port or free_port()
+
+    portal = FakePortal().start()
+    botapi = FakeBotAPI().start()
+    os.environ.update({
+        "IVASMS_BASE_URL": portal.base_url,
+        "TELEGRAM_BASE_URL": botapi.api_url,
+        "BOT_TOKEN": "123456:BENCH",
+        "CHAT_ID": "-100123456",
+    })
+
+    results = []
+    cwd = os.getcwd()
+    try:
+        for mode in args.mode or ["polling", "webhook"]:
+            with tempfile.TemporaryDirectory() as state_dir:
+                os.chdir(state_dir)
+                try:
+                    results.append(asyncio.run(run_mode(mode, portal, botapi, args)))
+                finally:
+                    os.chdir(cwd)
+    finally:
+        portal.stop()
+        botapi.stop()
+
+    print(f"{'mode':<10}{'sent':>6}{'replied':>9}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'getUpdates':>12}")
+    for r in results:
+        print(f"{r['mode']:<10}{r['commands']:>6}{r['replied']:>9}{r['p50_ms']:>10.0f}{r['p95_ms']:>10.0f}{r['max_ms']:>10.0f}{r['getUpdates']:>12}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
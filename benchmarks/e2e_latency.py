@@ -0,0 +1,181 @@
+"""End-to-end OTP latency benchmark.
+
+Runs the real poller (main.main) against a local portal stand-in and a local
+fake Telegram Bot API, injects SMS at controlled times and reports the
+detection-to-delivery latency (portal injection -> sendMessage received) and
+delivery throughput per scenario. With --live-feed the poller subscribes to
+the stand-in's live SMS feed instead of drilling into every range each tick;
+the failover scenario takes the feed down halfway to exercise the fallback.
+
+    python -m benchmarks.e2e_latency
+    python -m benchmarks.e2e_latency --scenario burst --json bench.json
+    python -m benchmarks.e2e_latency --live-feed --scenario trickle --scenario failover
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.harness import FakeBotAPI, FakePortal, percentile
+
+
+async def idle_scenario(portal, args):
+    """Single OTPs landing on an otherwise idle account."""
+    for i in range(args.idle_count):
+        portal.inject("IDLE RANGE", f"4470000{i:05d}", f"Your code is {100000 + i}")
+        await asyncio.sleep(args.idle_gap)
+
+
+async def trickle_scenario(portal, args):
+    """A steady trickle of OTPs spread over a handful of ranges."""
+    for i in range(args.trickle_count):
+        portal.inject(f"TRICKLE {i % 5}", f"4480000{i:05d}", f"Your code is {200000 + i}")
+        await asyncio.sleep(args.trickle_interval)
+
+
+async def burst_scenario(portal, args):
+    """A burst of OTPs landing at once across many ranges."""
+    for i in range(args.burst_count):
+        portal.inject(f"BURST {i % args.burst_ranges}", f"4490000{i:05d}", f"Your code is {300000 + i}")
+
+
+async def failover_scenario(portal, args):
+    """A trickle during which the live feed goes down and comes back."""
+    for i in range(args.trickle_count):
+        if i == args.trickle_count // 3:
+            portal.set_feed(False)
+        elif i == 2 * args.trickle_count // 3:
+            portal.set_feed(True)
+        portal.inject(f"FAILOVER {i % 5}", f"4500000{i:05d}", f"Your code is {500000 + i}")
+        await asyncio.sleep(args.trickle_interval)
+
+
+SCENARIOS = {
+    "idle": idle_scenario,
+    "trickle": trickle_scenario,
+    "burst": burst_scenario,
+    "failover": failover_scenario,
+}
+
+
+async def wait_for(predicate, timeout, interval=0.05):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        await asyncio.sleep(interval)
+    return predicate()
+
+
+async def run_scenario(name, portal, botapi, args):
+    main = importlib.import_module("main")
+    portal.reset()
+    botapi.reset()
+    poller = asyncio.create_task(main.main())
+    try:
+        if not await wait_for(lambda: portal.request_count("/portal/sms/received/getsms") >= 2, args.startup_timeout):
+            raise RuntimeError("poller never reached its first statistics poll")
+        if args.live_feed and not await wait_for(lambda: portal.request_count("/portal/live/feed") >= 2, args.startup_timeout):
+            raise RuntimeError("poller never subscribed to the live feed")
+        started = time.monotonic()
+        await SCENARIOS[name](portal, args)
+        await wait_for(lambda: len(botapi.delivered) >= len(portal.injected), args.drain_timeout)
+        finished = time.monotonic()
+    finally:
+        poller.cancel()
+        try:
+            await poller
+        except (asyncio.CancelledError, Exception):
+            pass
+
+    latencies = [
+        botapi.delivered[marker] - injected
+        for marker, injected in portal.injected.items()
+        if marker in botapi.delivered
+    ]
+    deliveries = sorted(botapi.delivered.values())
+    span = (deliveries[-1] - min(portal.injected.values())) if deliveries else 0.0
+    return {
+        "scenario": name,
+        "injected": len(portal.injected),
+        "delivered": len(latencies),
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies) * 1000 if latencies else float("nan"),
+        "throughput_per_s": len(latencies) / span if span > 0 else float("nan"),
+        "duration_s": finished - started,
+        "portal_requests": sum(portal.requests.values()),
+        "live_feed": args.live_feed,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable, default: all)")
+    parser.add_argument("--poll-interval", type=float, default=None,
+                        help="override POLL_INTERVAL for the poller under test")
+    parser.add_argument("--live-feed", action="store_true",
+                        help="subscribe the poller to the stand-in's live SMS feed")
+    parser.add_argument("--idle-count", type=int, default=5)
+    parser.add_argument("--idle-gap", type=float, default=6.0)
+    parser.add_argument("--trickle-count", type=int, default=30)
+    parser.add_argument("--trickle-interval", type=float, default=1.0)
+    parser.add_argument("--burst-count", type=int, default=500)
+    parser.add_argument("--burst-ranges", type=int, default=50)
+    parser.add_argument("--startup-timeout", type=float, default=30.0)
+    parser.add_argument("--drain-timeout", type=float, default=120.0)
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    portal = FakePortal().start()
+    botapi = FakeBotAPI().start()
+
+    # The poller reads its configuration at import time
+    os.environ.update({
+        "IVASMS_BASE_URL": portal.base_url,
+        "TELEGRAM_BASE_URL": botapi.api_url,
+        "BOT_TOKEN": "123456:BENCH",
+        "CHAT_ID": "-100123456",
+    })
+    if args.poll_interval is not None:
+        os.environ["POLL_INTERVAL"] = str(args.poll_interval)
+    if args.live_feed:
+        os.environ["LIVE_FEED_URL"] = portal.feed_url
+
+    results = []
+    cwd = os.getcwd()
+    try:
+        for name in args.scenario or list(SCENARIOS):
+            with tempfile.TemporaryDirectory() as state_dir:
+                os.chdir(state_dir)
+                try:
+                    results.append(asyncio.run(run_scenario(name, portal, botapi, args)))
+                finally:
+                    os.chdir(cwd)
+    finally:
+        portal.stop()
+        botapi.stop()
+
+    print(f"{'scenario':<10}{'sent':>7}{'recv':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'msg/s':>9}{'reqs':>8}")
+    for r in results:
+        print(
+            f"{r['scenario']:<10}{r['injected']:>7}{r['delivered']:>7}{r['p50_ms']:>10.0f}{r['p95_ms']:>10.0f}"
+            f"{r['p99_ms']:>10.0f}{r['max_ms']:>10.0f}{r['throughput_per_s']:>9.1f}{r['portal_requests']:>8}"
+        )
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+    return 0 if all(r["delivered"] == r["injected"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
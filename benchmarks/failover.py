@@ -0,0 +1,126 @@
+"""HA lease failover benchmark.
+
+Runs two replicas of the lease loop in separate processes against a lease
+store: a SQLite file, or the Redis stand-in (needs the redis package). The
+leader ticks every 50 ms as the poller would; the benchmark then stops it,
+by killing its process (crash) or releasing the lease (graceful), and
+reports how long the standby took to tick instead, checking that the two
+replicas never ticked at the same time.
+
+    python -m benchmarks.failover --store sqlite --mode crash --ttl 3 --renew 0.5
+    python -m benchmarks.failover --store redis --mode graceful
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from ha import HA_LEASE_TTL, HA_RENEW_INTERVAL, Replica, open_store
+
+TICK_INTERVAL = 0.05
+
+def replica_process(store_url, replica_id, ttl, renew_interval, events, stop):
+    async def run():
+        replica = Replica(open_store(store_url, "failover-bench"), replica_id, ttl, renew_interval)
+        while True:
+            await replica.acquire()
+            events.put((replica_id, "leader", time.time()))
+            keeper = asyncio.create_task(replica.keep())
+            while not keeper.done():
+                if stop.is_set():
+                    keeper.cancel()
+                    await replica.release()
+                    return
+                if replica.holds_lease():
+                    events.put((replica_id, "tick", time.time()))
+                await asyncio.sleep(TICK_INTERVAL)
+
+    asyncio.run(run())
+
+def wait_event(events, replica_id, kind, timeout, ticks):
+    """Wait for `kind` from `replica_id`, collecting every tick seen meanwhile; returns its time."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            who, what, at = events.get(timeout=max(0.01, deadline - time.monotonic()))
+        except Exception:
+            break
+        if what == "tick":
+            ticks.append((who, at))
+        if who == replica_id and what == kind:
+            return at
+    raise TimeoutError(f"{replica_id} never reported {kind}")
+
+def run_round(context, store_url, args):
+    events = context.Queue()
+    replicas = {}
+    for replica_id in ("primary", "standby"):
+        stop = context.Event()
+        process = context.Process(target=replica_process, daemon=True,
+                                  args=(store_url, replica_id, args.ttl, args.renew, events, stop))
+        replicas[replica_id] = (process, stop)
+
+    ticks = []
+    replicas["primary"][0].start()
+    wait_event(events, "primary", "leader", 30, ticks)
+    replicas["standby"][0].start()
+    time.sleep(args.settle)
+
+    stopped = time.time()
+    if args.mode == "crash":
+        replicas["primary"][0].kill()
+    else:
+        replicas["primary"][1].set()
+    took_over = wait_event(events, "standby", "tick", args.ttl * 3 + 30, ticks)
+
+    replicas["standby"][1].set()
+    for process, _ in replicas.values():
+        process.join(timeout=10)
+    primary_ticks = [at for who, at in ticks if who == "primary"]
+    standby_ticks = [at for who, at in ticks if who == "standby"]
+    return {
+        "gap_s": took_over - max(primary_ticks, default=stopped),
+        "since_stop_s": took_over - stopped,
+        "overlap": bool(primary_ticks and standby_ticks and min(standby_ticks) <= max(primary_ticks)),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--store", choices=["sqlite", "redis"], default="sqlite")
+    parser.add_argument("--mode", choices=["crash", "graceful"], default="crash")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--ttl", type=float, default=HA_LEASE_TTL)
+    parser.add_argument("--renew", type=float, default=HA_RENEW_INTERVAL)
+    parser.add_argument("--settle", type=float, default=1.0, help="seconds both replicas run before the leader stops")
+    args = parser.parse_args(argv)
+
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as state_dir:
+        redis = None
+        if args.store == "redis":
+            from benchmarks.harness import FakeRedis
+
+            redis = FakeRedis().start()
+            store_url = redis.url
+        else:
+            store_url = f"sqlite:///{os.path.join(state_dir, 'ha.sqlite3')}"
+        try:
+            results = [run_round(context, store_url, args) for _ in range(args.rounds)]
+        finally:
+            if redis is not None:
+                redis.stop()
+
+    print(f"{args.mode} failover over {args.store}, lease ttl {args.ttl}s, renew every {args.renew}s")
+    for i, r in enumerate(results, 1):
+        print(f"  round {i}: standby ticking {r['gap_s'] * 1000:.0f} ms after the leader's last tick"
+              f"{'  OVERLAP' if r['overlap'] else ''}")
+    print(f"mean gap {statistics.mean(r['gap_s'] for r in results) * 1000:.0f} ms, "
+          f"max {max(r['gap_s'] for r in results) * 1000:.0f} ms")
+    return 1 if any(r["overlap"] for r in results) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
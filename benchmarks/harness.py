@@ -0,0 +1,460 @@
+import json
+import math
+import re
+import socket
+import socketserver
+import threading
+import time
+import urllib.parse
+import urllib.request
+from datetime import datetime
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MARKER_PATTERN = re.compile(r"BENCH-\d+")
+
+class _Handler(BaseHTTPRequestHandler):
+    """Dispatch requests to the owning stand-in's route table."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _dispatch(self, method):
+        parsed = urllib.parse.urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        status, headers, payload = self.server.owner.handle(method, parsed.path, parsed.query, self.headers, body)
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+class _ReusePortHTTPServer(ThreadingHTTPServer):
+    """Lets several processes serve the same port, the kernel spreading connections over them."""
+
+    def server_bind(self):
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+class StandInServer:
+    """Threaded local HTTP server that delegates routing to handle()."""
+
+    def __init__(self, host="127.0.0.1", port=0, reuse_port=False):
+        server_class = _ReusePortHTTPServer if reuse_port else ThreadingHTTPServer
+        self.httpd = server_class((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.owner = self
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def handle(self, method, path, query, headers, body):
+        raise NotImplementedError
+
+def _form(body):
+    return {k: v[-1] for k, v in urllib.parse.parse_qs(body.decode("utf-8"), keep_blank_values=True).items()}
+
+class FakePortal(StandInServer):
+    """Minimal ivasms.com stand-in serving the markup the bot's parsers expect.
+
+    SMS are injected with inject(); the injection time of every message is
+    recorded against the BENCH-<n> marker embedded in its text. Injected SMS
+    are also published on a long-poll live feed at /portal/live/feed, which
+    set_feed(False) takes down to exercise the polling fallback.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, reuse_port=False):
+        super().__init__(host, port, reuse_port)
+        self.lock = threading.Lock()
+        self.feed_ready = threading.Condition(self.lock)
+        self.reset()
+
+    @property
+    def feed_url(self):
+        return f"{self.base_url}/portal/live/feed"
+
+    def reset(self):
+        with self.lock:
+            self.ranges = {}
+            self.injected = {}
+            self.requests = {}
+            self._next_marker = 0
+            self._next_number_id = 1000
+            self.events = []
+            self.feed_up = True
+
+    def inject(self, range_name, number, text, revenue="0.01", timestamp=None):
+        """Add an SMS to a number (newest first) and return its marker."""
+        with self.lock:
+            self._next_marker += 1
+            marker = f"BENCH-{self._next_marker:06d}"
+            range_data = self.ranges.setdefault(range_name, {
+                "range_id": f"R{len(self.ranges) + 1}",
+                "numbers": {},
+            })
+            number_data = range_data["numbers"].get(number)
+            if number_data is None:
+                self._next_number_id += 1
+                number_data = range_data["numbers"][number] = {"number_id": str(self._next_number_id), "messages": []}
+            timestamp = timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            number_data["messages"].insert(0, (timestamp, f"{text} {marker}", revenue))
+            self.injected[marker] = time.monotonic()
+            self.events.append({
+                "id": len(self.events) + 1,
+                "range": range_name,
+                "number": number,
+                "message": f"{text} {marker}",
+                "timestamp": timestamp,
+                "revenue": revenue,
+            })
+            self.feed_ready.notify_all()
+            return marker
+
+    def set_feed(self, up):
+        """Bring the live feed up or down; while down it answers 503 and open long-polls are dropped."""
+        with self.feed_ready:
+            self.feed_up = up
+            self.feed_ready.notify_all()
+
+    def feed_events(self, query):
+        """Long-poll: events after ?cursor=, waiting up to ?wait= seconds for one to arrive."""
+        params = urllib.parse.parse_qs(query)
+        wait = min(float(params.get("wait", ["25"])[-1]), 60)
+        deadline = time.monotonic() + wait
+        with self.feed_ready:
+            if "cursor" not in params:
+                return 200, {"cursor": len(self.events), "events": []}
+            cursor = int(params["cursor"][-1])
+            while self.feed_up and len(self.events) <= cursor and time.monotonic() < deadline:
+                self.feed_ready.wait(deadline - time.monotonic())
+            if not self.feed_up:
+                return 503, {"error": "feed unavailable"}
+            return 200, {"cursor": len(self.events), "events": self.events[cursor:]}
+
+    def request_count(self, path):
+        with self.lock:
+            return self.requests.get(path, 0)
+
+    def handle(self, method, path, query, headers, body):
+        with self.lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+        html = {"Content-Type": "text/html; charset=UTF-8"}
+        if path == "/login" and method == "GET":
+            return 200, html, '<form><input type="hidden" name="_token" value="bench-token"></form>'
+        if path == "/login" and method == "POST":
+            return 302, {"Location": "/portal"}, ""
+        if path == "/portal":
+            return 200, html, "<html><body>portal</body></html>"
+        if path == "/portal/sms/received":
+            return 200, html, '<html><head><meta name="csrf-token" content="bench-csrf"></head></html>'
+        if path == "/portal/sms/received/getsms":
+            return 200, html, self.render_statistics()
+        if path == "/portal/sms/received/getsms/number":
+            return 200, html, self.render_numbers(_form(body).get("range", ""))
+        if path == "/portal/sms/received/getsms/number/sms":
+            fields = _form(body)
+            return 200, html, self.render_messages(fields.get("Range", ""), fields.get("Number", ""))
+        if path == "/portal/live/feed":
+            status, data = self.feed_events(query)
+            return status, {"Content-Type": "application/json"}, json.dumps(data)
+        return 404, html, "not found"
+
+    def render_statistics(self):
+        with self.lock:
+            cards = []
+            for range_name, range_data in self.ranges.items():
+                count = sum(len(n["messages"]) for n in range_data["numbers"].values())
+                revenue = sum(float(m[2]) for n in range_data["numbers"].values() for m in n["messages"])
+                cards.append(
+                    f'<div class="card card-body mb-1 pointer" onclick="getDetials(\'{range_data["range_id"]}\')">'
+                    f'<div class="row"><div class="col-sm-4">{escape(range_name)}</div>'
+                    f'<div class="col-3 col-sm-2"><p>{count}</p></div>'
+                    f'<div class="col-3 col-sm-2"><p>{count}</p></div>'
+                    f'<div class="col-3 col-sm-2"><p>0</p></div>'
+                    f'<div class="col-3 col-sm-2"><span class="currency_cdr">{revenue:.2f}</span></div></div></div>'
+                )
+        if not cards:
+            return '<p id="messageFlash">You do not have any SMS</p>'
+        return "".join(cards)
+
+    def render_numbers(self, range_name):
+        with self.lock:
+            numbers = self.ranges.get(range_name, {}).get("numbers", {})
+            return "".join(
+                '<div class="card card-body border-bottom bg-100 p-2 rounded-0">'
+                f'<div class="col-sm-4" onclick="getDetialsNumber(\'{number}\',\'{data["number_id"]}\')">{number}</div></div>'
+                for number, data in numbers.items()
+            )
+
+    def render_messages(self, range_name, number):
+        with self.lock:
+            messages = list(self.ranges.get(range_name, {}).get("numbers", {}).get(number, {}).get("messages", []))
+        rows = "".join(
+            "<tr><td>"
+            f'<div class="col-9 col-sm-6 text-center text-sm-start"><p>{escape(text)}</p></div>'
+            f'<div class="col-3 col-sm-2 text-center text-sm-start"><span class="currency_cdr">{revenue}</span></div>'
+            f'<div class="col-12 col-sm-4 text-center text-sm-start"><p>{timestamp}</p></div>'
+            "</td></tr>"
+            for timestamp, text, revenue in messages
+        )
+        return f"<table><tbody>{rows}</tbody></table>"
+
+class FakeBotAPI(StandInServer):
+    """Local Telegram Bot API stand-in that records every sendMessage call."""
+
+    def __init__(self, host="127.0.0.1", port=0, long_poll_seconds=1.0):
+        super().__init__(host, port)
+        self.long_poll_seconds = long_poll_seconds
+        self.lock = threading.Lock()
+        self.updates_ready = threading.Condition(self.lock)
+        self.reset()
+
+    @property
+    def api_url(self):
+        return f"{self.base_url}/bot"
+
+    def reset(self):
+        with self.lock:
+            self.sent = []
+            self.delivered = {}
+            self.calls = {}
+            self.updates = []
+            self.webhook = None
+            self._next_message_id = 1
+            self._next_update_id = 1
+
+    def handle(self, method, path, query, headers, body):
+        api_method = path.rsplit("/", 1)[-1]
+        if headers.get("Content-Type", "").startswith("application/json"):
+            params = json.loads(body or b"{}")
+        else:
+            params = _form(body)
+        with self.lock:
+            self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        result = self.dispatch(api_method, params)
+        return 200, {"Content-Type": "application/json"}, json.dumps({"ok": True, "result": result})
+
+    def dispatch(self, api_method, params):
+        if api_method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if api_method == "getUpdates":
+            return self.next_updates(int(params.get("offset") or 0), float(params.get("timeout") or 0))
+        if api_method == "setWebhook":
+            with self.lock:
+                self.webhook = {"url": params.get("url"), "secret_token": params.get("secret_token")}
+            return True
+        if api_method == "deleteWebhook":
+            with self.lock:
+                self.webhook = None
+            return True
+        if api_method == "sendMessage":
+            return self.record_message(params)
+        return True
+
+    def command_update(self, text, chat_id=42):
+        """Build a private-chat update carrying a bot command."""
+        with self.lock:
+            update_id = self._next_update_id
+            self._next_update_id += 1
+        command_length = len(text.split()[0])
+        return {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private", "first_name": "Operator"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "Operator"},
+                "text": text,
+                "entities": [{"type": "bot_command", "offset": 0, "length": command_length}],
+            },
+        }
+
+    def queue_update(self, update):
+        """Hand an update to the bot through the next getUpdates call."""
+        with self.updates_ready:
+            self.updates.append(update)
+            self.updates_ready.notify_all()
+
+    def push_update(self, update):
+        """Deliver an update to the bot's registered webhook, as Telegram would."""
+        with self.lock:
+            webhook = dict(self.webhook or {})
+        if not webhook.get("url"):
+            raise RuntimeError("no webhook registered")
+        request = urllib.request.Request(webhook["url"], data=json.dumps(update).encode("utf-8"), method="POST")
+        request.add_header("Content-Type", "application/json")
+        if webhook.get("secret_token"):
+            request.add_header("X-Telegram-Bot-Api-Secret-Token", webhook["secret_token"])
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+
+    def next_updates(self, offset, timeout):
+        with self.updates_ready:
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+            if not self.updates:
+                self.updates_ready.wait(min(timeout, self.long_poll_seconds))
+            return list(self.updates)
+
+    def record_message(self, params):
+        received = time.monotonic()
+        text = params.get("text", "")
+        with self.lock:
+            message_id = self._next_message_id
+            self._next_message_id += 1
+            self.sent.append((received, params.get("chat_id"), text))
+            for marker in MARKER_PATTERN.findall(text):
+                self.delivered.setdefault(marker, received)
+        try:
+            chat_id = int(params.get("chat_id"))
+        except (TypeError, ValueError):
+            chat_id = 0
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": "bench"},
+            "text": text,
+        }
+
+class _RedisHandler(socketserver.StreamRequestHandler):
+    """Read RESP commands and write back the owning FakeRedis's replies."""
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            if args:
+                self.wfile.write(_resp(self.server.owner.execute(args)))
+
+def _resp(reply):
+    if isinstance(reply, Exception):
+        return f"-ERR {reply}\r\n".encode()
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, bool) or reply == "OK":
+        return b"+OK\r\n"
+    if isinstance(reply, int):
+        return f":{reply}\r\n".encode()
+    return b"$%d\r\n%s\r\n" % (len(reply), reply)
+
+class FakeRedis:
+    """Minimal Redis stand-in speaking RESP, with the commands and scripts of the HA lease store.
+
+    Scripts are not interpreted: EVAL runs the Python equivalent of the
+    lease scripts in ha.py, matched by their exact source.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        from ha import ACQUIRE_SCRIPT, RELEASE_SCRIPT
+
+        self.lock = threading.Lock()
+        self.data = {}
+        self.scripts = {ACQUIRE_SCRIPT.encode(): self._acquire, RELEASE_SCRIPT.encode(): self._release}
+        self.server = socketserver.ThreadingTCPServer((host, port), _RedisHandler)
+        self.server.daemon_threads = True
+        self.server.owner = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _get(self, key):
+        value, expires = self.data.get(key, (None, None))
+        if expires is not None and time.monotonic() >= expires:
+            del self.data[key]
+            return None
+        return value
+
+    def _set(self, key, value, px=None):
+        self.data[key] = (value, time.monotonic() + px / 1000 if px else None)
+
+    def _acquire(self, keys, args):
+        holder = self._get(keys[0])
+        if holder is None or holder == args[0]:
+            self._set(keys[0], args[0], int(args[1]))
+            return 1
+        return 0
+
+    def _release(self, keys, args):
+        if self._get(keys[0]) == args[0]:
+            del self.data[keys[0]]
+            return 1
+        return 0
+
+    def execute(self, args):
+        command = args[0].upper()
+        with self.lock:
+            if command == b"GET":
+                return self._get(args[1])
+            if command == b"SET":
+                options = [a.upper() for a in args[3:]]
+                if b"NX" in options and self._get(args[1]) is not None:
+                    return None
+                px = int(args[3 + options.index(b"PX") + 1]) if b"PX" in options else None
+                self._set(args[1], args[2], px)
+                return "OK"
+            if command == b"DEL":
+                return sum(1 for key in args[1:] if self._get(key) is not None and self.data.pop(key))
+            if command == b"EVAL":
+                script = self.scripts.get(args[1])
+                if script is None:
+                    return ValueError("unknown script")
+                numkeys = int(args[2])
+                return script(args[3:3 + numkeys], args[3 + numkeys:])
+            if command == b"PING":
+                return b"PONG"
+            if command in (b"CLIENT", b"SELECT", b"HELLO"):
+                return "OK"
+            return ValueError(f"unknown command '{command.decode()}'")
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an unsorted sequence."""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = max(0, math.ceil(fraction * len(ordered)) - 1)
+    return ordered[index]
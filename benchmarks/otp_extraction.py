@@ -0,0 +1,124 @@
+"""OTP extraction throughput benchmark.
+
+Builds a synthetic corpus of OTP messages in the formats the big services use,
+runs otp.extract_otps over it in cycle-sized batches and reports messages per
+second. Accuracy is measured separately on LABELLED, hand-labelled SMS in
+real formats, including messages whose numbers are not codes (amounts, phone
+numbers, order numbers), so a pattern regression shows up as a lower score.
+
+    python -m benchmarks.otp_extraction --messages 200000 --batch 500
+"""
+import argparse
+import copy
+import random
+import sys
+import time
+
+from models import SMS
+from otp import extract_otps
+
+TEMPLATES = [
+    ("WhatsApp", "Your WhatsApp code {a}-{b}\nYou can also tap on this link to verify your phone: v.whatsapp.com/{a}{b}\nDon't share this code with others"),
+    ("WhatsApp", "<#> Your WhatsApp Business code {a}-{b}\n4sgLq1p5sV6"),
+    ("Telegram", "Telegram code: {a}{b}\n\nYou can also tap on this link to log in:\nhttps://t.me/login/{a}{b}"),
+    ("Google", "G-{a}{b} is your Google verification code."),
+    ("Facebook", "FB-{a}{b} is your Facebook confirmation code"),
+    ("Instagram", "Use {a} {b} to verify your Instagram account."),
+    ("TikTok", "[TikTok] {a}{b} is your verification code, valid for 5 minutes. To keep your account safe, never forward this code."),
+    ("Microsoft", "Use the code {a}{b} to verify your Microsoft account"),
+    ("Binance", "[Binance] Your verification code: {a}{b}. Don't share your code with anyone."),
+    (None, "Your verification code is {a}{b}. It expires in 10 minutes."),
+    (None, "رمز التحقق الخاص بك هو {a}{b}"),
+    (None, "Tu código de verificación es {a}{b}"),
+]
+
+# Hand-labelled SMS: (sender, message, service, code), with None where there is no code
+LABELLED = [
+    ("WhatsApp", "Your WhatsApp code 482-915\nYou can also tap on this link to verify your phone: v.whatsapp.com/482915\nDon't share this code with others", "WhatsApp", "482915"),
+    (None, "<#> Your WhatsApp Business code 307-664\n4sgLq1p5sV6", "WhatsApp", "307664"),
+    ("Telegram", "Telegram code: 51873\n\nYou can also tap on this link to log in:\nhttps://t.me/login/51873\n\naQ1xZ9Lm7kP", "Telegram", "51873"),
+    (None, "Код подтверждения Telegram: 64021. Никому не давайте код.", "Telegram", "64021"),
+    ("Google", "G-730184 is your Google verification code.", "Google", "730184"),
+    (None, "Your Google verification code is 552913", "Google", "552913"),
+    ("Facebook", "FB-83012 is your Facebook confirmation code", "Facebook", "83012"),
+    (None, "Use 229 481 to verify your Instagram account.", "Instagram", "229481"),
+    (None, "[TikTok] 6627 is your verification code, valid for 5 minutes. To keep your account safe, never forward this code.", "TikTok", "6627"),
+    (None, "Microsoft account security code: 9034", "Microsoft", "9034"),
+    (None, "Use the code 40917733 to verify your Microsoft account", "Microsoft", "40917733"),
+    (None, "Your Apple ID Code is: 318822. Don't share it with anyone.", "Apple", "318822"),
+    (None, "Amazon: 901245 is your one-time password (OTP). Do not share it with anyone.", "Amazon", "901245"),
+    ("Viber", "Your Viber code is 7731. Do not share it with anyone.", "Viber", "7731"),
+    (None, "Your Signal registration code is 184-330. Do not share this code", "Signal", "184330"),
+    (None, "Snapchat code: 602-117. Happy Snapping!", "Snapchat", "602117"),
+    (None, "Your Uber code is 4412. Never share this code.", "Uber", "4412"),
+    (None, "[Binance] Your verification code: 275604. Don't share your code with anyone.", "Binance", "275604"),
+    (None, "Your verification code is 839201. It expires in 10 minutes.", None, "839201"),
+    (None, "Your OTP is 4481. Valid for 3 minutes.", None, "4481"),
+    (None, "رمز التحقق الخاص بك هو 550713", None, "550713"),
+    (None, "Tu código de verificación es 114278", None, "114278"),
+    (None, "Seu código de acesso: 908 231", None, "908231"),
+    (None, "PIN: 2290 - do not share it with anyone", None, "2290"),
+    # The code is not the first number of the message
+    (None, "Order 55120 confirmed. Your delivery code is 8830.", None, "8830"),
+    (None, "Valid for 10 minutes: 661902 is your login code", None, "661902"),
+    # No code at all
+    (None, "You have received 2500.00 USD. Your balance is 18342.50 USD.", None, None),
+    (None, "Call us back on 0800 123 456 for help with your account.", None, None),
+    (None, "Your order #1042993 has shipped and arrives on 12/05/2025.", None, None),
+    (None, "Welcome! Reply STOP to 20202 to unsubscribe.", None, None),
+    ("WhatsApp", "Someone is trying to register +44 7911 123456 on WhatsApp. If this wasn't you, ignore this message.", "WhatsApp", None),
+]
+
+def labelled_accuracy():
+    """Return (correct codes, correct services, wrong codes on messages without one) over LABELLED."""
+    batch = extract_otps([
+        SMS("2025-01-01 00:00:00", f"2250{i:08d}", message, "IVORY COAST 1", "0.01", sender=sender)
+        for i, (sender, message, _, _) in enumerate(LABELLED)
+    ])
+    codes = sum(1 for sms, (_, _, _, code) in zip(batch, LABELLED) if sms.otp == code)
+    services = sum(1 for sms, (_, _, service, _) in zip(batch, LABELLED) if sms.service == service)
+    false_codes = sum(1 for sms, (_, _, _, code) in zip(batch, LABELLED) if code is None and sms.otp is not None)
+    return codes, services, false_codes
+
+def build_corpus(size, seed=1):
+    """Return (sms, expected_code) pairs drawn from the templates."""
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(size):
+        _, template = rng.choice(TEMPLATES)
+        a, b = f"{rng.randrange(1000):03d}", f"{rng.randrange(1000):03d}"
+        sms = SMS("2025-01-01 00:00:00", f"2250{i:08d}", template.format(a=a, b=b), f"IVORY COAST {i % 50}", "0.01")
+        corpus.append((sms, a + b))
+    return corpus
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--batch", type=int, default=500, help="messages per poll cycle")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--min-accuracy", type=float, default=0.0, help="exit 1 when the code accuracy is lower")
+    args = parser.parse_args(argv)
+
+    corpus = build_corpus(args.messages)
+    best = None
+    for _ in range(args.repeat):
+        batches = [[copy.copy(sms) for sms, _ in corpus[i:i + args.batch]] for i in range(0, len(corpus), args.batch)]
+        started = time.perf_counter()
+        for batch in batches:
+            extract_otps(batch)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    codes, services, false_codes = labelled_accuracy()
+    negatives = sum(1 for *_, code in LABELLED if code is None)
+    print(f"messages:   {len(corpus)}")
+    print(f"batch size: {args.batch}")
+    print(f"best time:  {best:.3f} s")
+    print(f"throughput: {len(corpus) / best:,.0f} msg/s")
+    print(f"code accuracy:    {codes}/{len(LABELLED)} ({codes / len(LABELLED):.2%}) hand-labelled SMS")
+    print(f"service accuracy: {services}/{len(LABELLED)} ({services / len(LABELLED):.2%})")
+    print(f"false codes:      {false_codes}/{negatives} messages without a code")
+    return 0 if codes / len(LABELLED) >= args.min_accuracy else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""HTML parse offload benchmark.
+
+Parses a cycle's worth of large getsms/number and getsms/number/sms pages
+through main.parse_offloaded with 0 (inline), 1, 2 and N pool workers while a
+probe task measures event-loop lag, and reports lag and cycle time for each.
+
+    python -m benchmarks.parse_offload --pages 40 --rows 2000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import main
+from benchmarks.harness import FakePortal, percentile
+
+def build_pages(pages, rows):
+    """Render large message and number pages with the portal stand-in's markup."""
+    portal = FakePortal()
+    try:
+        for page in range(pages):
+            for row in range(rows):
+                portal.inject(f"RANGE {page}", f"4410{page:04d}", f"Your verification code is {row:06d}")
+                if page == 0:
+                    portal.inject(f"RANGE {page}", f"4420{row:06d}", "Your code is 123456")
+        message_pages = [portal.render_messages(f"RANGE {page}", f"4410{page:04d}") for page in range(pages)]
+        number_page = portal.render_numbers("RANGE 0")
+    finally:
+        portal.httpd.server_close()
+    return message_pages, number_page
+
+async def lag_probe(samples, interval=0.005):
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - started - interval)
+
+async def run_cycle(message_pages, number_page):
+    probe_samples = []
+    probe = asyncio.create_task(lag_probe(probe_samples))
+    await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    await asyncio.gather(
+        main.parse_offloaded(main.parse_numbers, number_page),
+        *(main.parse_offloaded(main.parse_message, page) for page in message_pages),
+    )
+    elapsed = time.perf_counter() - started
+    probe.cancel()
+    return elapsed, probe_samples
+
+def main_benchmark(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--executor", choices=["process", "thread"], default="process")
+    parser.add_argument("--workers", type=int, action="append",
+                        help="worker counts to compare (default: 0, 1, 2 and CPU count)")
+    args = parser.parse_args(argv)
+
+    message_pages, number_page = build_pages(args.pages, args.rows)
+    print(f"{args.pages} message pages of {args.rows} rows (~{len(message_pages[0]) // 1024} KiB each)")
+    print(f"{'workers':>8}{'cycle s':>10}{'lag p50 ms':>12}{'lag p99 ms':>12}{'lag max ms':>12}")
+    for workers in args.workers or [0, 1, 2, os.cpu_count() or 4]:
+        main.PARSE_WORKERS = workers
+        main.PARSE_EXECUTOR = args.executor
+        main.PARSE_INLINE_THRESHOLD = 0
+        main._parse_executor = None
+        executor = main.get_parse_executor()
+        if executor is not None:
+            # Warm the pool so worker start-up is not counted as parse time
+            list(executor.map(main.parse_numbers, [number_page] * workers))
+        elapsed, lag = asyncio.run(run_cycle(message_pages, number_page))
+        if executor is not None:
+            executor.shutdown()
+        print(
+            f"{workers:>8}{elapsed:>10.2f}{percentile(lag, 0.50) * 1000:>12.1f}"
+            f"{percentile(lag, 0.99) * 1000:>12.1f}{max(lag, default=0) * 1000:>12.1f}"
+        )
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_benchmark())
@@ -0,0 +1,103 @@
+"""Record model memory and allocation benchmark.
+
+Compares the former ad-hoc dict layout with the slotted models of models.py:
+memory held by a number tracker of N tracked numbers, and the blocks
+allocated and time taken by one poll tick's worth of records (range stats,
+number lists, message rows and detected SMS).
+
+    python -m benchmarks.record_model --numbers 100000 --ranges 200
+"""
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+
+from models import SMS, Message, NumberInfo, RangeStats, TrackedNumber
+
+def measure(build, inputs):
+    """Return (bytes, blocks) still allocated after build(inputs), and its run time without tracing."""
+    started = time.perf_counter()
+    build(inputs)
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    tracemalloc.start()
+    result = build(inputs)
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    del result
+    stats = snapshot.statistics("filename")
+    return sum(s.size for s in stats), sum(s.count for s in stats), elapsed
+
+def raw_inputs(numbers, ranges):
+    """(range name, [(number, number_id)]) as they come out of the HTML parser."""
+    per_range = max(1, numbers // ranges)
+    return [
+        (f"RANGE {r}", [(f"2250{r:04d}{n:06d}", f"{r}{n}") for n in range(per_range)])
+        for r in range(ranges)
+    ]
+
+def tracker_dicts(inputs):
+    return {
+        range_name: {
+            number: {"number_id": number_id, "message_count": 1, "last_messages": ["Your code is 123456"],
+                     "last_digest": "0123456789abcdef", "last_seen": 1.0}
+            for number, number_id in numbers
+        }
+        for range_name, numbers in inputs
+    }
+
+def tracker_models(inputs):
+    return {
+        sys.intern(range_name): {
+            sys.intern(number): TrackedNumber(number_id, 1, ["Your code is 123456"], "0123456789abcdef", 1.0)
+            for number, number_id in numbers
+        }
+        for range_name, numbers in inputs
+    }
+
+def tick_dicts(inputs, new_per_range):
+    ranges = [{"range_name": name, "range_id": name, "count": len(nums), "paid": 0, "unpaid": 0, "revenue": 0.0}
+              for name, nums in inputs]
+    ranges_dict = {r["range_name"]: r for r in ranges}
+    numbers = [[{"number": number, "number_id": number_id} for number, number_id in nums] for _, nums in inputs]
+    sms = []
+    for (name, _), range_numbers in zip(inputs, numbers):
+        for n in range_numbers[:new_per_range]:
+            row = {"message": "Your code is 123456", "revenue": "0.01", "timestamp": "2025-01-01 00:00:00"}
+            sms.append({"timestamp": row["timestamp"], "number": n["number"], "message": row["message"],
+                        "range": name, "revenue": row["revenue"], "service": None, "otp": "123456"})
+    return ranges, ranges_dict, numbers, sms
+
+def tick_models(inputs, new_per_range):
+    ranges = [RangeStats(name, name, len(nums)) for name, nums in inputs]
+    numbers = [[NumberInfo(number, number_id) for number, number_id in nums] for _, nums in inputs]
+    sms = []
+    for (name, _), range_numbers in zip(inputs, numbers):
+        for n in range_numbers[:new_per_range]:
+            row = Message("2025-01-01 00:00:00", "Your code is 123456", "0.01")
+            sms.append(SMS(row.timestamp, n.number, row.message, name, row.revenue, otp="123456"))
+    return ranges, numbers, sms
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--numbers", type=int, default=100000)
+    parser.add_argument("--ranges", type=int, default=200)
+    parser.add_argument("--new", type=int, default=5, help="new SMS per range per tick")
+    args = parser.parse_args(argv)
+
+    print(f"{args.numbers} tracked numbers in {args.ranges} ranges")
+    print(f"{'':<22}{'MiB':>10}{'blocks':>12}{'ms':>10}")
+    inputs = raw_inputs(args.numbers, args.ranges)
+    for label, build in (
+        ("tracker (dicts)", tracker_dicts),
+        ("tracker (models)", tracker_models),
+        ("tick (dicts)", lambda i: tick_dicts(i, args.new)),
+        ("tick (models)", lambda i: tick_models(i, args.new)),
+    ):
+        size, blocks, elapsed = measure(build, inputs)
+        print(f"{label:<22}{size / 2 ** 20:>10.1f}{blocks:>12,}{elapsed * 1000:>10.0f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
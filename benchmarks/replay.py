@@ -0,0 +1,123 @@
+"""Record and replay a poll session for deterministic regression runs.
+
+record: runs the real poller against the local portal stand-in while SMS
+trickle in, writing every upstream exchange (scrubbed) to a capture file.
+replay: runs the poller against that capture instead of the network, with
+the recorded or scaled latency, and reports CPU time, upstream requests and
+the notifications sent, so two versions can be compared on identical input.
+
+    python -m benchmarks.replay record session.jsonl.gz --duration 60
+    python -m benchmarks.replay replay session.jsonl.gz --duration 60 --scale 0 --json run.json
+"""
+import argparse
+import asyncio
+import hashlib
+import importlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.harness import FakeBotAPI, FakePortal
+
+async def run_poller(duration, portal=None, sms_interval=2.0):
+    """Run main.main() for `duration` seconds, injecting an SMS every sms_interval seconds when recording."""
+    main = importlib.import_module("main")
+    poller = asyncio.create_task(main.main())
+    try:
+        deadline = time.monotonic() + duration
+        i = 0
+        while time.monotonic() < deadline and not poller.done():
+            if portal is not None:
+                portal.inject(f"REPLAY {i % 5}", f"4460000{i:05d}", f"Your verification code is {400000 + i}")
+                i += 1
+            await asyncio.sleep(sms_interval)
+    finally:
+        poller.cancel()
+        try:
+            await poller
+        except (asyncio.CancelledError, Exception):
+            pass
+
+def run_in_state_dir(coroutine):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as state_dir:
+        os.chdir(state_dir)
+        try:
+            return asyncio.run(coroutine)
+        finally:
+            os.chdir(cwd)
+
+def record(args, botapi):
+    portal = FakePortal().start()
+    os.environ.update({"IVASMS_BASE_URL": portal.base_url, "UPSTREAM_RECORD": os.path.abspath(args.capture)})
+    try:
+        run_in_state_dir(run_poller(args.duration, portal, args.sms_interval))
+    finally:
+        portal.stop()
+    print(f"recorded {sum(portal.requests.values())} upstream requests and {len(botapi.sent)} notifications to {args.capture}")
+    return 0
+
+def replay(args, botapi):
+    os.environ.update({
+        "IVASMS_BASE_URL": "http://portal.replay.invalid",
+        "UPSTREAM_REPLAY": os.path.abspath(args.capture),
+        "UPSTREAM_REPLAY_SCALE": str(args.scale),
+    })
+    cpu_started, wall_started = time.process_time(), time.perf_counter()
+    run_in_state_dir(run_poller(args.duration))
+    cpu, wall = time.process_time() - cpu_started, time.perf_counter() - wall_started
+
+    from capture import Capture
+
+    capture = Capture.for_path(os.path.abspath(args.capture))
+    requests_by_path = {}
+    for key, count in capture.served.items():
+        path = key.split(" ", 2)[1]
+        requests_by_path[path] = requests_by_path.get(path, 0) + count
+    texts = [text for _, _, text in botapi.sent]
+    result = {
+        "cpu_s": cpu,
+        "wall_s": wall,
+        "requests": sum(capture.served.values()),
+        "requests_by_path": requests_by_path,
+        "unmatched_requests": sum(capture.misses.values()),
+        "notifications": len(texts),
+        "notifications_sha256": hashlib.sha256("\n\x00".join(texts).encode("utf-8")).hexdigest(),
+        "notification_texts": texts,
+    }
+    print(f"cpu {cpu:.2f} s  wall {wall:.2f} s  requests {result['requests']} (unmatched {result['unmatched_requests']})")
+    for path, count in sorted(requests_by_path.items()):
+        print(f"  {count:>7}  {path}")
+    print(f"notifications {len(texts)}  sha256 {result['notifications_sha256'][:16]}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=4, ensure_ascii=False)
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("capture", help="capture file (gzip JSON lines)")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds to run the poller")
+    parser.add_argument("--sms-interval", type=float, default=2.0, help="seconds between injected SMS when recording")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="replay latency multiplier (1 = recorded timing, 0 = as fast as possible)")
+    parser.add_argument("--json", metavar="PATH", help="also write the replay report as JSON")
+    args = parser.parse_args(argv)
+
+    botapi = FakeBotAPI().start()
+    # The poller reads its configuration at import time
+    os.environ.update({
+        "TELEGRAM_BASE_URL": botapi.api_url,
+        "BOT_TOKEN": "123456:BENCH",
+        "CHAT_ID": "-100123456",
+    })
+    try:
+        return record(args, botapi) if args.mode == "record" else replay(args, botapi)
+    finally:
+        botapi.stop()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""Sharded range scan scaling benchmark.
+
+Fills the portal stand-in with many ranges, numbers and messages, served by
+several identical processes sharing one port so the stand-in is not the
+bottleneck, then times full scan cycles of shard pools of increasing size:
+a cold cycle (every message new, full parses) and warm cycles (incremental
+parses of unchanged pages). Reports cycle times and the speedup over one
+worker.
+
+    python -m benchmarks.shard_scaling --workers 1 2 4 8 --ranges 400 --numbers 25 --messages 10
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.harness import FakePortal
+
+# Every portal process must serve byte-identical pages
+FIXED_TIMESTAMP = "2025-01-01 12:00:00"
+
+def serve_portal(port, ranges, numbers, messages, ready, stop):
+    portal = FakePortal(port=port, reuse_port=True).start()
+    for r in range(ranges):
+        for n in range(numbers):
+            for m in range(messages):
+                portal.inject(f"SCALE {r:04d}", f"44{r:04d}{n:05d}", f"Your verification code is {100000 + m}",
+                              timestamp=FIXED_TIMESTAMP)
+    ready.put(portal.httpd.server_address[1])
+    stop.wait()
+    portal.stop()
+
+def start_portals(count, args):
+    """Start `count` portal processes on one port; returns (base_url, stop event, processes)."""
+    context = multiprocessing.get_context("spawn")
+    ready, stop = context.Queue(), context.Event()
+    processes, port = [], 0
+    for _ in range(count):
+        process = context.Process(target=serve_portal, daemon=True,
+                                  args=(port, args.ranges, args.numbers, args.messages, ready, stop))
+        process.start()
+        processes.append(process)
+        port = ready.get(timeout=600)
+    return f"http://127.0.0.1:{port}", stop, processes
+
+async def time_cycles(workers, cycles):
+    main = importlib.import_module("main")
+    from scheduler import STATISTICS
+    from shards import ShardPool
+    from transport import create_session
+
+    today = datetime.now()
+    from_date, to_date = today.strftime("%m/%d/%Y"), (today + timedelta(days=1)).strftime("%m/%d/%Y")
+    pool = ShardPool(workers)
+    await pool.start()
+    try:
+        with create_session() as session:
+            tokens = await main.upstream(STATISTICS, main.payload_1, session)
+            await main.upstream(STATISTICS, main.payload_2, session, tokens["_token"])
+            _, csrf_token = await main.upstream(STATISTICS, main.payload_3, session)
+            response = await main.upstream(STATISTICS, main.payload_4, session, csrf_token, from_date, to_date)
+            ranges = main.parse_statistics(response.text)
+
+            number_tracker = {}
+            started = time.perf_counter()
+            detected = await pool.scan(session, csrf_token, to_date, ranges, number_tracker)
+            cold = time.perf_counter() - started
+            cold_pages = pool.pages
+
+            warm = []
+            for _ in range(cycles):
+                started = time.perf_counter()
+                await pool.scan(session, csrf_token, to_date, ranges, number_tracker)
+                warm.append(time.perf_counter() - started)
+    finally:
+        pool.close()
+    return {
+        "workers": workers,
+        "ranges": len(ranges),
+        "sms": len(detected),
+        "pages_per_cycle": cold_pages,
+        "cold_s": cold,
+        "warm_s": statistics.median(warm) if warm else float("nan"),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--ranges", type=int, default=400)
+    parser.add_argument("--numbers", type=int, default=25, help="numbers per range")
+    parser.add_argument("--messages", type=int, default=10, help="messages per number")
+    parser.add_argument("--cycles", type=int, default=3, help="warm cycles timed per pool size")
+    parser.add_argument("--portal-processes", type=int, default=max(2, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--io-concurrency", type=int, default=16, help="concurrent requests per worker")
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    args = parser.parse_args(argv)
+
+    base_url, stop, processes = start_portals(args.portal_processes, args)
+    # The poller and its workers read their configuration at import time; the request budget is lifted
+    os.environ.update({
+        "IVASMS_BASE_URL": base_url,
+        "UPSTREAM_RATE": "0",
+        "UPSTREAM_CONCURRENCY": str(args.io_concurrency),
+        "UPSTREAM_POOL_MAXSIZE": str(args.io_concurrency),
+        "UPSTREAM_LIMIT_NUMBERS": str(args.io_concurrency),
+        "UPSTREAM_LIMIT_MESSAGES": str(args.io_concurrency),
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+    })
+    try:
+        results = [asyncio.run(time_cycles(workers, args.cycles)) for workers in args.workers]
+    finally:
+        stop.set()
+        for process in processes:
+            process.join(timeout=10)
+
+    base = results[0]
+    print(f"{args.ranges} ranges x {args.numbers} numbers x {args.messages} messages, "
+          f"{results[0]['pages_per_cycle']} pages per cycle, {args.portal_processes} portal processes")
+    print(f"{'workers':>8}{'cold s':>10}{'speedup':>9}{'warm s':>10}{'speedup':>9}{'pages/s':>10}")
+    for r in results:
+        r["cold_speedup"] = base["cold_s"] / r["cold_s"]
+        r["warm_speedup"] = base["warm_s"] / r["warm_s"]
+        print(f"{r['workers']:>8}{r['cold_s']:>10.2f}{r['cold_speedup']:>9.2f}{r['warm_s']:>10.2f}"
+              f"{r['warm_speedup']:>9.2f}{r['pages_per_cycle'] / r['warm_s']:>10.0f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+    return 0 if all(r["sms"] == base["sms"] for r in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+import collections
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+import time
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+# Request fields and page markup carrying credentials or session tokens
+SECRET_FIELDS = ("_token", "email", "password", "g-recaptcha-response")
+SECRET_PATTERNS = [
+    re.compile(r'(name="_token" value=")[^"]*(")'),
+    re.compile(r'(<meta name="csrf-token" content=")[^"]*(")'),
+    re.compile(r'(name="(?:_token|email|password)"\r\n\r\n)[^\r]*(\r\n)'),
+    re.compile(r'((?:^|&)(?:_token|email|password)=)[^&]*()'),
+]
+# Dates in request bodies and queries, so a capture replays on any day
+DATE_PATTERN = re.compile(r"\b\d{2}(?:/|%2F)\d{2}(?:/|%2F)\d{4}\b|\b\d{4}-\d{2}-\d{2}\b")
+# Query parameters that differ on every request (the DataTables `_` cache-buster), left out of request keys
+VOLATILE_PARAMS = ("_",)
+SCRUBBED = "scrubbed"
+
+def scrub(text):
+    """Blank tokens, credentials and the configured account details out of a request or response body."""
+    for pattern in SECRET_PATTERNS:
+        text = pattern.sub(rf"\g<1>{SCRUBBED}\g<2>", text)
+    for secret in (os.getenv("IVASMS_EMAIL"), os.getenv("IVASMS_PASSWORD")):
+        if secret:
+            text = text.replace(secret, SCRUBBED)
+            text = text.replace(urllib.parse.quote_plus(secret), SCRUBBED)
+    return text
+
+def normalise_query(query):
+    """Drop volatile parameters from a query string and normalise the dates in it."""
+    pairs = [(k, v) for k, v in urllib.parse.parse_qsl(query, keep_blank_values=True) if k not in VOLATILE_PARAMS]
+    return DATE_PATTERN.sub("<date>", urllib.parse.urlencode(pairs))
+
+def request_key(method, url, params=None, data=None):
+    """Identify a request by method, path, normalised query and scrubbed, date-normalised body."""
+    parts = urllib.parse.urlsplit(str(url))
+    query = parts.query
+    if params:
+        query += ("&" if query else "") + urllib.parse.urlencode(params)
+    query = normalise_query(query)
+    path = parts.path + (f"?{query}" if query else "")
+    if isinstance(data, dict):
+        body = "&".join(f"{k}={SCRUBBED if k in SECRET_FIELDS else v}" for k, v in data.items())
+    elif isinstance(data, bytes):
+        body = data.decode("utf-8", "replace")
+    else:
+        body = data or ""
+    return f"{method} {path} {DATE_PATTERN.sub('<date>', scrub(body))}"
+
+class CaptureWriter:
+    """Append-only gzip capture file shared by every recording session of a process.
+
+    Each exchange is one JSON line; the stream is flushed after every record
+    so a crash loses at most the exchange in flight, and reopening the file
+    appends a new gzip member.
+    """
+
+    _writers = {}
+    _writers_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.file = gzip.open(path, "ab")
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+
+    @classmethod
+    def for_path(cls, path):
+        with cls._writers_lock:
+            if path not in cls._writers:
+                cls._writers[path] = cls(path)
+            return cls._writers[path]
+
+    def write(self, record):
+        record["t"] = round(time.monotonic() - self.started, 4)
+        line = json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+class RecordingSession:
+    """Session wrapper recording every request/response pair, scrubbed, to a capture file."""
+
+    def __init__(self, session, path):
+        self.session = session
+        self.writer = CaptureWriter.for_path(path)
+
+    @property
+    def cookies(self):
+        return self.session.cookies
+
+    def _record(self, method, url, params, data, call):
+        started = time.perf_counter()
+        response = call()
+        self.writer.write({
+            "key": request_key(method, url, params, data),
+            "status": response.status_code,
+            "url": urllib.parse.urlsplit(str(response.url)).path,
+            "content_type": response.headers.get("Content-Type", ""),
+            "elapsed": round(time.perf_counter() - started, 4),
+            "text": scrub(response.text),
+        })
+        return response
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        return self._record("GET", url, params, None,
+                            lambda: self.session.get(url, headers=headers, params=params, timeout=timeout))
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        return self._record("POST", url, None, data,
+                            lambda: self.session.post(url, headers=headers, data=data, timeout=timeout))
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class ReplayHTTPError(Exception):
+    pass
+
+class ReplayResponse:
+    """The parts of a requests.Response the payloads use, rebuilt from a capture record."""
+
+    def __init__(self, record, base_url):
+        self.status_code = record["status"]
+        self.text = record["text"]
+        self.url = base_url + record["url"]
+        self.headers = {"Content-Type": record.get("content_type", "")}
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise ReplayHTTPError(f"{self.status_code} replayed for {self.url}")
+
+class Capture:
+    """Recorded exchanges grouped by request key, served back in recording order.
+
+    The last response of a key keeps being served once its recordings run
+    out, so steady-state polling can outlast the capture.
+    """
+
+    _loaded = {}
+    _loaded_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.responses = collections.defaultdict(collections.deque)
+        self.served = collections.Counter()
+        self.misses = collections.Counter()
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self.responses[record["key"]].append(record)
+        logger.info("Loaded %s recorded exchanges from %s", sum(map(len, self.responses.values())), path)
+
+    @classmethod
+    def for_path(cls, path):
+        with cls._loaded_lock:
+            if path not in cls._loaded:
+                cls._loaded[path] = cls(path)
+            return cls._loaded[path]
+
+    def next(self, key):
+        with self.lock:
+            queue = self.responses.get(key)
+            if not queue:
+                self.misses[key] += 1
+                return None
+            self.served[key] += 1
+            return queue.popleft() if len(queue) > 1 else queue[0]
+
+class ReplaySession:
+    """Session stand-in answering from a capture with the recorded (optionally scaled) latency."""
+
+    def __init__(self, path, scale=1.0):
+        self.capture = Capture.for_path(path)
+        self.scale = scale
+        self.cookies = {}
+
+    def _replay(self, method, url, params, data):
+        key = request_key(method, url, params, data)
+        record = self.capture.next(key)
+        parts = urllib.parse.urlsplit(str(url))
+        base_url = f"{parts.scheme}://{parts.netloc}"
+        if record is None:
+            logger.warning("No recorded response for %s", key[:200])
+            record = {"status": 404, "url": parts.path, "text": ""}
+        elif self.scale > 0:
+            time.sleep(record.get("elapsed", 0) * self.scale)
+        return ReplayResponse(record, base_url)
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        return self._replay("GET", url, params, None)
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        return self._replay("POST", url, None, data)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
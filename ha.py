@@ -0,0 +1,214 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+# High availability: replicas sharing a lease store, only the lease holder polls and sends ("" runs a single instance)
+# sqlite:///ha.sqlite3 (sqlite:////abs/path for an absolute path) for replicas on one host, redis://host:6379/0 otherwise
+HA_STORE = os.getenv("HA_STORE", "")
+HA_NAME = os.getenv("HA_NAME", "ivasms-bot")
+HA_REPLICA_ID = os.getenv("HA_REPLICA_ID", "") or f"{socket.gethostname()}-{os.getpid()}"
+# A crashed leader is replaced within about HA_LEASE_TTL seconds, a stopped one within HA_RENEW_INTERVAL
+HA_LEASE_TTL = float(os.getenv("HA_LEASE_TTL", "8"))
+HA_RENEW_INTERVAL = float(os.getenv("HA_RENEW_INTERVAL", "2"))
+# The leader publishes its state at least this often, and standbys refresh their copy as often
+HA_STATE_INTERVAL = float(os.getenv("HA_STATE_INTERVAL", "5"))
+
+# Take the lease if it is free, expired or already ours; 1 when held afterwards
+ACQUIRE_SCRIPT = """
+local holder = redis.call('GET', KEYS[1])
+if holder == false or holder == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+# Drop the lease only if it is still ours
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+class SqliteLeaseStore:
+    """Lease and state store in a SQLite file shared by replicas on one host.
+
+    Lease checks run in IMMEDIATE transactions, so two replicas never both
+    see the lease as free; expiry uses the host's wall clock.
+    """
+
+    def __init__(self, path, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS lease (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value BLOB NOT NULL, updated REAL NOT NULL)")
+
+    def acquire(self, owner, ttl):
+        now = time.time()
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute("SELECT owner, expires FROM lease WHERE name = ?", (self.name,)).fetchone()
+                held = row is None or row[0] == owner or row[1] <= now
+                if held:
+                    self.db.execute("INSERT OR REPLACE INTO lease (name, owner, expires) VALUES (?, ?, ?)", (self.name, owner, now + ttl))
+            finally:
+                self.db.execute("COMMIT")
+        return held
+
+    def release(self, owner):
+        with self.lock:
+            self.db.execute("DELETE FROM lease WHERE name = ? AND owner = ?", (self.name, owner))
+
+    def put(self, key, value):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO state (key, value, updated) VALUES (?, ?, ?)", (f"{self.name}:{key}", value, time.time()))
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM state WHERE key = ?", (f"{self.name}:{key}",)).fetchone()
+        return row[0] if row else None
+
+class RedisLeaseStore:
+    """Lease and state store in Redis, for replicas on different hosts (needs the redis package).
+
+    The lease is one key with a server-side expiry, taken and released by
+    scripts that check the holder, so no replica clock is involved.
+    """
+
+    def __init__(self, url, name):
+        import redis
+
+        self.name = name
+        self.client = redis.Redis.from_url(url, socket_timeout=5, socket_connect_timeout=5)
+
+    def acquire(self, owner, ttl):
+        return bool(self.client.eval(ACQUIRE_SCRIPT, 1, f"{self.name}:lease", owner, int(ttl * 1000)))
+
+    def release(self, owner):
+        self.client.eval(RELEASE_SCRIPT, 1, f"{self.name}:lease", owner)
+
+    def put(self, key, value):
+        self.client.set(f"{self.name}:state:{key}", value)
+
+    def get(self, key):
+        return self.client.get(f"{self.name}:state:{key}")
+
+def open_store(url, name=HA_NAME):
+    """Open the lease store named by an HA_STORE URL."""
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme == "sqlite":
+        return SqliteLeaseStore(parts.path[1:] or "ha.sqlite3", name)
+    if parts.scheme in ("redis", "rediss", "unix"):
+        return RedisLeaseStore(url, name)
+    raise ValueError(f"Unsupported HA_STORE: {url}")
+
+class Replica:
+    """One bot replica competing for the lease of a shared store.
+
+    A standby retries the lease every renew interval and keeps a copy of the
+    leader's last published state, so it takes over warm. The leader renews
+    the lease every renew interval and counts the lease as lost as soon as a
+    renewal is refused, or when renewals have failed for long enough that
+    the lease may have expired, measured from when the last successful
+    renewal was sent, so it stops before any standby can take over.
+    """
+
+    def __init__(self, store, replica_id=HA_REPLICA_ID, ttl=HA_LEASE_TTL, renew_interval=HA_RENEW_INTERVAL):
+        self.store = store
+        self.replica_id = replica_id
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self.valid_until = 0.0
+        self.state = None
+        self.state_fetched = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(open_store(HA_STORE))
+
+    def holds_lease(self):
+        return time.monotonic() < self.valid_until
+
+    async def _renew(self):
+        """Take or renew the lease; returns whether it is held, raising when the store cannot be reached."""
+        sent = time.monotonic()
+        held = await asyncio.to_thread(self.store.acquire, self.replica_id, self.ttl)
+        if held:
+            # A renew interval of margin, so the leader stops before a standby can see the lease expired
+            self.valid_until = sent + self.ttl - self.renew_interval
+        return held
+
+    async def acquire(self):
+        """Wait as a standby until this replica holds the lease; returns the leader's last published state."""
+        logger.info("HA replica %s waiting for the lease", self.replica_id)
+        while True:
+            try:
+                if await self._renew():
+                    break
+            except Exception as e:
+                logger.warning("HA lease store unavailable: %s", e)
+            if time.monotonic() - self.state_fetched >= HA_STATE_INTERVAL:
+                await self.refresh_state()
+            await asyncio.sleep(self.renew_interval)
+        await self.refresh_state()
+        logger.info("HA replica %s is now the leader", self.replica_id)
+        return self.state
+
+    async def keep(self):
+        """Renew the lease until it is refused or may have expired, then return."""
+        while True:
+            await asyncio.sleep(self.renew_interval)
+            try:
+                if await self._renew():
+                    continue
+            except Exception as e:
+                logger.warning("Failed to renew the HA lease: %s", e)
+                if self.holds_lease():
+                    continue
+            self.valid_until = 0.0
+            logger.warning("HA replica %s lost the lease", self.replica_id)
+            return
+
+    async def release(self):
+        self.valid_until = 0.0
+        try:
+            await asyncio.to_thread(self.store.release, self.replica_id)
+        except Exception as e:
+            logger.warning("Failed to release the HA lease: %s", e)
+
+    async def publish(self, state):
+        """Store the leader's state (gzip JSON) for the standbys."""
+        def put():
+            self.store.put("state", gzip.compress(json.dumps(state, ensure_ascii=False).encode("utf-8"), compresslevel=1))
+        try:
+            await asyncio.to_thread(put)
+        except Exception as e:
+            logger.warning("Failed to publish HA state: %s", e)
+
+    async def refresh_state(self):
+        self.state_fetched = time.monotonic()
+        try:
+            value = await asyncio.to_thread(self.store.get, "state")
+        except Exception as e:
+            logger.warning("Failed to fetch HA state: %s", e)
+            return
+        if value:
+            self.state = json.loads(gzip.decompress(value))
+
+    def take_session(self):
+        """Return the published portal session (cookies and CSRF token) once, or None."""
+        if not self.state:
+            return None
+        return self.state.pop("session", None)
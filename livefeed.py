@@ -0,0 +1,129 @@
+import asyncio
+import functools
+import logging
+import os
+import time
+from datetime import datetime
+
+from models import SMS
+from scheduler import MESSAGES, scheduler
+from transport import endpoint_timeout
+
+logger = logging.getLogger(__name__)
+
+# Live SMS feed: long-poll endpoint pushing SMS as they arrive (empty disables it)
+LIVE_FEED_URL = os.getenv("LIVE_FEED_URL", "")
+# Seconds the feed may hold a long-poll open waiting for events
+LIVE_FEED_WAIT = float(os.getenv("LIVE_FEED_WAIT", "25"))
+# Statistics are still refreshed at this interval while the feed is healthy
+LIVE_FEED_STATS_INTERVAL = float(os.getenv("LIVE_FEED_STATS_INTERVAL", "30"))
+LIVE_FEED_MAX_BACKOFF = float(os.getenv("LIVE_FEED_MAX_BACKOFF", "60"))
+
+# Accepted names of each SMS field in feed events, first match wins
+EVENT_FIELDS = {
+    "range": ("range", "range_name", "termination"),
+    "number": ("number", "recipient", "to"),
+    "message": ("message", "sms", "text"),
+    "timestamp": ("timestamp", "time", "date"),
+    "revenue": ("revenue", "payout", "paid"),
+    "sender": ("sender", "originator", "from", "cli"),
+}
+
+def event_to_sms(event):
+    """Build an SMS from one feed event, or None when it lacks a range, number or message."""
+    values = {}
+    for field, names in EVENT_FIELDS.items():
+        values[field] = next((event[name] for name in names if event.get(name) not in (None, "")), None)
+    if not (values["range"] and values["number"] and values["message"]):
+        return None
+    return SMS(
+        str(values["timestamp"] or datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+        str(values["number"]).lstrip("+"),
+        str(values["message"]),
+        str(values["range"]),
+        str(values["revenue"] or "0"),
+        sender=values["sender"],
+    )
+
+class LiveFeed:
+    """Long-poll client of the live SMS feed.
+
+    Each request asks for the events after the last cursor and is held open
+    by the feed until one arrives or `wait` seconds pass. The feed counts as
+    healthy while its polls succeed; on any failure it is marked down at
+    once, so the poller falls back to full polling, and it reconnects with
+    exponential backoff, resuming from the cursor it had. SMS pushed here
+    are recorded in the tracker of a number already tracked, so polling
+    does not count them again; the rest are deduplicated by the archive.
+
+    The first poll only fetches the current cursor and any events it
+    carries are discarded, so SMS that arrived before `connected_since` are
+    the poller's to find: it keeps polling in full until one complete pass
+    has started after the feed connected.
+    """
+
+    def __init__(self, url, wait=LIVE_FEED_WAIT):
+        self.url = url
+        self.wait = wait
+        self.cursor = None
+        self.connected = False
+        self.connected_since = None
+        self.pushed = 0
+
+    def covers(self, started):
+        """Whether the feed has been connected since monotonic time `started`."""
+        return self.connected and self.connected_since <= started
+
+    async def poll(self, session, headers):
+        """One long-poll; returns the SMS of the events received, none on the first poll."""
+        params = {"wait": self.wait}
+        first = self.cursor is None
+        if not first:
+            params["cursor"] = self.cursor
+        connect_timeout, read_timeout = endpoint_timeout("live_feed")
+        response = await scheduler.call(MESSAGES, "live_feed", functools.partial(
+            session.get, self.url, headers=headers, params=params,
+            timeout=(connect_timeout, max(read_timeout, self.wait + 10)),
+        ))
+        response.raise_for_status()
+        data = response.json()
+        self.cursor = data.get("cursor", self.cursor)
+        if first:
+            return []
+        return [sms for sms in map(event_to_sms, data.get("events") or []) if sms is not None]
+
+    async def run(self, session, headers, on_sms):
+        """Poll the feed until cancelled, handing every non-empty batch to `on_sms`."""
+        backoff = 1
+        try:
+            while True:
+                try:
+                    batch = await self.poll(session, headers)
+                except Exception as e:
+                    if self.connected:
+                        logger.warning("Live feed dropped, falling back to polling: %s", e)
+                    else:
+                        logger.debug("Live feed unavailable: %s", e)
+                    self.connected = False
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, LIVE_FEED_MAX_BACKOFF)
+                    continue
+                if not self.connected:
+                    logger.info("Live feed connected at cursor %s", self.cursor)
+                    self.connected = True
+                    self.connected_since = time.monotonic()
+                backoff = 1
+                if batch:
+                    self.pushed += len(batch)
+                    try:
+                        await on_sms(batch)
+                    except Exception as e:
+                        logger.error("Failed to ingest %s live feed SMS: %s", len(batch), e)
+        finally:
+            self.connected = False
+
+    async def wait_until_down(self, timeout, step=0.5):
+        """Sleep up to `timeout` seconds, returning early once the feed drops."""
+        deadline = time.monotonic() + timeout
+        while self.connected and time.monotonic() < deadline:
+            await asyncio.sleep(min(step, max(0, deadline - time.monotonic())))
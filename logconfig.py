@@ -0,0 +1,115 @@
+import atexit
+import copy
+import dataclasses
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+
+# Logging settings
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_RATE_LIMIT_WINDOW = float(os.getenv("LOG_RATE_LIMIT_WINDOW", "60"))
+LOG_RATE_LIMIT_BURST = int(os.getenv("LOG_RATE_LIMIT_BURST", "5"))
+
+# Structured fields passed through `extra=` on hot-path records
+CONTEXT_FIELDS = ("cycle", "range", "number", "phase")
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line, including context fields."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    """The classic text format, noting how many identical records were suppressed."""
+
+    def __init__(self):
+        super().__init__('%(asctime)s - %(levelname)s - %(message)s')
+
+    def format(self, record):
+        text = super().format(record)
+        if getattr(record, "suppressed", 0):
+            text += f" (suppressed {record.suppressed} identical messages)"
+        return text
+
+class RateLimitFilter(logging.Filter):
+    """Let at most `burst` identical records through per `window` seconds.
+
+    Records are identical when logger, level and message template match;
+    arguments are left out, so repeats of one error count together whatever
+    exception object or values they carry, and nothing is rendered on the
+    calling thread. The number suppressed since the last one let through is
+    attached to the next record as `suppressed`.
+    """
+
+    def __init__(self, window, burst):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self.seen = {}
+
+    def filter(self, record):
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        window_start, count, suppressed = self.seen.get(key, (now, 0, 0))
+        if now - window_start >= self.window:
+            window_start, count = now, 0
+        if count >= self.burst:
+            self.seen[key] = (window_start, count, suppressed + 1)
+            return False
+        record.suppressed = suppressed
+        self.seen[key] = (window_start, count + 1, 0)
+        if len(self.seen) > 10000:
+            self.seen = {k: v for k, v in self.seen.items() if now - v[0] < self.window}
+        return True
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves message rendering, formatting and I/O to the listener thread.
+
+    Record arguments (SMS, tracker entries) may change after the call, so
+    they are shallow-copied here; their fields are immutable values.
+    """
+
+    def prepare(self, record):
+        if isinstance(record.args, tuple):
+            record.args = tuple(copy.copy(arg) if dataclasses.is_dataclass(arg) else arg for arg in record.args)
+        return record
+
+def setup_logging():
+    """Route all logging through a queue so callers only enqueue records.
+
+    A background QueueListener formats (text or JSON, per LOG_FORMAT) and
+    writes the records. Returns the listener; it is stopped at exit.
+    """
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+
+    queue_handler = DeferredQueueHandler(log_queue)
+    if LOG_RATE_LIMIT_BURST > 0:
+        queue_handler.addFilter(RateLimitFilter(LOG_RATE_LIMIT_WINDOW, LOG_RATE_LIMIT_BURST))
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,123 @@
+import asyncio
+import bisect
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+# Event-loop lag watchdog (a threshold of 0 disables it)
+WATCHDOG_INTERVAL = float(os.getenv("WATCHDOG_INTERVAL", "0.1"))
+WATCHDOG_THRESHOLD = float(os.getenv("WATCHDOG_THRESHOLD", "0.25"))
+WATCHDOG_REPORT_INTERVAL = float(os.getenv("WATCHDOG_REPORT_INTERVAL", "300"))
+
+# Upper bounds of the lag histogram buckets, in milliseconds (the last bucket is open-ended)
+LAG_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+class LoopWatchdog:
+    """Measures event-loop scheduling lag and reports what blocks the loop.
+
+    A task sleeps `interval` in a loop and records how late it wakes up in a
+    fixed-bucket histogram. It also leaves a heartbeat that a daemon thread
+    checks; once the loop has missed it by more than `threshold`, the thread
+    logs the loop thread's current stack together with the cycle phase, while
+    the blocking call is still running. One task wake-up and one thread
+    wake-up per interval keep it cheap enough to stay on.
+    """
+
+    def __init__(self, interval, threshold):
+        self.interval = interval
+        self.threshold = threshold
+        self.histogram = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.phase = "startup"
+        self.cycle = None
+        self.phase_started = time.perf_counter()
+        self.phase_seconds = {}
+        self.phase_counts = {}
+        self.heartbeat = time.monotonic()
+        self.loop_thread_id = None
+        self.stopped = threading.Event()
+
+    def set_phase(self, phase, cycle=None):
+        """Record what the poller is doing, for blocked-loop reports and per-phase timings."""
+        now = time.perf_counter()
+        self.phase_seconds[self.phase] = self.phase_seconds.get(self.phase, 0.0) + now - self.phase_started
+        self.phase_counts[self.phase] = self.phase_counts.get(self.phase, 0) + 1
+        self.phase_started = now
+        self.phase = phase
+        if cycle is not None:
+            self.cycle = cycle
+
+    def phase_timings(self):
+        """Return {phase: {"seconds", "count"}}: time spent in each phase so far and how often it was entered."""
+        seconds = dict(self.phase_seconds)
+        seconds[self.phase] = seconds.get(self.phase, 0.0) + time.perf_counter() - self.phase_started
+        return {
+            phase: {"seconds": total, "count": self.phase_counts.get(phase, 0) + (phase == self.phase)}
+            for phase, total in seconds.items()
+        }
+
+    def record(self, lag):
+        self.histogram[bisect.bisect_left(LAG_BUCKETS_MS, lag * 1000)] += 1
+        self.max_lag = max(self.max_lag, lag)
+
+    async def run(self, report_interval=WATCHDOG_REPORT_INTERVAL):
+        self.loop_thread_id = threading.get_ident()
+        self.stopped.clear()
+        threading.Thread(target=self._monitor, name="loop-watchdog", daemon=True).start()
+        last_report = time.monotonic()
+        try:
+            while True:
+                self.heartbeat = time.monotonic()
+                await asyncio.sleep(self.interval)
+                self.record(max(0.0, time.monotonic() - self.heartbeat - self.interval))
+                if report_interval and time.monotonic() - last_report >= report_interval:
+                    last_report = time.monotonic()
+                    logger.info("Event loop lag: %s", self.summary(), extra={"cycle": self.cycle})
+        finally:
+            self.stopped.set()
+
+    def _monitor(self):
+        reported = None
+        while not self.stopped.wait(self.threshold / 2):
+            heartbeat = self.heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked < self.threshold or reported == heartbeat:
+                continue
+            reported = heartbeat
+            self.stalls += 1
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "(stack unavailable)\n"
+            logger.warning(
+                "Event loop blocked for over %.0f ms during %s:\n%s", blocked * 1000, self.phase, stack.rstrip(),
+                extra={"phase": self.phase, "cycle": self.cycle},
+            )
+
+    def percentile(self, fraction):
+        """Upper bound (ms) of the bucket holding the given fraction of samples."""
+        total = sum(self.histogram)
+        if not total:
+            return 0
+        seen = 0
+        for i, count in enumerate(self.histogram):
+            seen += count
+            if seen >= total * fraction:
+                return LAG_BUCKETS_MS[i] if i < len(LAG_BUCKETS_MS) else float("inf")
+
+    def summary(self):
+        buckets = " ".join(
+            f"<{bound}ms={count}" for bound, count in zip(LAG_BUCKETS_MS, self.histogram) if count
+        )
+        if self.histogram[-1]:
+            buckets += f" >={LAG_BUCKETS_MS[-1]}ms={self.histogram[-1]}"
+        return (
+            f"p50<={self.percentile(0.5)}ms p99<={self.percentile(0.99)}ms max={self.max_lag * 1000:.0f}ms "
+            f"stalls={self.stalls} [{buckets}]"
+        )
+
+watchdog = LoopWatchdog(WATCHDOG_INTERVAL, WATCHDOG_THRESHOLD)
@@ -1,26 +1,102 @@
-import requests
+import time
+
+# Process start reference for the startup timing report
+_IMPORT_STARTED = time.perf_counter()
+
 import re
 import json
-import time
+import argparse
 import logging
 from datetime import datetime, timedelta
-from bs4 import BeautifulSoup
 import os
-from telegram import Bot
-from telegram.ext import Application, CommandHandler, ConversationHandler, MessageHandler, filters
 import asyncio
+import collections
+import functools
+import hashlib
+import math
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from html.parser import HTMLParser
 import urllib.parse
+from archive import Archive
+from ha import HA_STATE_INTERVAL, HA_STORE, Replica
+from livefeed import LIVE_FEED_STATS_INTERVAL, LIVE_FEED_URL, LiveFeed
+from logconfig import setup_logging
+from looplag import WATCHDOG_THRESHOLD, watchdog
+from models import SMS, Message, NumberInfo, RangeStats, TrackedNumber, dump_tracker, from_dict, load_tracker, to_dict
+from otp import extract_code, extract_otps
+from outbox import Outbox
+from routing import load_router
+from scheduler import COMMANDS, HOUSEKEEPING, MESSAGES, STATISTICS, scheduler
+from shards import SHARD_WORKERS, ShardPool
+from timeseries import RangeMetrics
+from transport import create_session, endpoint_timeout
 
-# Set up logging with a corrected format
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
+# Upstream endpoints (overridable to point the bot at local stand-ins)
+PORTAL_URL = os.getenv("IVASMS_BASE_URL", "https://www.ivasms.com").rstrip("/")
+TELEGRAM_BASE_URL = os.getenv("TELEGRAM_BASE_URL", "https://api.telegram.org/bot")
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", "2"))
+
+# Telegram webhook mode (enabled when TELEGRAM_WEBHOOK_URL is set, otherwise long polling)
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL", "")
+TELEGRAM_WEBHOOK_LISTEN = os.getenv("TELEGRAM_WEBHOOK_LISTEN", "0.0.0.0")
+TELEGRAM_WEBHOOK_PORT = int(os.getenv("TELEGRAM_WEBHOOK_PORT", os.getenv("PORT", "8443")))
+TELEGRAM_WEBHOOK_PATH = os.getenv("TELEGRAM_WEBHOOK_PATH", "telegram").strip("/")
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET") or None
+TELEGRAM_WEBHOOK_MAX_CONNECTIONS = int(os.getenv("TELEGRAM_WEBHOOK_MAX_CONNECTIONS", "40"))
+INCREMENTAL_PARSE = os.getenv("INCREMENTAL_PARSE", "1") == "1"
+# Newest message texts kept per tracked number in memory and in number_tracker.json
+MAX_LAST_MESSAGES = int(os.getenv("MAX_LAST_MESSAGES", "10"))
+
+# Local state files
+STATISTICS_FILE = "sms_statistics.json"
+NUMBER_TRACKER_FILE = "number_tracker.json"
+
+# Durable notification outbox
+OUTBOX_FILE = os.getenv("OUTBOX_FILE", "outbox.sqlite3")
+# Failed sends are retried with backoff up to OUTBOX_RETRY_MAX seconds apart, and given up after OUTBOX_GIVE_UP_HOURS
+OUTBOX_RETRY_MAX = float(os.getenv("OUTBOX_RETRY_MAX", "300"))
+OUTBOX_GIVE_UP_HOURS = float(os.getenv("OUTBOX_GIVE_UP_HOURS", "24"))
+OUTBOX_RETENTION_DAYS = float(os.getenv("OUTBOX_RETENTION_DAYS", "7"))
+
+# Searchable SMS archive
+ARCHIVE_FILE = os.getenv("ARCHIVE_FILE", "sms_archive.sqlite3")
+ARCHIVE_RETENTION_DAYS = float(os.getenv("ARCHIVE_RETENTION_DAYS", "90"))
+SEARCH_RESULTS = int(os.getenv("SEARCH_RESULTS", "10"))
+
+# Background refresh cadence of the /active read model, in seconds
+ACTIVE_REFRESH_INTERVAL = float(os.getenv("ACTIVE_REFRESH_INTERVAL", "300"))
+
+# How often the upstream scheduler's queue-wait metrics are logged, in seconds
+UPSTREAM_REPORT_INTERVAL = float(os.getenv("UPSTREAM_REPORT_INTERVAL", "300"))
+
+# Routing rules fanning SMS out to chats (everything goes to CHAT_ID without them)
+ROUTES_FILE = os.getenv("ROUTES_FILE", "routes.json")
+
+# HTML parsing offload: pages above the threshold are parsed in a worker pool (0 workers = inline)
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "0"))
+PARSE_EXECUTOR = os.getenv("PARSE_EXECUTOR", "").lower()
+PARSE_INLINE_THRESHOLD = int(os.getenv("PARSE_INLINE_THRESHOLD", "65536"))
+
+# /check pagination
+CHECK_PAGE_SIZE = int(os.getenv("CHECK_PAGE_SIZE", "100"))
+CHECK_MAX_PAGES = int(os.getenv("CHECK_MAX_PAGES", "20"))
+CHECK_CONCURRENCY = int(os.getenv("CHECK_CONCURRENCY", "4"))
+CHECK_EDIT_INTERVAL = float(os.getenv("CHECK_EDIT_INTERVAL", "1.0"))
+
+# Number return batching and the optional automatic return policy ("otp" or "idle")
+RETURN_BATCH_SIZE = int(os.getenv("RETURN_BATCH_SIZE", "100"))
+RETURN_CONCURRENCY = int(os.getenv("RETURN_CONCURRENCY", "4"))
+AUTO_RETURN = os.getenv("AUTO_RETURN", "").lower()
+AUTO_RETURN_IDLE_HOURS = float(os.getenv("AUTO_RETURN_IDLE_HOURS", "6"))
+AUTO_RETURN_INTERVAL = float(os.getenv("AUTO_RETURN_INTERVAL", "600"))
+
 # Common headers
 BASE_HEADERS = {
-    "Host": "www.ivasms.com",
+    "Host": urllib.parse.urlparse(PORTAL_URL).netloc,
     "Cache-Control": "max-age=0",
     "Sec-Ch-Ua": '"Not)A;Brand";v="8", "Chromium";v="138"',
     "Sec-Ch-Ua-Mobile": "?0",
@@ -41,78 +117,163 @@ BASE_HEADERS = {
 # Conversation states for /check command
 SENDER_ID = 0
 
-async def send_to_telegram(sms):
-    """Send SMS details to Telegram group with copiable number."""
-    bot = Bot(token=os.getenv("8250313433:AAGMZs2By7gC2AR9rIzs1GHAbE-H63nHekE"))
+# Startup phase durations in seconds, reported once the first poll completes
+STARTUP_TIMINGS = {}
+
+# The poll loop and the live feed both deliver; one outbox pass runs at a time ((loop, lock), one per event loop)
+_delivery_lock = None
+
+def delivery_lock():
+    """Return the delivery lock of the running event loop, creating it on first use."""
+    global _delivery_lock
+    loop = asyncio.get_running_loop()
+    if _delivery_lock is None or _delivery_lock[0] is not loop:
+        _delivery_lock = (loop, asyncio.Lock())
+    return _delivery_lock[1]
+
+# Recently ingested SMS, handed to the next HA leader so it does not notify them again
+recent_sms = collections.deque(maxlen=int(os.getenv("HA_RECENT_SMS", "1000")))
+
+async def send_to_telegram(bot, sms):
+    """Send SMS details to Telegram group with copiable number and OTP code; returns True once sent."""
     message = (
         "📨 *New SMS Received*\n\n"
-        f"📞 *Number*: `+{sms['number']}`\n"
-        f"🌐 *Range*: `{sms['range']}`\n"
-        f"💬 *Message*: {sms['message']}\n"
-        f"🕒 *Time*: {sms['timestamp']}\n"
+        f"📞 *Number*: `+{sms.number}`\n"
+        f"🌐 *Range*: `{sms.range}`\n"
+        f"💬 *Message*: {sms.message}\n"
+        f"🕒 *Time*: {sms.timestamp}\n"
     )
+    if sms.otp:
+        message += f"🔑 *Code*: `{sms.otp}`\n"
+    if sms.service:
+        message += f"🏷 *Service*: {sms.service}\n"
 
     try:
-        await bot.send_message(chat_id=os.getenv("-1003377700516"), text=message, parse_mode="Markdown")
-        logger.info(f"Sent SMS to Telegram: {sms['-1003377700516'][:50]}...")
+        await bot.send_message(chat_id=sms.chat_id or os.getenv("CHAT_ID"), text=message, parse_mode="Markdown")
+        logger.info("Sent SMS to Telegram: %s...", sms.message[:50], extra={"range": sms.range, "number": sms.number})
+        return True
     except Exception as e:
-        logger.error(f"Failed to send to Telegram: {str(e)}")
+        logger.error("Failed to send to Telegram: %s", e, extra={"range": sms.range, "number": sms.number})
+        return False
+
+async def deliver_pending(bot, outbox):
+    """Send every outbox entry due for delivery, recording each chat's outcomes in one commit.
+
+    Chats are served in parallel; messages to the same chat keep their order.
+    A chat's outcomes are recorded when its sends end, even when the pass is
+    cancelled, so only a crash mid-pass makes that chat's messages go out again.
+    """
+    async with delivery_lock():
+        by_chat = {}
+        for key, sms in await asyncio.to_thread(outbox.pending):
+            by_chat.setdefault(sms.chat_id, []).append((key, sms))
+        delivered = 0
+
+        async def deliver_to_chat(entries):
+            nonlocal delivered
+            sent, failed = [], []
+            try:
+                for key, sms in entries:
+                    (sent if await send_to_telegram(bot, sms) else failed).append(key)
+            finally:
+                delivered += len(sent)
+                await asyncio.to_thread(outbox.mark, sent, failed)
+
+        await asyncio.gather(*(deliver_to_chat(entries) for entries in by_chat.values()))
+        return delivered
+
+async def ingest_sms(sms_batch, archive, router, outbox, bot):
+    """Extract OTP codes, record the SMS not archived yet in the outbox, archive the batch, then deliver."""
+    if sms_batch:
+        extract_otps(sms_batch)
+        # SMS already archived (pushed by the live feed, backfilled or seen before a state loss) are not notified again;
+        # archive and outbox reads and writes are SQLite work, so they run in a worker thread
+        new_sms = await asyncio.to_thread(archive.unarchived, sms_batch)
+        await asyncio.to_thread(outbox.add, router.fan_out(new_sms))
+        await asyncio.to_thread(archive.append, sms_batch)
+        recent_sms.extend(sms_batch)
+    if bot is None:
+        # Running without Telegram: the outbox keeps them for the next run that has a bot
+        return 0
+    return await deliver_pending(bot, outbox)
+
+async def ingest_pushed_sms(sms_batch, number_tracker, shard_pool=None, **ingest):
+    """Ingest SMS pushed by the live feed, recording them in the tracker of their numbers.
+
+    A tracked number's entry counts the pushed SMS as the poller would, so
+    the next full poll finds nothing new on its page. Untracked numbers are
+    left for that poll to pick up with their earlier SMS; the archive keeps
+    the pushed ones from being notified twice.
+    """
+    now = time.time()
+    for sms in sms_batch:
+        logger.info("Pushed SMS: %s", sms, extra={"range": sms.range, "number": sms.number})
+        tracker_entry = number_tracker.get(sms.range, {}).get(sms.number)
+        if tracker_entry is not None:
+            tracker_entry.message_count += 1
+            tracker_entry.last_messages = ([sms.message] + tracker_entry.last_messages)[:MAX_LAST_MESSAGES]
+            tracker_entry.last_digest = message_digest(sms)
+            tracker_entry.last_seen = now
+    if shard_pool is not None:
+        # Workers hold their own copy of the tracker state, so hand them the updated one
+        shard_pool.invalidate({sms.range for sms in sms_batch})
+    await ingest_sms(sms_batch, **ingest)
 
 def payload_1(session):
     """Send GET request to /login to retrieve initial tokens."""
-    url = "https://www.ivasms.com/login"
+    url = f"{PORTAL_URL}/login"
     headers = BASE_HEADERS.copy()
     try:
-        response = session.get(url, headers=headers, timeout=30)
+        response = session.get(url, headers=headers, timeout=endpoint_timeout("login"))
         response.raise_for_status()
         token_match = re.search(r'<input type="hidden" name="_token" value="([^"]+)"', response.text)
         if not token_match:
             raise ValueError("Could not find _token in response")
         return {"_token": token_match.group(1)}
     except Exception as e:
-        logger.error(f"Payload 1 failed: {str(e)}")
+        logger.error("Payload 1 failed: %s", e)
         raise
 
 def payload_2(session, _token):
     """Send POST request to /login with credentials."""
-    url = "https://www.ivasms.com/login"
+    url = f"{PORTAL_URL}/login"
     headers = BASE_HEADERS.copy()
     headers.update({
         "Content-Type": "application/x-www-form-urlencoded",
         "Sec-Fetch-Site": "same-origin",
-        "Referer": "https://www.ivasms.com/login"
+        "Referer": f"{PORTAL_URL}/login"
     })
     
     data = {
         "_token": _token,
-        "email": os.getenv("abdullahalgeria@mailbox.in.ua"),
-        "password": os.getenv("@Abdullah1&"),
+        "email": os.getenv("IVASMS_EMAIL"),
+        "password": os.getenv("IVASMS_PASSWORD"),
         "remember": "on",
         "g-recaptcha-response": "",
         "submit": "Login"
     }
     
     try:
-        response = session.post(url, headers=headers, data=data, timeout=30)
+        response = session.post(url, headers=headers, data=data, timeout=endpoint_timeout("login"))
         response.raise_for_status()
-        if response.url.endswith("/login"):
+        if str(response.url).endswith("/login"):
             raise ValueError("Login failed, redirected back to /login")
         return response
     except Exception as e:
-        logger.error(f"Payload 2 failed: {str(e)}")
+        logger.error("Payload 2 failed: %s", e)
         raise
 
 def payload_3(session):
     """Send GET request to /sms/received to get statistics page."""
-    url = "https://www.ivasms.com/portal/sms/received"
+    url = f"{PORTAL_URL}/portal/sms/received"
     headers = BASE_HEADERS.copy()
     headers.update({
         "Sec-Fetch-Site": "same-origin",
-        "Referer": "https://www.ivasms.com/portal"
+        "Referer": f"{PORTAL_URL}/portal"
     })
     
     try:
-        response = session.get(url, headers=headers, timeout=30)
+        response = session.get(url, headers=headers, timeout=endpoint_timeout("login"))
         response.raise_for_status()
         token_match = re.search(r'<meta name="csrf-token" content="([^"]+)"', response.text)
         if not token_match:
@@ -120,12 +281,12 @@ def payload_3(session):
             return response, ""
         return response, token_match.group(1)
     except Exception as e:
-        logger.error(f"Payload 3 failed: {str(e)}")
+        logger.error("Payload 3 failed: %s", e)
         raise
 
 def payload_4(session, csrf_token, from_date, to_date):
     """Send POST request to /sms/received/getsms to fetch SMS statistics."""
-    url = "https://www.ivasms.com/portal/sms/received/getsms"
+    url = f"{PORTAL_URL}/portal/sms/received/getsms"
     headers = BASE_HEADERS.copy()
     headers.update({
         "Content-Type": "multipart/form-data; boundary=----WebKitFormBoundaryhkp0qMozYkZV6Ham",
@@ -133,8 +294,8 @@ def payload_4(session, csrf_token, from_date, to_date):
         "Sec-Fetch-Site": "same-origin",
         "Sec-Fetch-Mode": "cors",
         "Sec-Fetch-Dest": "empty",
-        "Referer": "https://www.ivasms.com/portal/sms/received",
-        "Origin": "https://www.ivasms.com"
+        "Referer": f"{PORTAL_URL}/portal/sms/received",
+        "Origin": PORTAL_URL
     })
     
     data = (
@@ -154,16 +315,16 @@ def payload_4(session, csrf_token, from_date, to_date):
     )
     
     try:
-        response = session.post(url, headers=headers, data=data, timeout=30)
+        response = session.post(url, headers=headers, data=data, timeout=endpoint_timeout("statistics"))
         response.raise_for_status()
         return response
     except Exception as e:
-        logger.error(f"Payload 4 failed: {str(e)}")
+        logger.error("Payload 4 failed: %s", e)
         raise
 
-def payload_5(session, csrf_token, to_date, range_name):
+def payload_5(session, csrf_token, to_date, range_name, from_date=""):
     """Send POST request to /sms/received/getsms/number to get numbers for a range."""
-    url = "https://www.ivasms.com/portal/sms/received/getsms/number"
+    url = f"{PORTAL_URL}/portal/sms/received/getsms/number"
     headers = BASE_HEADERS.copy()
     headers.update({
         "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
@@ -171,28 +332,28 @@ def payload_5(session, csrf_token, to_date, range_name):
         "Sec-Fetch-Site": "same-origin",
         "Sec-Fetch-Mode": "cors",
         "Sec-Fetch-Dest": "empty",
-        "Referer": "https://www.ivasms.com/portal/sms/received",
-        "Origin": "https://www.ivasms.com"
+        "Referer": f"{PORTAL_URL}/portal/sms/received",
+        "Origin": PORTAL_URL
     })
     
     data = {
         "_token": csrf_token,
-        "start": "",
+        "start": from_date,
         "end": to_date,
         "range": range_name
     }
     
     try:
-        response = session.post(url, headers=headers, data=data, timeout=30)
+        response = session.post(url, headers=headers, data=data, timeout=endpoint_timeout("numbers"))
         response.raise_for_status()
         return response
     except Exception as e:
-        logger.error(f"Payload 5 failed: {str(e)}")
+        logger.error("Payload 5 failed: %s", e, extra={"range": range_name})
         raise
 
-def payload_6(session, csrf_token, to_date, number, range_name):
+def payload_6(session, csrf_token, to_date, number, range_name, from_date=""):
     """Send POST request to /sms/received/getsms/number/sms to get message details."""
-    url = "https://www.ivasms.com/portal/sms/received/getsms/number/sms"
+    url = f"{PORTAL_URL}/portal/sms/received/getsms/number/sms"
     headers = BASE_HEADERS.copy()
     headers.update({
         "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
@@ -200,29 +361,29 @@ def payload_6(session, csrf_token, to_date, number, range_name):
         "Sec-Fetch-Site": "same-origin",
         "Sec-Fetch-Mode": "cors",
         "Sec-Fetch-Dest": "empty",
-        "Referer": "https://www.ivasms.com/portal/sms/received",
-        "Origin": "https://www.ivasms.com"
+        "Referer": f"{PORTAL_URL}/portal/sms/received",
+        "Origin": PORTAL_URL
     })
     
     data = {
         "_token": csrf_token,
-        "start": "",
+        "start": from_date,
         "end": to_date,
         "Number": number,
         "Range": range_name
     }
     
     try:
-        response = session.post(url, headers=headers, data=data, timeout=30)
+        response = session.post(url, headers=headers, data=data, timeout=endpoint_timeout("messages"))
         response.raise_for_status()
         return response
     except Exception as e:
-        logger.error(f"Payload 6 failed: {str(e)}")
+        logger.error("Payload 6 failed: %s", e, extra={"range": range_name, "number": number})
         raise
 
-def payload_7(session, app):
-    """Send GET request to /portal/sms/test/sms to get available ranges."""
-    url = f"https://www.ivasms.com/portal/sms/test/sms?app={urllib.parse.quote(app)}&draw=1&columns%5B0%5D%5Bdata%5D=range&columns%5B0%5D%5Borderable%5D=false&columns%5B1%5D%5Bdata%5D=termination.test_number&columns%5B1%5D%5Bsearchable%5D=false&columns%5B1%5D%5Borderable%5D=false&columns%5B2%5D%5Bdata%5D=originator&columns%5B2%5D%5Borderable%5D=false&columns%5B3%5D%5Bdata%5D=messagedata&columns%5B3%5D%5Borderable%5D=false&columns%5B4%5D%5Bdata%5D=senttime&columns%5B4%5D%5Bsearchable%5D=false&order%5B0%5D%5Bcolumn%5D=4&order%5B0%5D%5Bdir%5D=desc&start=0&length=25&search%5Bvalue%5D=&_={int(time.time() * 1000)}"
+def payload_7(session, app, start=0, length=25):
+    """Send GET request to /portal/sms/test/sms to get one DataTables page of available ranges."""
+    url = f"{PORTAL_URL}/portal/sms/test/sms?app={urllib.parse.quote(app)}&draw=1&columns%5B0%5D%5Bdata%5D=range&columns%5B0%5D%5Borderable%5D=false&columns%5B1%5D%5Bdata%5D=termination.test_number&columns%5B1%5D%5Bsearchable%5D=false&columns%5B1%5D%5Borderable%5D=false&columns%5B2%5D%5Bdata%5D=originator&columns%5B2%5D%5Borderable%5D=false&columns%5B3%5D%5Bdata%5D=messagedata&columns%5B3%5D%5Borderable%5D=false&columns%5B4%5D%5Bdata%5D=senttime&columns%5B4%5D%5Bsearchable%5D=false&order%5B0%5D%5Bcolumn%5D=4&order%5B0%5D%5Bdir%5D=desc&start={start}&length={length}&search%5Bvalue%5D=&_={int(time.time() * 1000)}"
     headers = BASE_HEADERS.copy()
     headers.update({
         "X-Requested-With": "XMLHttpRequest",
@@ -230,20 +391,20 @@ def payload_7(session, app):
         "Sec-Fetch-Site": "same-origin",
         "Sec-Fetch-Mode": "cors",
         "Sec-Fetch-Dest": "empty",
-        "Referer": f"https://www.ivasms.com/portal/sms/test/sms?app={urllib.parse.quote(app)}"
+        "Referer": f"{PORTAL_URL}/portal/sms/test/sms?app={urllib.parse.quote(app)}"
     })
     
     try:
-        response = session.get(url, headers=headers, timeout=30)
+        response = session.get(url, headers=headers, timeout=endpoint_timeout("test_sms"))
         response.raise_for_status()
         return response.json()
     except Exception as e:
-        logger.error(f"Payload 7 failed for app {app}: {str(e)}")
+        logger.error("Payload 7 failed for app %s: %s", app, e)
         raise
 
 def payload_8(session, csrf_token, number_ids):
     """Send POST request to /portal/numbers/return/number/bluck to delete specific numbers."""
-    url = "https://www.ivasms.com/portal/numbers/return/number/bluck"
+    url = f"{PORTAL_URL}/portal/numbers/return/number/bluck"
     headers = BASE_HEADERS.copy()
     headers.update({
         "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
@@ -253,23 +414,23 @@ def payload_8(session, csrf_token, number_ids):
         "Sec-Fetch-Site": "same-origin",
         "Sec-Fetch-Mode": "cors",
         "Sec-Fetch-Dest": "empty",
-        "Referer": "https://www.ivasms.com/portal/numbers",
-        "Origin": "https://www.ivasms.com"
+        "Referer": f"{PORTAL_URL}/portal/numbers",
+        "Origin": PORTAL_URL
     })
     
     data = {"NumberID[]": number_ids}
     
     try:
-        response = session.post(url, headers=headers, data=data, timeout=30)
+        response = session.post(url, headers=headers, data=data, timeout=endpoint_timeout("return"))
         response.raise_for_status()
         return response.json()
     except Exception as e:
-        logger.error(f"Payload 8 failed: {str(e)}")
+        logger.error("Payload 8 failed: %s", e)
         raise
 
 def payload_9(session, csrf_token):
     """Send POST request to /portal/numbers/return/allnumber/bluck to delete all numbers."""
-    url = "https://www.ivasms.com/portal/numbers/return/allnumber/bluck"
+    url = f"{PORTAL_URL}/portal/numbers/return/allnumber/bluck"
     headers = BASE_HEADERS.copy()
     headers.update({
         "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
@@ -279,39 +440,59 @@ def payload_9(session, csrf_token):
         "Sec-Fetch-Site": "same-origin",
         "Sec-Fetch-Mode": "cors",
         "Sec-Fetch-Dest": "empty",
-        "Referer": "https://www.ivasms.com/portal/numbers",
-        "Origin": "https://www.ivasms.com"
+        "Referer": f"{PORTAL_URL}/portal/numbers",
+        "Origin": PORTAL_URL
     })
     
     try:
-        response = session.post(url, headers=headers, data={}, timeout=30)
+        response = session.post(url, headers=headers, data={}, timeout=endpoint_timeout("return"))
         response.raise_for_status()
         return response.json()
     except Exception as e:
-        logger.error(f"Payload 9 failed: {str(e)}")
+        logger.error("Payload 9 failed: %s", e)
         raise
 
 def payload_active(session):
     """Send GET request to /portal/live/my_sms to get active SMS data."""
-    url = "https://www.ivasms.com/portal/live/my_sms"
+    url = f"{PORTAL_URL}/portal/live/my_sms"
     headers = BASE_HEADERS.copy()
     headers.update({
         "Sec-Fetch-Site": "same-origin",
         "Sec-Fetch-Mode": "navigate",
         "Sec-Fetch-Dest": "document",
-        "Referer": "https://www.ivasms.com/portal"
+        "Referer": f"{PORTAL_URL}/portal"
     })
     
     try:
-        response = session.get(url, headers=headers, timeout=30)
+        response = session.get(url, headers=headers, timeout=endpoint_timeout("active"))
         response.raise_for_status()
         return response
     except Exception as e:
-        logger.error(f"Payload active failed: {str(e)}")
+        logger.error("Payload active failed: %s", e)
         raise
 
+# Scheduler endpoint class of every payload (see scheduler.ENDPOINT_LIMITS)
+PAYLOAD_ENDPOINTS = {
+    "payload_1": "login",
+    "payload_2": "login",
+    "payload_3": "login",
+    "payload_4": "statistics",
+    "payload_5": "numbers",
+    "payload_6": "messages",
+    "payload_7": "test_sms",
+    "payload_8": "return",
+    "payload_9": "return",
+    "payload_active": "active",
+}
+
+async def upstream(priority, payload, *args):
+    """Run a payload_* call in a worker thread once the upstream scheduler admits it."""
+    return await scheduler.call(priority, PAYLOAD_ENDPOINTS[payload.__name__], payload, *args)
+
 def parse_statistics(response_text):
     """Parse SMS statistics from response and return range data."""
+    from bs4 import BeautifulSoup
+
     try:
         soup = BeautifulSoup(response_text, 'html.parser')
         ranges = []
@@ -338,28 +519,23 @@ def parse_statistics(response_text):
                     unpaid = int(unpaid_text) if unpaid_text else 0
                     revenue = float(revenue_text) if revenue_text else 0.0
                 except ValueError as e:
-                    logger.warning(f"Error parsing values for {range_name}: {str(e)}")
+                    logger.warning("Error parsing values for %s: %s", range_name, e)
                     count, paid, unpaid, revenue = 0, 0, 0, 0.0
                 
                 onclick = card.get('onclick', '')
                 range_id_match = re.search(r"getDetials\('([^']+)'\)", onclick)
                 range_id = range_id_match.group(1) if range_id_match else range_name
                 
-                ranges.append({
-                    "range_name": range_name,
-                    "range_id": range_id,
-                    "count": count,
-                    "paid": paid,
-                    "unpaid": unpaid,
-                    "revenue": revenue
-                })
+                ranges.append(RangeStats(range_name, range_id, count, paid, unpaid, revenue))
         return ranges
     except Exception as e:
-        logger.error(f"Parse statistics failed: {str(e)}")
+        logger.error("Parse statistics failed: %s", e)
         raise
 
 def parse_numbers(response_text):
     """Parse numbers from the range response."""
+    from bs4 import BeautifulSoup
+
     try:
         soup = BeautifulSoup(response_text, 'html.parser')
         numbers = []
@@ -370,16 +546,18 @@ def parse_numbers(response_text):
             match = re.search(r"'([^']+)','([^']+)'", onclick)
             if match:
                 number, number_id = match.groups()
-                numbers.append({"number": number, "number_id": number_id})
+                numbers.append(NumberInfo(number, number_id))
             else:
-                logger.warning(f"Failed to parse onclick: {onclick}")
+                logger.warning("Failed to parse onclick: %s", onclick)
         return numbers
     except Exception as e:
-        logger.error(f"Parse numbers failed: {str(e)}")
+        logger.error("Parse numbers failed: %s", e)
         raise
 
 def parse_message(response_text):
     """Parse message details from response."""
+    from bs4 import BeautifulSoup
+
     try:
         soup = BeautifulSoup(response_text, 'html.parser')
         message_rows = soup.find_all('tr')
@@ -394,17 +572,121 @@ def parse_message(response_text):
             revenue = revenue_div.find('span', class_='currency_cdr').text.strip() if revenue_div else "0.0"
             timestamp = timestamp_div.find('p').text.strip() if timestamp_div else datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             
-            messages.append({
-                "message": message,
-                "revenue": revenue,
-                "timestamp": timestamp
-            })
+            messages.append(Message(timestamp, message, revenue))
         
         return messages
     except Exception as e:
-        logger.error(f"Parse message failed: {str(e)}")
+        logger.error("Parse message failed: %s", e)
+        raise
+
+# Message row fields, keyed by the exact class of the div holding them
+MESSAGE_ROW_FIELDS = {
+    "col-9 col-sm-6 text-center text-sm-start": ("message", "p"),
+    "col-3 col-sm-2 text-center text-sm-start": ("revenue", "span"),
+    "col-12 col-sm-4 text-center text-sm-start": ("timestamp", "p"),
+}
+
+class MessageRowParser(HTMLParser):
+    """Streaming parser collecting message rows as their </tr> is seen."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        self._row = None
+        self._field = None
+        self._field_tag = None
+        self._field_depth = 0
+        self._capture = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "tr":
+            self._row = {}
+        elif self._row is None:
+            return
+        elif tag == "div":
+            if self._field:
+                self._field_depth += 1
+            elif dict(attrs).get("class") in MESSAGE_ROW_FIELDS:
+                self._field, self._field_tag = MESSAGE_ROW_FIELDS[dict(attrs).get("class")]
+                self._field_depth = 1
+        elif self._field and tag == self._field_tag and self._capture is None and self._field not in self._row:
+            classes = (dict(attrs).get("class") or "").split()
+            if tag != "span" or "currency_cdr" in classes:
+                self._capture = []
+
+    def handle_endtag(self, tag):
+        if self._capture is not None and tag == self._field_tag:
+            self._row[self._field] = "".join(self._capture).strip()
+            self._capture = None
+        elif tag == "div" and self._field:
+            self._field_depth -= 1
+            if not self._field_depth:
+                self._field = None
+        elif tag == "tr" and self._row is not None:
+            row = self._row
+            self.rows.append(Message(
+                row.get("timestamp") or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                row.get("message", "No message found"),
+                row.get("revenue", "0.0"),
+            ))
+            self._row = None
+            self._field = None
+
+    def handle_data(self, data):
+        if self._capture is not None:
+            self._capture.append(data)
+
+def iter_message_rows(response_text, chunk_size=8192):
+    """Yield message rows newest-first while feeding the page in chunks."""
+    parser = MessageRowParser()
+    for start in range(0, len(response_text), chunk_size):
+        parser.feed(response_text[start:start + chunk_size])
+        yield from parser.rows
+        parser.rows.clear()
+    parser.close()
+    yield from parser.rows
+
+def message_digest(message_data):
+    """Return a short digest identifying a message row."""
+    key = f"{message_data.timestamp}\x00{message_data.message}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+def parse_new_messages(response_text, last_digest=None, known_count=0):
+    """Incrementally parse only the messages newer than the last processed one.
+
+    Rows are streamed newest-first and parsing stops at the row matching
+    last_digest. If that row is not on the page, every row is parsed and the
+    newest len(rows) - known_count are returned, as with a full parse.
+    Returns (new_messages, current_message_count).
+    """
+    try:
+        rows = []
+        for message_data in iter_message_rows(response_text):
+            if last_digest and message_digest(message_data) == last_digest:
+                return rows, known_count + len(rows)
+            rows.append(message_data)
+        return rows[:max(0, len(rows) - known_count)], len(rows)
+    except Exception as e:
+        logger.error("Parse new messages failed: %s", e)
         raise
 
+def parse_number_messages(response_text, last_digest=None, known_count=0):
+    """Return (new_messages, current_message_count) of a number's SMS page, parsed incrementally if enabled."""
+    if INCREMENTAL_PARSE:
+        return parse_new_messages(response_text, last_digest, known_count)
+    messages = parse_message(response_text)
+    return messages[:max(0, len(messages) - known_count)], len(messages)
+
+def track_messages(tracker_entry, number, range_name, new_messages, current_message_count):
+    """Record a number's new messages (newest first) in its tracker entry; returns them as SMS, oldest first."""
+    if current_message_count <= tracker_entry.message_count:
+        return []
+    tracker_entry.message_count = current_message_count
+    tracker_entry.last_messages = ([msg.message for msg in new_messages] + tracker_entry.last_messages)[:MAX_LAST_MESSAGES]
+    tracker_entry.last_digest = message_digest(new_messages[0])
+    tracker_entry.last_seen = time.time()
+    return [SMS(msg.timestamp, number, msg.message, range_name, msg.revenue) for msg in new_messages[::-1]]
+
 def parse_ranges(response_json):
     """Parse available ranges from JSON response."""
     try:
@@ -415,11 +697,13 @@ def parse_ranges(response_json):
                 ranges.add(range_name)
         return sorted(list(ranges))
     except Exception as e:
-        logger.error(f"Parse ranges failed: {str(e)}")
+        logger.error("Parse ranges failed: %s", e)
         return []
 
 def parse_active_data(response_text):
     """Parse active SMS data from /portal/live/my_sms response."""
+    from bs4 import BeautifulSoup
+
     try:
         soup = BeautifulSoup(response_text, 'html.parser')
         active_data = {"ranges": [], "total_numbers": 0}
@@ -441,17 +725,42 @@ def parse_active_data(response_text):
         
         return active_data
     except Exception as e:
-        logger.error(f"Parse active data failed: {str(e)}")
+        logger.error("Parse active data failed: %s", e)
         raise
 
+_parse_executor = None
+
+def get_parse_executor():
+    """Return the shared parse executor, creating it on first use (None when parsing inline)."""
+    global _parse_executor
+    if _parse_executor is None and PARSE_WORKERS > 0:
+        kind = PARSE_EXECUTOR
+        if not kind:
+            free_threaded = hasattr(sys, "_is_gil_enabled") and not sys._is_gil_enabled()
+            kind = "thread" if free_threaded else "process"
+        if kind == "thread":
+            _parse_executor = ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix="parse")
+        else:
+            # Spawned, not forked: the poller has threads running
+            _parse_executor = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        logger.info("Parsing pages over %s bytes in a %s pool of %s workers", PARSE_INLINE_THRESHOLD, kind, PARSE_WORKERS)
+    return _parse_executor
+
+async def parse_offloaded(parser, response_text, *args):
+    """Run a parser inline for small pages, or in the parse executor for large ones."""
+    executor = get_parse_executor()
+    if executor is None or len(response_text) < PARSE_INLINE_THRESHOLD:
+        return parser(response_text, *args)
+    return await asyncio.get_running_loop().run_in_executor(executor, parser, response_text, *args)
+
 def save_to_json(data, filename):
     """Save data to JSON file."""
     try:
         with open(filename, 'w', encoding='utf-8') as f:
             json.dump(data, f, indent=4)
-        logger.info(f"Data saved to {filename}")
+        logger.info("Data saved to %s", filename)
     except Exception as e:
-        logger.error(f"Failed to save to JSON {filename}: {str(e)}")
+        logger.error("Failed to save to JSON %s: %s", filename, e)
 
 def load_from_json(filename):
     """Load data from JSON file."""
@@ -461,7 +770,7 @@ def load_from_json(filename):
                 return json.load(f)
         return {}
     except Exception as e:
-        logger.error(f"Failed to load from JSON {filename}: {str(e)}")
+        logger.error("Failed to load from JSON %s: %s", filename, e)
         return {}
 
 async def start_command(update, context):
@@ -470,263 +779,909 @@ async def start_command(update, context):
         await update.message.reply_text("IVASMS Bot started! Monitoring SMS statistics.")
         logger.info("Processed /start command")
     except Exception as e:
-        logger.error(f"Start command failed: {str(e)}")
+        logger.error("Start command failed: %s", e)
 
 async def check_start(update, context):
     """Start the /check command conversation by asking for sender ID."""
     await update.message.reply_text("Please enter the sender ID (e.g., WhatsApp, Telegram):")
     return SENDER_ID
 
+def format_check_ranges(sender_id, ranges, pages_done, pages_total):
+    """Render the /check reply for the ranges found so far, within Telegram's message size limit."""
+    status = "✅ Done" if pages_done >= pages_total else "⏳ Scanning"
+    header = f"📋 *Available Ranges for {sender_id}* ({len(ranges)}, {status} {pages_done}/{pages_total} pages):\n\n"
+    lines = []
+    size = len(header)
+    for range_name in sorted(ranges):
+        line = f"`{range_name}`"
+        if size + len(line) + 40 > 4096:
+            lines.append(f"…and {len(ranges) - len(lines)} more")
+            break
+        lines.append(line)
+        size += len(line) + 1
+    return header + "\n".join(lines)
+
 async def check_receive_sender_id(update, context):
-    """Handle the sender ID input and fetch ranges."""
+    """Handle the sender ID input, scan result pages concurrently and stream ranges to the chat."""
+    from telegram.ext import ConversationHandler
+
     sender_id = update.message.text.strip()
     context.user_data['sender_id'] = sender_id
     try:
-        with requests.Session() as session:
+        with create_session() as session:
             # Login
-            tokens = payload_1(session)
-            payload_2(session, tokens["_token"])
+            tokens = await upstream(COMMANDS, payload_1, session)
+            await upstream(COMMANDS, payload_2, session, tokens["_token"])
             
-            # Fetch ranges with user-provided sender ID
-            response = payload_7(session, sender_id)
-            ranges = parse_ranges(response)
+            # First page tells us how many test SMS there are
+            response = await upstream(COMMANDS, payload_7, session, sender_id, 0, CHECK_PAGE_SIZE)
+            ranges = set(parse_ranges(response))
+            total_records = int(response.get("recordsFiltered") or response.get("recordsTotal") or 0)
+            pages_total = max(1, min(CHECK_MAX_PAGES, math.ceil(total_records / CHECK_PAGE_SIZE)))
             
-            if not ranges:
+            if not ranges and pages_total == 1:
                 await update.message.reply_text(f"No ranges found for sender ID '{sender_id}'.", parse_mode="Markdown")
                 return ConversationHandler.END
             
-            message = f"📋 *Available Ranges for {sender_id}*:\n\n" + "\n".join([f"`{range_name}`" for range_name in ranges])
-            await update.message.reply_text(message, parse_mode="Markdown")
-            logger.info(f"Processed /check command for sender ID: {sender_id}")
+            text = format_check_ranges(sender_id, ranges, 1, pages_total)
+            reply = await update.message.reply_text(text, parse_mode="Markdown")
+            
+            # Fetch the remaining pages concurrently, editing the reply as they arrive
+            semaphore = asyncio.Semaphore(CHECK_CONCURRENCY)
+            
+            async def fetch_page(page):
+                async with semaphore:
+                    return await upstream(COMMANDS, payload_7, session, sender_id, page * CHECK_PAGE_SIZE, CHECK_PAGE_SIZE)
+            
+            pages_done = 1
+            last_edit = time.monotonic()
+            for page_task in asyncio.as_completed([fetch_page(page) for page in range(1, pages_total)]):
+                try:
+                    ranges.update(parse_ranges(await page_task))
+                except Exception as e:
+                    logger.warning("Check page failed for sender ID %s: %s", sender_id, e)
+                pages_done += 1
+                new_text = format_check_ranges(sender_id, ranges, pages_done, pages_total)
+                if new_text != text and (pages_done == pages_total or time.monotonic() - last_edit >= CHECK_EDIT_INTERVAL):
+                    await reply.edit_text(new_text, parse_mode="Markdown")
+                    text = new_text
+                    last_edit = time.monotonic()
+            
+            final_text = format_check_ranges(sender_id, ranges, pages_total, pages_total)
+            if final_text != text:
+                await reply.edit_text(final_text, parse_mode="Markdown")
+            logger.info("Processed /check command for sender ID: %s (%s ranges, %s pages)", sender_id, len(ranges), pages_total)
             return ConversationHandler.END
     except Exception as e:
-        logger.error(f"Check command failed for sender ID {sender_id}: {str(e)}")
+        logger.error("Check command failed for sender ID %s: %s", sender_id, e)
         await update.message.reply_text(f"Error fetching ranges for '{sender_id}': {str(e)}", parse_mode="Markdown")
         return ConversationHandler.END
 
 async def check_cancel(update, context):
     """Cancel the /check command conversation."""
+    from telegram.ext import ConversationHandler
+
     await update.message.reply_text("Check command cancelled.")
     return ConversationHandler.END
 
-async def active_command(update, context):
-    """Handle /active command to fetch and display active SMS ranges and total numbers."""
+def select_numbers_to_return(number_tracker, policy, idle_hours=None, numbers=None):
+    """Select tracked numbers matching a return policy as [(range_name, number, number_id)].
+
+    Policies: "otp" (an OTP code was extracted from one of its recent
+    messages), "idle" (no SMS for idle_hours) and "numbers" (the explicitly
+    given numbers). Returned numbers are skipped.
+    """
+    now = time.time()
+    wanted = {n.lstrip("+") for n in numbers or []}
+    selected = []
+    for range_name, tracked_numbers in number_tracker.items():
+        for number, entry in tracked_numbers.items():
+            if entry.returned or not entry.number_id:
+                continue
+            if policy == "otp":
+                match = any(extract_code(message) for message in entry.last_messages)
+            elif policy == "idle":
+                match = now - (entry.last_seen or now) >= idle_hours * 3600
+            elif policy == "numbers":
+                match = number in wanted
+            else:
+                raise ValueError(f"Unknown return policy: {policy}")
+            if match:
+                selected.append((range_name, number, entry.number_id))
+    return selected
+
+async def return_numbers(session, csrf_token, number_ids, priority=COMMANDS):
+    """Return numbers in chunked payload_8 calls with bounded concurrency.
+
+    Returns one (batch_ids, result_or_exception) tuple per batch.
+    """
+    batches = [number_ids[i:i + RETURN_BATCH_SIZE] for i in range(0, len(number_ids), RETURN_BATCH_SIZE)]
+    semaphore = asyncio.Semaphore(RETURN_CONCURRENCY)
+
+    async def return_batch(batch):
+        async with semaphore:
+            return await upstream(priority, payload_8, session, csrf_token, batch)
+
+    results = await asyncio.gather(*(return_batch(batch) for batch in batches), return_exceptions=True)
+    return list(zip(batches, results))
+
+def mark_returned(number_tracker, selected, batch_results):
+    """Flag numbers of successful return batches in the tracker; returns how many were marked."""
+    returned_ids = {
+        number_id
+        for batch, result in batch_results if not isinstance(result, Exception)
+        for number_id in batch
+    }
+    for range_name, number, number_id in selected:
+        if number_id in returned_ids:
+            number_tracker[range_name][number].returned = True
+    return len(returned_ids)
+
+def format_return_results(batch_results):
+    """Render one line per return batch."""
+    lines = []
+    for index, (batch, result) in enumerate(batch_results, 1):
+        if isinstance(result, Exception):
+            lines.append(f"❌ Batch {index} ({len(batch)} numbers): {str(result)}")
+        else:
+            detail = result.get("message", "ok") if isinstance(result, dict) else "ok"
+            lines.append(f"✅ Batch {index} ({len(batch)} numbers): {detail}")
+    return "\n".join(lines)
+
+async def return_command(update, context):
+    """Handle /return all confirm | otp | idle <hours> | <number> ... to return numbers in bulk."""
+    usage = "Usage: /return all confirm | otp | idle <hours> | <number> [<number> ...]"
+    args = context.args or []
+    number_tracker = context.bot_data.get("number_tracker", {})
+    if not args:
+        await update.message.reply_text(usage)
+        return
+    policy = args[0].lower()
+    selected = None
+    if policy == "all":
+        # Returning every number cannot be undone, so it has to be confirmed
+        if len(args) < 2 or args[1].lower() != "confirm":
+            tracked = sum(len(tracked_numbers) for tracked_numbers in number_tracker.values())
+            await update.message.reply_text(
+                f"⚠️ This returns every number on the account ({tracked} tracked). Send /return all confirm to proceed."
+            )
+            return
+    elif policy == "otp":
+        selected = select_numbers_to_return(number_tracker, "otp")
+    elif policy == "idle":
+        try:
+            idle_hours = float(args[1]) if len(args) > 1 else AUTO_RETURN_IDLE_HOURS
+        except ValueError:
+            idle_hours = -1
+        if not 0 <= idle_hours < math.inf:
+            await update.message.reply_text(usage)
+            return
+        selected = select_numbers_to_return(number_tracker, "idle", idle_hours=idle_hours)
+    else:
+        selected = select_numbers_to_return(number_tracker, "numbers", numbers=args)
+    
+    # Selection is local, so the portal login is only paid for when something matched
+    if selected is not None and not selected:
+        await update.message.reply_text("No tracked numbers match.")
+        return
     try:
-        with requests.Session() as session:
+        with create_session() as session:
             # Login
-            tokens = payload_1(session)
-            payload_2(session, tokens["_token"])
+            tokens = await upstream(COMMANDS, payload_1, session)
+            await upstream(COMMANDS, payload_2, session, tokens["_token"])
+            _, csrf_token = await upstream(COMMANDS, payload_3, session)
             
-            # Fetch active SMS data
-            response = payload_active(session)
-            active_data = parse_active_data(response.text)
-            
-            if not active_data["ranges"]:
-                await update.message.reply_text("No active ranges found.", parse_mode="Markdown")
+            if policy == "all":
+                result = await upstream(COMMANDS, payload_9, session, csrf_token)
+                for tracked_numbers in number_tracker.values():
+                    for entry in tracked_numbers.values():
+                        entry.returned = True
+                detail = result.get("message", "ok") if isinstance(result, dict) else "ok"
+                await update.message.reply_text(f"✅ Returned all numbers: {detail}")
+                logger.info("Processed /return all command")
                 return
             
-            message = (
-                "📊 *Active SMS Data*:\n\n"
-                f"🔢 *Total Numbers*: `{active_data['total_numbers']}`\n"
-                f"🌐 *Active Ranges*:\n" + "\n".join([f"`{range_name}`" for range_name in active_data["ranges"]])
+            started = time.monotonic()
+            batch_results = await return_numbers(session, csrf_token, [number_id for _, _, number_id in selected])
+            returned = mark_returned(number_tracker, selected, batch_results)
+            await update.message.reply_text(
+                f"♻️ Returned {returned}/{len(selected)} numbers in {time.monotonic() - started:.1f}s\n\n"
+                + format_return_results(batch_results)
             )
-            await update.message.reply_text(message, parse_mode="Markdown")
-            logger.info("Processed /active command")
+            logger.info("Processed /return command: %s/%s numbers returned", returned, len(selected))
     except Exception as e:
-        logger.error(f"Active command failed: {str(e)}")
-        await update.message.reply_text(f"Error fetching active SMS data: {str(e)}", parse_mode="Markdown")
+        logger.error("Return command failed: %s", e)
+        await update.message.reply_text(f"Error returning numbers: {str(e)}")
 
-async def main():
-    """Main function to execute automation and monitor SMS statistics."""
+def new_snapshot():
+    """Create the in-memory read model served to /active and /stats."""
+    return {
+        "ranges": [],
+        "totals": {"ranges": 0, "count": 0, "paid": 0, "unpaid": 0, "revenue": 0.0},
+        "updated": None,
+        "active": None,
+        "active_updated": None,
+    }
+
+def update_snapshot(snapshot, ranges):
+    """Refresh the snapshot's range statistics from a parse_statistics result."""
+    snapshot["ranges"] = ranges
+    snapshot["totals"] = {
+        "ranges": len(ranges),
+        "count": sum(r.count for r in ranges),
+        "paid": sum(r.paid for r in ranges),
+        "unpaid": sum(r.unpaid for r in ranges),
+        "revenue": sum(r.revenue for r in ranges),
+    }
+    snapshot["updated"] = time.time()
+
+async def refresh_active_snapshot(session, snapshot):
+    """Fetch /portal/live/my_sms in the background and store it in the snapshot."""
     try:
-        # Set up Telegram bot with polling
-        application = Application.builder().token(os.getenv("BOT_TOKEN")).build()
-        application.add_handler(CommandHandler("start", start_command))
-        
-        # Add ConversationHandler for /check command
-        check_conv_handler = ConversationHandler(
-            entry_points=[CommandHandler("check", check_start)],
-            states={
-                SENDER_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, check_receive_sender_id)],
-            },
-            fallbacks=[CommandHandler("cancel", check_cancel)],
-        )
-        application.add_handler(check_conv_handler)
+        response = await upstream(HOUSEKEEPING, payload_active, session)
+        snapshot["active"] = await parse_offloaded(parse_active_data, response.text)
+        snapshot["active_updated"] = time.time()
+    except Exception as e:
+        logger.warning("Active snapshot refresh failed: %s", e)
+
+def format_age(timestamp):
+    """Render how long ago a snapshot field was refreshed."""
+    if timestamp is None:
+        return "never"
+    return f"{time.time() - timestamp:.0f}s ago"
+
+async def active_command(update, context):
+    """Handle /active command to display active SMS ranges and total numbers."""
+    try:
+        snapshot = context.bot_data.get("snapshot") or {}
+        active_data = snapshot.get("active")
+        if active_data is None:
+            # The poller has not refreshed the active data yet, fetch it directly
+            with create_session() as session:
+                # Login
+                tokens = await upstream(COMMANDS, payload_1, session)
+                await upstream(COMMANDS, payload_2, session, tokens["_token"])
+                
+                # Fetch active SMS data
+                response = await upstream(COMMANDS, payload_active, session)
+                active_data = await parse_offloaded(parse_active_data, response.text)
         
-        # Add /active command handler
-        application.add_handler(CommandHandler("active", active_command))
+        if not active_data["ranges"]:
+            await update.message.reply_text("No active ranges found.", parse_mode="Markdown")
+            return
         
-        await application.initialize()
-        await application.start()
+        message = (
+            "📊 *Active SMS Data*:\n\n"
+            f"🔢 *Total Numbers*: `{active_data['total_numbers']}`\n"
+            f"🕒 *Updated*: {format_age(snapshot.get('active_updated'))}\n"
+            f"🌐 *Active Ranges*:\n" + "\n".join([f"`{range_name}`" for range_name in active_data["ranges"]])
+        )
+        await update.message.reply_text(message[:4096], parse_mode="Markdown")
+        logger.info("Processed /active command")
+    except Exception as e:
+        logger.error("Active command failed: %s", e)
+        await update.message.reply_text(f"Error fetching active SMS data: {str(e)}", parse_mode="Markdown")
+
+async def stats_command(update, context):
+    """Handle /stats command with per-range count/paid/unpaid/revenue from the poller's snapshot."""
+    try:
+        snapshot = context.bot_data.get("snapshot") or {}
+        if not snapshot.get("updated"):
+            await update.message.reply_text("Statistics are not available yet, the first poll has not completed.")
+            return
+        totals = snapshot["totals"]
+        header = (
+            f"📈 *Range Statistics* (updated {format_age(snapshot['updated'])})\n\n"
+            f"🌐 *Ranges*: `{totals['ranges']}`  📨 *SMS*: `{totals['count']}`\n"
+            f"✅ *Paid*: `{totals['paid']}`  ⏳ *Unpaid*: `{totals['unpaid']}`  💰 *Revenue*: `{totals['revenue']:.2f}`\n\n"
+        )
+        lines = []
+        size = len(header)
+        metrics = context.bot_data.get("metrics")
+        ranges = sorted(snapshot["ranges"], key=lambda r: r.count, reverse=True)
+        for r in ranges:
+            line = f"`{r.range_name}`: {r.count} ({r.paid} paid / {r.unpaid} unpaid) · {r.revenue:.2f}"
+            rate = metrics.rate(r.range_name) if metrics else 0
+            if rate:
+                line += f" · {rate:.1f}/min"
+            if size + len(line) + 40 > 4096:
+                lines.append(f"…and {len(ranges) - len(lines)} more")
+                break
+            lines.append(line)
+            size += len(line) + 1
+        await update.message.reply_text(header + "\n".join(lines), parse_mode="Markdown")
+        logger.info("Processed /stats command")
+    except Exception as e:
+        logger.error("Stats command failed: %s", e)
+        await update.message.reply_text(f"Error building statistics: {str(e)}")
+
+async def trends_command(update, context):
+    """Handle /trends [minutes] with the busiest ranges and hourly revenue from the rolling aggregates."""
+    try:
+        metrics = context.bot_data.get("metrics")
+        if metrics is None:
+            await update.message.reply_text("Range trends are not available.")
+            return
+        minutes = int(context.args[0]) if context.args and context.args[0].isdigit() else 60
+        minutes = max(1, min(minutes, metrics.minutes))
+        top = metrics.top(10, minutes)
+        lines = [f"📊 *Busiest ranges* (last {minutes} min)\n"]
+        for name, count, revenue in top:
+            lines.append(f"`{name}`: {int(count)} SMS · {count / minutes:.1f}/min · {revenue:.2f}")
+        if not top:
+            lines.append("No new SMS in this window.")
+        hourly = metrics.revenue_per_hour(6)
+        lines.append("\n💰 *Revenue per hour* (oldest first)")
+        lines.append(" · ".join(f"{value:.2f}" for value in hourly))
+        lines.append(f"\n⏱ *Upstream queue wait*: {scheduler.summary()}")
+        await update.message.reply_text("\n".join(lines), parse_mode="Markdown")
+        logger.info("Processed /trends command")
+    except Exception as e:
+        logger.error("Trends command failed: %s", e)
+        await update.message.reply_text(f"Error building trends: {str(e)}")
+
+def format_search_results(query, results, elapsed):
+    """Render /search hits, newest first, within Telegram's message size limit."""
+    header = f"🔎 *{len(results)} results* for `{query}` ({elapsed * 1000:.0f} ms)\n\n"
+    lines = []
+    size = len(header)
+    for sms in results:
+        code = f" · Code `{sms['otp']}`" if sms.get("otp") else ""
+        line = f"🕒 {sms['timestamp']} · `+{sms['number']}` · {sms['range']}{code}\n{sms['message']}\n"
+        if size + len(line) > 4000:
+            break
+        lines.append(line)
+        size += len(line) + 1
+    return header + "\n".join(lines)
+
+async def search_command(update, context):
+    """Handle /search <number prefix | range:NAME | text> against the SMS archive."""
+    try:
+        query = " ".join(context.args or []).strip()
+        if not query:
+            await update.message.reply_text("Usage: /search <number prefix | range:NAME | text>")
+            return
+        archive = context.bot_data.get("archive")
+        if archive is None:
+            await update.message.reply_text("The SMS archive is not available.")
+            return
+        started = time.perf_counter()
+        results = await asyncio.to_thread(archive.search, query, SEARCH_RESULTS)
+        elapsed = time.perf_counter() - started
+        if not results:
+            await update.message.reply_text(f"No archived SMS match `{query}`.", parse_mode="Markdown")
+            return
+        await update.message.reply_text(format_search_results(query, results, elapsed), parse_mode="Markdown")
+        logger.info("Processed /search for %r: %s results in %.1f ms", query, len(results), elapsed * 1000)
+    except Exception as e:
+        logger.error("Search command failed: %s", e)
+        await update.message.reply_text(f"Error searching the archive: {str(e)}")
+
+async def start_updates(application):
+    """Start receiving Telegram updates through the webhook listener or long polling."""
+    if TELEGRAM_WEBHOOK_URL:
+        webhook_url = f"{TELEGRAM_WEBHOOK_URL.rstrip('/')}/{TELEGRAM_WEBHOOK_PATH}"
+        await application.updater.start_webhook(
+            listen=TELEGRAM_WEBHOOK_LISTEN,
+            port=TELEGRAM_WEBHOOK_PORT,
+            url_path=TELEGRAM_WEBHOOK_PATH,
+            webhook_url=webhook_url,
+            secret_token=TELEGRAM_WEBHOOK_SECRET,
+            max_connections=TELEGRAM_WEBHOOK_MAX_CONNECTIONS,
+        )
+        logger.info("Telegram bot receiving updates via webhook on %s:%s/%s", TELEGRAM_WEBHOOK_LISTEN, TELEGRAM_WEBHOOK_PORT, TELEGRAM_WEBHOOK_PATH)
+    else:
         await application.updater.start_polling()
-        logger.info("Telegram bot started")
-        
+        logger.info("Telegram bot receiving updates via long polling")
+
+async def start_bot(bot_data, receive_updates=True):
+    """Build, initialize and start the Telegram application sharing bot_data with the poller.
+
+    Without receive_updates it only sends notifications and handles no commands.
+    """
+    started = time.perf_counter()
+    from telegram.ext import Application, CommandHandler, ConversationHandler, MessageHandler, filters
+
+    application = Application.builder().token(os.getenv("BOT_TOKEN")).base_url(TELEGRAM_BASE_URL).build()
+    application.add_handler(CommandHandler("start", start_command))
+    
+    # Add ConversationHandler for /check command
+    check_conv_handler = ConversationHandler(
+        entry_points=[CommandHandler("check", check_start)],
+        states={
+            SENDER_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, check_receive_sender_id)],
+        },
+        fallbacks=[CommandHandler("cancel", check_cancel)],
+    )
+    application.add_handler(check_conv_handler)
+    
+    # Add /active command handler
+    application.add_handler(CommandHandler("active", active_command))
+    
+    # Add /return command handler
+    application.add_handler(CommandHandler("return", return_command))
+    
+    # Add /stats command handler
+    application.add_handler(CommandHandler("stats", stats_command))
+    
+    # Add /trends command handler
+    application.add_handler(CommandHandler("trends", trends_command))
+    
+    # Add /search command handler
+    application.add_handler(CommandHandler("search", search_command))
+    application.bot_data.update(bot_data)
+    
+    await application.initialize()
+    await application.start()
+    if receive_updates:
+        await start_updates(application)
+    STARTUP_TIMINGS["bot_init"] = time.perf_counter() - started
+    logger.info("Telegram bot started")
+    return application
+
+async def stop_poller(bot_task, tasks, shard_pool):
+    """Cancel the poller's background tasks, then stop the shard workers and the Telegram bot.
+
+    The scheduler and the delivery lock are reset, so a later poller, on this
+    event loop or another, starts from a clean state.
+    """
+    global _delivery_lock
+    for task in tasks:
+        if task is not None:
+            task.cancel()
+    if shard_pool is not None:
+        shard_pool.close()
+    scheduler.reset()
+    _delivery_lock = None
+    if bot_task is None:
+        return
+    if not bot_task.done():
+        bot_task.cancel()
+        return
+    if bot_task.cancelled() or bot_task.exception():
+        return
+    application = bot_task.result()
+    try:
+        if application.updater.running:
+            await application.updater.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+    except Exception as e:
+        logger.warning("Failed to stop the Telegram bot: %s", e)
+
+async def resume_portal_session(session, saved):
+    """Reuse the portal session published by the previous HA leader; returns its CSRF token, or None if it expired."""
+    session.cookies.update(saved["cookies"])
+    try:
+        response = await scheduler.call(STATISTICS, "portal", functools.partial(
+            session.get, f"{PORTAL_URL}/portal", headers=BASE_HEADERS, timeout=endpoint_timeout("portal")
+        ))
+    except Exception as e:
+        logger.warning("Could not check the previous leader's portal session: %s", e)
+        return None
+    if response.status_code == 401 or str(response.url).endswith("/login"):
+        return None
+    return saved["csrf_token"]
+
+def restore_replica_state(state):
+    """Write the state published by the previous HA leader to this replica's files before it starts polling."""
+    if not state:
+        return
+    save_to_json(state["tracker"], NUMBER_TRACKER_FILE)
+    save_to_json(state["statistics"], STATISTICS_FILE)
+    outbox = Outbox(OUTBOX_FILE, give_up_after=OUTBOX_GIVE_UP_HOURS * 3600, retry_max=OUTBOX_RETRY_MAX)
+    outbox.add([from_dict(SMS, sms) for sms in state["pending"]])
+    outbox.close()
+    archive = Archive(ARCHIVE_FILE)
+    archive.append([from_dict(SMS, sms) for sms in state["recent"]])
+    archive.close()
+    logger.info("Restored HA state: %s tracked ranges, %s undelivered and %s recent SMS",
+                len(state["tracker"]), len(state["pending"]), len(state["recent"]))
+
+def run_summary(started, cycles, detected, pushed):
+    """Machine-readable summary of a run: startup and per-phase timings, upstream queue waits and detected SMS."""
+    return {
+        "cycles": cycles,
+        "elapsed_s": time.perf_counter() - started,
+        "startup_s": dict(STARTUP_TIMINGS),
+        "phases": watchdog.phase_timings(),
+        "upstream_wait": scheduler.wait_stats(),
+        "pushed_sms": pushed,
+        "detected_sms": [to_dict(sms) for sms in detected],
+    }
+
+def print_summary(summary):
+    """Print the detected SMS and the timings of a run_summary() for a human reader."""
+    for sms in summary["detected_sms"]:
+        print(f"{sms['timestamp']}  +{sms['number']}  {sms['range']}  {sms['otp'] or '-'}  {sms['message']}")
+    print(f"{len(summary['detected_sms'])} SMS detected in {summary['cycles']} cycles, {summary['elapsed_s']:.2f} s")
+    for name, seconds in summary["startup_s"].items():
+        print(f"  startup {name:<14}{seconds * 1000:>10.0f} ms")
+    for phase, timing in summary["phases"].items():
+        print(f"  phase   {phase:<14}{timing['seconds'] * 1000:>10.0f} ms  x{timing['count']}")
+
+def log_startup_timings():
+    """Log how long each startup phase took and the total time to the first poll."""
+    phases = " ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in STARTUP_TIMINGS.items())
+    logger.info("Startup timing: %s time_to_first_poll=%.0fms", phases, (time.perf_counter() - _IMPORT_STARTED) * 1000)
+
+async def main(replica=None, receive_updates=True, max_cycles=None, duration=None):
+    """Main function to execute automation and monitor SMS statistics.
+
+    As an HA replica, it publishes its state for the standbys and takes
+    over the previous leader's portal session when that is still valid.
+    With max_cycles or duration it stops after that many scan cycles or
+    seconds and returns a run_summary().
+    """
+    run_started = time.perf_counter()
+    deadline = time.monotonic() + duration if duration else None
+    detected = []
+    # Started below and stopped when the poller ends, e.g. when an HA replica loses its lease
+    bot_task = watchdog_task = active_refresh = live_task = shards_started = shard_pool = None
+    try:
         # Calculate date range
         today = datetime.now()
         from_date = today.strftime("%m/%d/%Y")
         to_date = (today + timedelta(days=1)).strftime("%m/%d/%Y")
         
         # Initialize storage
-        JSON_FILE = "sms_statistics.json"
-        NUMBER_TRACKER_FILE = "number_tracker.json"
-        existing_ranges = load_from_json(JSON_FILE)
-        existing_ranges_dict = {r["range_name"]: r for r in existing_ranges}
-        number_tracker = load_from_json(NUMBER_TRACKER_FILE)
+        existing_ranges_dict = {r["range_name"]: from_dict(RangeStats, r) for r in load_from_json(STATISTICS_FILE) or []}
+        number_tracker = load_tracker(load_from_json(NUMBER_TRACKER_FILE))
+        # Trackers written before last_messages was capped
+        for tracked_numbers in number_tracker.values():
+            for tracker_entry in tracked_numbers.values():
+                del tracker_entry.last_messages[MAX_LAST_MESSAGES:]
+        
+        # Undelivered notifications from a previous run are replayed once the bot is up
+        outbox = Outbox(OUTBOX_FILE, give_up_after=OUTBOX_GIVE_UP_HOURS * 3600, retry_max=OUTBOX_RETRY_MAX)
+        outbox.prune(OUTBOX_RETENTION_DAYS * 86400)
+        router = load_router(ROUTES_FILE, os.getenv("CHAT_ID"))
+        archive = Archive(ARCHIVE_FILE)
+        pruned = await asyncio.to_thread(archive.prune, ARCHIVE_RETENTION_DAYS * 86400)
+        if pruned:
+            logger.info("Pruned %s archived SMS older than %s days", pruned, ARCHIVE_RETENTION_DAYS)
+        last_archive_prune = time.time()
         
-        # Initialize number tracker if empty
-        if not number_tracker:
-            number_tracker = {}
+        # Start the Telegram bot concurrently with the portal login below
+        snapshot = new_snapshot()
+        metrics = RangeMetrics()
+        # Without updates and without a token, nothing is sent to Telegram at all
+        if receive_updates or os.getenv("BOT_TOKEN"):
+            bot_task = asyncio.create_task(start_bot(
+                {"number_tracker": number_tracker, "snapshot": snapshot, "archive": archive, "metrics": metrics},
+                receive_updates,
+            ))
+        if WATCHDOG_THRESHOLD > 0:
+            watchdog_task = asyncio.create_task(watchdog.run())
+        active_refresh = None
+        last_active_refresh = 0
+        last_upstream_report = time.time()
+        first_poll_done = False
+        bot = None
         
         last_reauth_time = 0
         min_reauth_interval = 60
+        last_auto_return = time.time()
+        last_state_publish = 0
+        cycle = 0
+        
+        # While the live feed is up and a full poll has run since it connected, ticks only refresh statistics
+        live_feed = LiveFeed(LIVE_FEED_URL) if LIVE_FEED_URL and max_cycles is None else None
+        live_task = None
+        last_full_poll = None
+        
+        # Ranges are scanned in worker processes when sharding is on; the workers start during login
+        shard_pool = ShardPool(SHARD_WORKERS) if SHARD_WORKERS > 0 else None
+        if shard_pool is not None:
+            shards_started = asyncio.create_task(shard_pool.start())
         
         while True:
+            if deadline is not None and time.monotonic() >= deadline:
+                return run_summary(run_started, cycle, detected, live_feed.pushed if live_feed else 0)
             try:
-                with requests.Session() as session:
+                with create_session() as session:
                     session_start = time.time()
+                    login_started = time.perf_counter()
                     
-                    # Login
-                    logger.info("Executing Payload 1: GET /login")
-                    tokens = payload_1(session)
+                    # Login, unless the previous HA leader's portal session is still valid
+                    watchdog.set_phase("login")
+                    saved_session = replica.take_session() if replica is not None else None
+                    csrf_token = saved_session and await resume_portal_session(session, saved_session)
+                    if csrf_token:
+                        session_start = saved_session["started"]
+                        logger.info("Resumed the previous leader's portal session")
+                    else:
+                        logger.info("Executing Payload 1: GET /login")
+                        tokens = await upstream(STATISTICS, payload_1, session)
+                        
+                        logger.info("Executing Payload 2: POST /login")
+                        response = await upstream(STATISTICS, payload_2, session, tokens["_token"])
+                        logger.debug("Payload 2 response status: %s, URL: %s", response.status_code, response.url)
+                        
+                        logger.info("Executing Payload 3: GET /sms/received")
+                        response, csrf_token = await upstream(STATISTICS, payload_3, session)
+                        logger.debug("Payload 3 response status: %s", response.status_code)
+                    STARTUP_TIMINGS.setdefault("login", time.perf_counter() - login_started)
+                    
+                    # Fetch initial statistics as soon as auth completes
+                    first_poll_started = time.perf_counter()
+                    logger.info("Executing Payload 4: POST /sms/received/getsms for date range %s to %s", from_date, to_date)
+                    response = await upstream(STATISTICS, payload_4, session, csrf_token, from_date, to_date)
+                    logger.debug("Payload 4 response status: %s", response.status_code)
+                    ranges = await parse_offloaded(parse_statistics, response.text)
+                    update_snapshot(snapshot, ranges)
+                    metrics.update(ranges)
                     
-                    logger.info("Executing Payload 2: POST /login")
-                    response = payload_2(session, tokens["_token"])
-                    logger.debug(f"Payload 2 response status: {response.status_code}, URL: {response.url}")
+                    if not existing_ranges_dict:
+                        existing_ranges_dict = {r.range_name: r for r in ranges}
+                        save_to_json([to_dict(r) for r in ranges], STATISTICS_FILE)
                     
-                    logger.info("Executing Payload 3: GET /sms/received")
-                    response, csrf_token = payload_3(session)
-                    logger.debug(f"Payload 3 response status: {response.status_code}")
+                    if not first_poll_done:
+                        first_poll_done = True
+                        STARTUP_TIMINGS["first_poll"] = time.perf_counter() - first_poll_started
+                        if bot_task is not None:
+                            bot = (await bot_task).bot
+                        log_startup_timings()
+                        if bot is not None:
+                            replayed = await deliver_pending(bot, outbox)
+                            if replayed:
+                                logger.info("Replayed %s undelivered notifications from the outbox", replayed)
                     
-                    # Fetch initial statistics
-                    logger.info(f"Executing Payload 4: POST /sms/received/getsms for date range {from_date} to {to_date}")
-                    response = payload_4(session, csrf_token, from_date, to_date)
-                    logger.debug(f"Payload 4 response status: {response.status_code}")
-                    ranges = parse_statistics(response.text)
+                    # (Re)start the live feed on the new session
+                    if live_feed is not None:
+                        if live_task is not None:
+                            live_task.cancel()
+                        live_task = asyncio.create_task(live_feed.run(session, BASE_HEADERS, functools.partial(
+                            ingest_pushed_sms, number_tracker=number_tracker, shard_pool=shard_pool,
+                            archive=archive, router=router, outbox=outbox, bot=bot,
+                        )))
                     
-                    if not existing_ranges:
-                        existing_ranges = ranges
-                        existing_ranges_dict = {r["range_name"]: r for r in ranges}
-                        save_to_json(existing_ranges, JSON_FILE)
+                    # The session was validated by the login that just completed
+                    session_validated = True
                     
                     while True:
-                        # Session validation
+                        # Session validation (skipped right after login)
+                        watchdog.set_phase("validation")
                         try:
-                            test_response = session.get("https://www.ivasms.com/portal", headers=BASE_HEADERS, timeout=10)
-                            if test_response.status_code == 401 or test_response.url.endswith("/login"):
-                                logger.info("Session invalid. Re-authenticating...")
-                                last_reauth_time = time.time()
-                                break
+                            if not session_validated:
+                                test_response = await scheduler.call(STATISTICS, "portal", functools.partial(
+                                    session.get, f"{PORTAL_URL}/portal", headers=BASE_HEADERS, timeout=endpoint_timeout("portal")
+                                ))
+                                if test_response.status_code == 401 or str(test_response.url).endswith("/login"):
+                                    logger.info("Session invalid. Re-authenticating...")
+                                    last_reauth_time = time.time()
+                                    break
+                            session_validated = False
                         except Exception as e:
-                            logger.warning(f"Session validation check failed: {str(e)}")
+                            logger.warning("Session validation check failed: %s", e)
                             last_reauth_time = time.time()
                             break
                         
                         # Check session expiry
                         elapsed_time = time.time() - session_start
-                        logger.debug(f"Session elapsed time: {elapsed_time:.2f} seconds")
+                        logger.debug("Session elapsed time: %.2f seconds", elapsed_time)
                         if elapsed_time > 7200:
                             logger.info("Session nearing expiry. Re-authenticating...")
                             time_since_last_reauth = time.time() - last_reauth_time
                             if time_since_last_reauth < min_reauth_interval:
-                                logger.info(f"Waiting {min_reauth_interval - time_since_last_reauth:.2f} seconds before re-authenticating")
+                                logger.info("Waiting %.2f seconds before re-authenticating", min_reauth_interval - time_since_last_reauth)
                                 await asyncio.sleep(min_reauth_interval - time_since_last_reauth)
                             last_reauth_time = time.time()
                             break
                         
                         # Fetch updated statistics
-                        response = payload_4(session, csrf_token, from_date, to_date)
-                        logger.debug(f"Payload 4 response status: {response.status_code}")
-                        new_ranges = parse_statistics(response.text)
-                        new_ranges_dict = {r["range_name"]: r for r in new_ranges}
+                        cycle += 1
+                        watchdog.set_phase("statistics", cycle)
+                        response = await upstream(STATISTICS, payload_4, session, csrf_token, from_date, to_date)
+                        logger.debug("Payload 4 response status: %s", response.status_code, extra={"cycle": cycle})
+                        new_ranges = await parse_offloaded(parse_statistics, response.text)
+                        update_snapshot(snapshot, new_ranges)
+                        metrics.update(new_ranges)
+                        
+                        # Refresh the /active read model at a low cadence without blocking the tick
+                        if max_cycles is None and (active_refresh is None or active_refresh.done()) and time.time() - last_active_refresh >= ACTIVE_REFRESH_INTERVAL:
+                            last_active_refresh = time.time()
+                            active_refresh = asyncio.create_task(refresh_active_snapshot(session, snapshot))
+                        
+                        if time.time() - last_upstream_report >= UPSTREAM_REPORT_INTERVAL:
+                            last_upstream_report = time.time()
+                            logger.info("Upstream queue wait: %s", scheduler.summary(), extra={"cycle": cycle})
+                        
+                        # Fetch the number lists of all ranges concurrently, unless the live feed covers them
+                        watchdog.set_phase("numbers")
+                        pushing = last_full_poll is not None and live_feed is not None and live_feed.covers(last_full_poll)
+                        if pushing:
+                            polled_ranges = []
+                        else:
+                            polled_ranges = new_ranges
+                            last_full_poll = time.monotonic()
+                        
+                        # SMS detected in this cycle, delivered as one batch
+                        new_sms = []
+                        
+                        # Sharded: the workers fetch and parse the ranges, and nothing is left to scan here
+                        if shard_pool is not None:
+                            new_sms = await shard_pool.scan(session, csrf_token, to_date, polled_ranges, number_tracker)
+                            for sms in new_sms:
+                                logger.info("New SMS: %s", sms, extra={"cycle": cycle, "range": sms.range, "number": sms.number})
+                            polled_ranges = []
+                        
+                        number_responses = await scheduler.map(STATISTICS, "numbers", [
+                            functools.partial(payload_5, session, csrf_token, to_date, r.range_name)
+                            for r in polled_ranges
+                        ])
                         
                         # Process ranges
-                        for range_data in new_ranges:
-                            range_name = range_data["range_name"]
-                            current_count = range_data["count"]
+                        watchdog.set_phase("messages")
+                        for range_data, response in zip(polled_ranges, number_responses):
+                            range_name = range_data.range_name
+                            current_count = range_data.count
                             existing_range = existing_ranges_dict.get(range_name)
                             
-                            response = payload_5(session, csrf_token, to_date, range_name)
-                            logger.debug(f"Payload 5 response status: {response.status_code}")
-                            numbers = parse_numbers(response.text)
+                            logger.debug("Payload 5 response status: %s", response.status_code, extra={"cycle": cycle, "range": range_name})
+                            numbers = await parse_offloaded(parse_numbers, response.text)
                             
                             # Initialize number tracking for this range
-                            if range_name not in number_tracker:
-                                number_tracker[range_name] = {}
+                            tracked_numbers = number_tracker.setdefault(range_name, {})
+                            
+                            # Fetch all messages of every number in the range concurrently
+                            message_responses = await scheduler.map(MESSAGES, "messages", [
+                                functools.partial(payload_6, session, csrf_token, to_date, n.number, range_name)
+                                for n in numbers
+                            ])
                             
                             # Process new numbers or updated counts
-                            for number_data in numbers:
-                                number = number_data["number"]
-                                number_id = number_data["number_id"]
+                            for number_data, response in zip(numbers, message_responses):
+                                number = number_data.number
                                 
-                                # Fetch all messages for this number
-                                response = payload_6(session, csrf_token, to_date, number, range_name)
-                                logger.debug(f"Payload 6 response status: {response.status_code}")
-                                messages = parse_message(response.text)
+                                logger.debug("Payload 6 response status: %s", response.status_code, extra={"cycle": cycle, "range": range_name, "number": number})
                                 
                                 # Initialize number in tracker if not present
-                                if number not in number_tracker[range_name]:
-                                    number_tracker[range_name][number] = {
-                                        "number_id": number_id,
-                                        "message_count": 0,
-                                        "last_messages": []
-                                    }
+                                tracker_entry = tracked_numbers.get(number)
+                                if tracker_entry is None:
+                                    tracker_entry = tracked_numbers[number] = TrackedNumber(number_data.number_id, last_seen=time.time())
+                                elif tracker_entry.last_seen is None:
+                                    tracker_entry.last_seen = time.time()
                                 
                                 # Check for new or multiple messages
-                                current_message_count = len(messages)
-                                tracked_message_count = number_tracker[range_name][number]["message_count"]
-                                
-                                if current_message_count > tracked_message_count:
-                                    new_messages = messages[:current_message_count - tracked_message_count]
-                                    for msg_data in new_messages[::-1]:
-                                        sms = {
-                                            "timestamp": msg_data["timestamp"],
-                                            "number": number,
-                                            "message": msg_data["message"],
-                                            "range": range_name,
-                                            "revenue": msg_data["revenue"]
-                                        }
-                                        logger.info(f"New SMS: {sms}")
-                                        await send_to_telegram(sms)
-                                    
-                                    number_tracker[range_name][number]["message_count"] = current_message_count
-                                    number_tracker[range_name][number]["last_messages"] = [msg["message"] for msg in messages]
+                                new_messages, current_message_count = await parse_offloaded(
+                                    parse_number_messages, response.text, tracker_entry.last_digest, tracker_entry.message_count
+                                )
+                                for sms in track_messages(tracker_entry, number, range_name, new_messages, current_message_count):
+                                    logger.info("New SMS: %s", sms, extra={"cycle": cycle, "range": range_name, "number": number})
+                                    new_sms.append(sms)
                             
                             # Update range data
                             if not existing_range:
-                                logger.info(f"New range detected: {range_name}")
-                                existing_ranges.append(range_data)
-                                existing_ranges_dict[range_name] = range_data
-                            elif current_count != existing_range["count"]:
-                                logger.info(f"Count updated for {range_name}: {existing_range['count']} -> {current_count}")
-                                for r in existing_ranges:
-                                    if r["range_name"] == range_name:
-                                        r["count"] = current_count
-                                        r["paid"] = range_data["paid"]
-                                        r["unpaid"] = range_data["unpaid"]
-                                        r["revenue"] = range_data["revenue"]
-                                        break
-                                existing_ranges_dict[range_name] = range_data
+                                logger.info("New range detected: %s", range_name, extra={"cycle": cycle, "range": range_name})
+                            elif current_count != existing_range.count:
+                                logger.info("Count updated for %s: %s -> %s", range_name, existing_range.count, current_count, extra={"cycle": cycle, "range": range_name})
+                        
+                        # Extract OTP codes for the whole batch, route it to chats, record it in the outbox, archive it, then deliver
+                        watchdog.set_phase("delivery")
+                        await ingest_sms(new_sms, archive, router, outbox, bot)
+                        detected.extend(new_sms)
                         
                         # Update storage
-                        existing_ranges = new_ranges
-                        existing_ranges_dict = new_ranges_dict
-                        save_to_json(existing_ranges, JSON_FILE)
-                        save_to_json(number_tracker, NUMBER_TRACKER_FILE)
+                        watchdog.set_phase("storage")
+                        existing_ranges_dict = {r.range_name: r for r in new_ranges}
+                        statistics_data = [to_dict(r) for r in new_ranges]
+                        tracker_data = dump_tracker(number_tracker)
+                        save_to_json(statistics_data, STATISTICS_FILE)
+                        save_to_json(tracker_data, NUMBER_TRACKER_FILE)
+                        if replica is not None and (new_sms or time.time() - last_state_publish >= HA_STATE_INTERVAL):
+                            last_state_publish = time.time()
+                            await replica.publish({
+                                "tracker": tracker_data,
+                                "statistics": statistics_data,
+                                "pending": [to_dict(sms) for _, sms in outbox.pending(due=False)],
+                                "recent": [to_dict(sms) for sms in recent_sms],
+                                "session": {"cookies": dict(session.cookies.items()), "csrf_token": csrf_token, "started": session_start},
+                            })
+                        if time.time() - last_archive_prune >= 86400:
+                            last_archive_prune = time.time()
+                            await asyncio.to_thread(archive.prune, ARCHIVE_RETENTION_DAYS * 86400)
+                        
+                        # Automatic number return policy
+                        watchdog.set_phase("housekeeping")
+                        if AUTO_RETURN in ("otp", "idle") and time.time() - last_auto_return >= AUTO_RETURN_INTERVAL:
+                            last_auto_return = time.time()
+                            selected = select_numbers_to_return(number_tracker, AUTO_RETURN, idle_hours=AUTO_RETURN_IDLE_HOURS)
+                            if selected:
+                                batch_results = await return_numbers(session, csrf_token, [number_id for _, _, number_id in selected], HOUSEKEEPING)
+                                returned = mark_returned(number_tracker, selected, batch_results)
+                                logger.info("Auto-return (%s): %s/%s numbers returned in %s batches", AUTO_RETURN, returned, len(selected), len(batch_results))
+                                save_to_json(dump_tracker(number_tracker), NUMBER_TRACKER_FILE)
+                        
+                        # Bounded runs (--once, --duration) end here rather than sleeping past their end
+                        if max_cycles is not None and cycle >= max_cycles:
+                            return run_summary(run_started, cycle, detected, 0)
+                        sleep_for = LIVE_FEED_STATS_INTERVAL if pushing else POLL_INTERVAL + (time.time() % 1)
+                        if deadline is not None and time.monotonic() + sleep_for >= deadline:
+                            watchdog.set_phase("sleep")
+                            await asyncio.sleep(max(0, deadline - time.monotonic()))
+                            return run_summary(run_started, cycle, detected, live_feed.pushed if live_feed else 0)
                         
-                        await asyncio.sleep(2 + (time.time() % 1))
+                        watchdog.set_phase("sleep")
+                        if pushing:
+                            await live_feed.wait_until_down(sleep_for)
+                        else:
+                            await asyncio.sleep(sleep_for)
                     
             except Exception as e:
-                logger.error(f"Error in main loop: {str(e)}. Response content: {getattr(e, 'response', 'No response')}")
+                if bot_task is not None and bot_task.done() and not bot_task.cancelled() and bot_task.exception():
+                    raise bot_task.exception()
+                if max_cycles is not None:
+                    raise
+                logger.error("Error in main loop: %s. Response content: %s", e, getattr(e, 'response', 'No response'))
                 retry_delay = min(30 * 2 ** min(3, 1), 300)
-                logger.info(f"Retrying in {retry_delay} seconds...")
+                if deadline is not None:
+                    retry_delay = max(0, min(retry_delay, deadline - time.monotonic()))
+                logger.info("Retrying in %s seconds...", retry_delay)
                 await asyncio.sleep(retry_delay)
     
     except Exception as e:
-        logger.error(f"Main loop failed: {str(e)}")
+        logger.error("Main loop failed: %s", e)
         raise
+    finally:
+        await stop_poller(bot_task, (watchdog_task, active_refresh, live_task, shards_started), shard_pool)
 
-if __name__ == "__main__":
+async def run_replica(replica, receive_updates=True):
+    """Run as one HA replica: standby until it holds the lease, then poll and send for as long as it keeps it."""
+    while True:
+        restore_replica_state(await replica.acquire())
+        poller = asyncio.create_task(main(replica, receive_updates))
+        keeper = asyncio.create_task(replica.keep())
+        try:
+            await asyncio.wait({poller, keeper}, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            poller.cancel()
+            keeper.cancel()
+            await asyncio.gather(poller, return_exceptions=True)
+            await replica.release()
+            raise
+        if poller.done():
+            # The poller failed: hand the lease over right away rather than letting it expire
+            keeper.cancel()
+            await replica.release()
+            return poller.result()
+        poller.cancel()
+        await asyncio.gather(poller, return_exceptions=True)
+        logger.warning("Stopped polling after losing the HA lease, back to standby")
+
+def main_cli(argv=None):
+    """Command line entry point; returns the process exit code."""
+    parser = argparse.ArgumentParser(description="Forward new ivasms.com SMS to Telegram.")
+    bounded = parser.add_mutually_exclusive_group()
+    bounded.add_argument("--once", action="store_true", help="run one login and full scan cycle, print what it found and exit")
+    bounded.add_argument("--duration", type=float, metavar="N", help="run for N seconds, print the summary and exit")
+    parser.add_argument("--no-bot", action="store_true",
+                        help="handle no Telegram commands; notifications are still sent when BOT_TOKEN is set")
+    parser.add_argument("--json", metavar="PATH", help="write the summary of --once/--duration as JSON to PATH ('-' for stdout)")
+    args = parser.parse_args(argv)
+    if HA_STORE and (args.once or args.duration):
+        parser.error("--once and --duration run a single instance, unset HA_STORE")
 
-    asyncio.run(main())
+    setup_logging()
+    if not (args.once or args.duration):
+        asyncio.run(run_replica(Replica.from_env(), not args.no_bot) if HA_STORE else main(receive_updates=not args.no_bot))
+        return 0
+
+    summary = asyncio.run(main(receive_updates=not args.no_bot, max_cycles=1 if args.once else None, duration=args.duration))
+    if args.json == "-":
+        json.dump(summary, sys.stdout, indent=4, ensure_ascii=False)
+        print()
+    else:
+        print_summary(summary)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(summary, f, indent=4, ensure_ascii=False)
+    return 0 if summary["cycles"] else 1
+
+STARTUP_TIMINGS["import"] = time.perf_counter() - _IMPORT_STARTED
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
 
 
@@ -0,0 +1,86 @@
+import sys
+from dataclasses import dataclass, field
+from typing import Optional
+
+@dataclass(slots=True)
+class RangeStats:
+    """One range card of the statistics page."""
+
+    range_name: str
+    range_id: str
+    count: int = 0
+    paid: int = 0
+    unpaid: int = 0
+    revenue: float = 0.0
+
+    def __post_init__(self):
+        self.range_name = sys.intern(self.range_name)
+
+@dataclass(slots=True)
+class NumberInfo:
+    """A number listed under a range."""
+
+    number: str
+    number_id: str
+
+    def __post_init__(self):
+        self.number = sys.intern(self.number)
+
+@dataclass(slots=True)
+class Message:
+    """A message row of a number's SMS list."""
+
+    timestamp: str
+    message: str
+    revenue: str
+
+@dataclass(slots=True)
+class SMS:
+    """A detected SMS on its way to the archive, the router and Telegram."""
+
+    timestamp: str
+    number: str
+    message: str
+    range: str
+    revenue: str
+    sender: Optional[str] = None
+    service: Optional[str] = None
+    otp: Optional[str] = None
+    chat_id: Optional[str] = None
+
+    def __post_init__(self):
+        self.number = sys.intern(self.number)
+        self.range = sys.intern(self.range)
+
+@dataclass(slots=True)
+class TrackedNumber:
+    """Per-number tracking state kept between ticks."""
+
+    number_id: str
+    message_count: int = 0
+    last_messages: list = field(default_factory=list)
+    last_digest: Optional[str] = None
+    last_seen: Optional[float] = None
+    returned: bool = False
+
+def to_dict(record):
+    """Serialize a record to its storage dict (a shallow field copy, far cheaper than dataclasses.asdict)."""
+    return {name: getattr(record, name) for name in record.__slots__}
+
+def from_dict(cls, data):
+    """Build a record from a storage dict, ignoring fields the model does not know."""
+    return cls(**{name: data[name] for name in cls.__slots__ if name in data})
+
+def dump_tracker(number_tracker):
+    """Serialize {range: {number: TrackedNumber}} to the number_tracker.json layout."""
+    return {
+        range_name: {number: to_dict(entry) for number, entry in numbers.items()}
+        for range_name, numbers in number_tracker.items()
+    }
+
+def load_tracker(data):
+    """Rebuild {range: {number: TrackedNumber}} from number_tracker.json, interning the keys."""
+    return {
+        sys.intern(range_name): {sys.intern(number): from_dict(TrackedNumber, entry) for number, entry in numbers.items()}
+        for range_name, numbers in (data or {}).items()
+    }
@@ -0,0 +1,88 @@
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+# Service name -> (keyword pattern, code pattern). Code patterns capture the OTP in group 1.
+SERVICE_PATTERNS = {
+    "WhatsApp": (r"whatsapp", r"(?<![\d-])(\d{3}[- ]\d{3}|\d{6})(?![\d-])"),
+    "Telegram": (r"telegram", r"(?:code|код)\D{0,15}?(\d{5,6})\b"),
+    "Google": (r"google|\bG-\d", r"\bG-(\d{6})\b"),
+    "Facebook": (r"facebook|\bFB-\d", r"\bFB-(\d{5,8})\b"),
+    "Instagram": (r"instagram", r"(?<![\d-])(\d{3} ?\d{3})(?![\d-])"),
+    "TikTok": (r"tiktok", r"\[TikTok\]\s*(\d{4,6})|(?<!\d)(\d{6})(?!\d)"),
+    "Microsoft": (r"microsoft", r"(?:code|security code)\D{0,10}?(\d{4,8})\b"),
+    "Apple": (r"apple", r"(?<!\d)(\d{6})(?!\d)"),
+    "Amazon": (r"amazon", r"(?<!\d)(\d{6})(?!\d)"),
+    "Viber": (r"viber", r"(?<!\d)(\d{4,6})(?!\d)"),
+    "Signal": (r"signal", r"(?<![\d-])(\d{3}-?\d{3})(?![\d-])"),
+    "Snapchat": (r"snapchat", r"(?<![\d-])(\d{3}-?\d{3})(?![\d-])"),
+    "Uber": (r"\buber\b", r"(?<!\d)(\d{4})(?!\d)"),
+    "Binance": (r"binance", r"(?<!\d)(\d{6})(?!\d)"),
+}
+
+# Fallback when no service matched or the service pattern found nothing
+GENERIC_KEYWORD_PATTERN = re.compile(
+    r"(?:code|otp|pin|passcode|password|verification|كود|رمز|código|codigo|код)\D{0,20}?(\d(?:[- ]?\d){3,7})(?!\d)",
+    re.IGNORECASE,
+)
+GENERIC_CODE_PATTERN = re.compile(r"(?<![\d+])(\d{3}[- ]\d{3}|\d{4,8})(?![\d])")
+
+# Single-pass service detector: one named group per service
+_SERVICE_NAMES = list(SERVICE_PATTERNS)
+SERVICE_DETECTOR = re.compile(
+    "|".join(f"(?P<s{i}>{keyword})" for i, (keyword, _) in enumerate(SERVICE_PATTERNS.values())),
+    re.IGNORECASE,
+)
+SERVICE_CODE_PATTERNS = {
+    name: re.compile(code, re.IGNORECASE) for name, (_, code) in SERVICE_PATTERNS.items()
+}
+_SERVICES_BY_SENDER = {name.lower(): name for name in SERVICE_PATTERNS}
+
+def _parse_range_services(value):
+    """Parse OTP_RANGE_SERVICES ("RANGE PREFIX=Service;...") into a prefix map."""
+    mapping = {}
+    for item in filter(None, (part.strip() for part in value.split(";"))):
+        prefix, _, service = item.partition("=")
+        if service.strip() in SERVICE_CODE_PATTERNS:
+            mapping[prefix.strip().upper()] = service.strip()
+        else:
+            logger.warning("Ignoring OTP_RANGE_SERVICES entry with unknown service: %s", item)
+    return mapping
+
+# Range-name prefixes that always belong to one service
+RANGE_SERVICES = _parse_range_services(os.getenv("OTP_RANGE_SERVICES", ""))
+
+def service_for(sms):
+    """Resolve the service of an SMS by sender, then range prefix, then message keywords."""
+    sender = sms.sender
+    if sender and sender.lower() in _SERVICES_BY_SENDER:
+        return _SERVICES_BY_SENDER[sender.lower()]
+    range_name = sms.range.upper()
+    for prefix, service in RANGE_SERVICES.items():
+        if range_name.startswith(prefix):
+            return service
+    match = SERVICE_DETECTOR.search(sms.message)
+    if match:
+        return _SERVICE_NAMES[int(match.lastgroup[1:])]
+    return None
+
+def extract_code(message, service=None):
+    """Extract the OTP from a message, normalised to digits only."""
+    match = None
+    if service:
+        match = SERVICE_CODE_PATTERNS[service].search(message)
+    if not match:
+        match = GENERIC_KEYWORD_PATTERN.search(message) or GENERIC_CODE_PATTERN.search(message)
+    if not match:
+        return None
+    code = next(group for group in match.groups() if group)
+    return code.replace(" ", "").replace("-", "")
+
+def extract_otps(sms_batch):
+    """Set the service and otp of every SMS of a batch in place and return the batch."""
+    for sms in sms_batch:
+        sms.service = service_for(sms)
+        sms.otp = extract_code(sms.message, sms.service)
+    return sms_batch
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from models import SMS, from_dict, to_dict
+
+logger = logging.getLogger(__name__)
+
+class Outbox:
+    """Durable outbox of detected SMS awaiting Telegram delivery.
+
+    Every SMS is recorded under an idempotency key before it is sent and
+    marked delivered afterwards, so a restart replays what was not confirmed
+    and a re-detected SMS is never queued twice. Writes are batched per call
+    and the database runs in WAL mode with synchronous=NORMAL, so recording a
+    cycle, or the outcomes of one chat's deliveries, costs one commit rather
+    than one fsync per message. Calls may come from worker threads; they are
+    serialised on one connection.
+
+    A failed entry is retried with exponential backoff, from `retry_base` up
+    to `retry_max` seconds between attempts, until it has been undelivered
+    for `give_up_after` seconds, so an outage of the Bot API delays
+    notifications rather than dropping them.
+    """
+
+    def __init__(self, path, give_up_after=86400, retry_base=2.0, retry_max=300.0):
+        self.path = path
+        self.give_up_after = give_up_after
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " key TEXT PRIMARY KEY,"
+            " sms TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " delivered REAL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt REAL NOT NULL DEFAULT 0)"
+        )
+        # Outboxes created before retries were scheduled
+        if "next_attempt" not in {row[1] for row in self.db.execute("PRAGMA table_info(outbox)")}:
+            self.db.execute("ALTER TABLE outbox ADD COLUMN next_attempt REAL NOT NULL DEFAULT 0")
+        self.db.execute("CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (delivered, created)")
+        self.db.commit()
+
+    @staticmethod
+    def key_for(sms):
+        """Return the idempotency key of an SMS (range, number, portal timestamp, text and chat)."""
+        key = f"{sms.range}\x00{sms.number}\x00{sms.timestamp}\x00{sms.message}"
+        if sms.chat_id:
+            key += f"\x00{sms.chat_id}"
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def add(self, sms_batch):
+        """Record a batch of SMS in one transaction; returns how many were not already known."""
+        now = time.time()
+        with self.lock, self.db:
+            before = self.db.total_changes
+            self.db.executemany(
+                "INSERT OR IGNORE INTO outbox (key, sms, created) VALUES (?, ?, ?)",
+                [(self.key_for(sms), json.dumps(to_dict(sms)), now) for sms in sms_batch],
+            )
+            return self.db.total_changes - before
+
+    def pending(self, due=True):
+        """Return [(key, sms)] not yet delivered or given up, oldest first; only those due for an attempt unless `due` is False."""
+        now = time.time()
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT key, sms FROM outbox WHERE delivered IS NULL AND created > ? AND (? OR next_attempt <= ?)"
+                " ORDER BY created, rowid",
+                (now - self.give_up_after, not due, now),
+            ).fetchall()
+        return [(key, from_dict(SMS, json.loads(sms))) for key, sms in rows]
+
+    def mark(self, delivered, failed):
+        """Record delivery outcomes in one transaction: `delivered` keys are done, `failed` keys
+        count an attempt and are scheduled for their next one."""
+        if not delivered and not failed:
+            return
+        now = time.time()
+        given_up = 0
+        with self.lock, self.db:
+            self.db.executemany("UPDATE outbox SET delivered = ? WHERE key = ?", [(now, key) for key in delivered])
+            if failed:
+                self.db.executemany(
+                    "UPDATE outbox SET attempts = attempts + 1,"
+                    " next_attempt = ? + MIN(?, ? * (1 << MIN(attempts, 20))) WHERE key = ?",
+                    [(now, self.retry_max, self.retry_base, key) for key in failed],
+                )
+                given_up = self.db.execute(
+                    f"SELECT COUNT(*) FROM outbox WHERE key IN ({','.join('?' * len(failed))}) AND created <= ?",
+                    (*failed, now - self.give_up_after),
+                ).fetchone()[0]
+        if given_up:
+            logger.error("Giving up on %s outbox messages undelivered for %.0f s", given_up, self.give_up_after)
+
+    def prune(self, retention_seconds):
+        """Delete delivered entries older than the retention period, and given up ones as long after giving up."""
+        now = time.time()
+        with self.lock, self.db:
+            cursor = self.db.execute(
+                "DELETE FROM outbox WHERE (delivered IS NOT NULL AND delivered < ?) OR (delivered IS NULL AND created < ?)",
+                (now - retention_seconds, now - retention_seconds - self.give_up_after),
+            )
+        return cursor.rowcount
+
+    def close(self):
+        self.db.close()
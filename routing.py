@@ -0,0 +1,121 @@
+import dataclasses
+import json
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+class PrefixTrie:
+    """Character trie mapping prefixes to the chats of the rules that use them."""
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, prefix, chats):
+        node = self.root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node.setdefault(None, []).extend(chats)
+
+    def match(self, value):
+        """Return the chats of every prefix of value, in O(len(value))."""
+        chats = []
+        node = self.root
+        if None in node:
+            chats.extend(node[None])
+        for char in value:
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                chats.extend(node[None])
+        return chats
+
+class Router:
+    """Compiled routing table deciding which chats receive an SMS.
+
+    Rules match on one of range_prefix, number_prefix, sender (exact, also
+    tried against the extracted service) or keyword (word or phrase in the
+    message). Prefix rules live in tries and sender/single-word keyword rules
+    in dicts, so lookups cost O(prefix length) or O(words in the message)
+    however many rules there are. SMS matching no rule go to the default chats.
+    """
+
+    def __init__(self, rules, default_chats):
+        self.default_chats = list(default_chats)
+        self.range_prefixes = PrefixTrie()
+        self.number_prefixes = PrefixTrie()
+        self.senders = {}
+        self.keywords = {}
+        phrases = {}
+        for rule in rules:
+            chats = [str(chat) for chat in rule.get("chats", [])]
+            if not chats:
+                logger.warning("Ignoring route without chats: %s", rule)
+            elif "range_prefix" in rule:
+                self.range_prefixes.add(rule["range_prefix"].upper(), chats)
+            elif "number_prefix" in rule:
+                self.number_prefixes.add(rule["number_prefix"].lstrip("+"), chats)
+            elif "sender" in rule:
+                self.senders.setdefault(rule["sender"].lower(), []).extend(chats)
+            elif "keyword" in rule:
+                keyword = rule["keyword"].lower()
+                if re.fullmatch(r"\w+", keyword):
+                    self.keywords.setdefault(keyword, []).extend(chats)
+                else:
+                    phrases.setdefault(keyword, []).extend(chats)
+            else:
+                logger.warning("Ignoring route without a match field: %s", rule)
+        self.phrases = phrases
+        self.phrase_pattern = re.compile("|".join(map(re.escape, phrases))) if phrases else None
+
+    def route(self, sms):
+        """Return the de-duplicated list of chats an SMS is delivered to."""
+        chats = self.range_prefixes.match(sms.range.upper())
+        chats += self.number_prefixes.match(sms.number.lstrip("+"))
+        for sender in (sms.sender, sms.service):
+            if sender:
+                chats += self.senders.get(sender.lower(), [])
+        message = sms.message.lower()
+        if self.keywords:
+            for word in set(re.findall(r"\w+", message)):
+                chats += self.keywords.get(word, [])
+        if self.phrase_pattern:
+            for phrase in set(self.phrase_pattern.findall(message)):
+                chats += self.phrases[phrase]
+        return list(dict.fromkeys(chats or self.default_chats))
+
+    def fan_out(self, sms_batch):
+        """Expand a batch into one copy of each SMS per destination chat (sets chat_id).
+
+        An SMS with no destination (no rule matched and no default chat) is
+        logged, since it will not be notified anywhere.
+        """
+        routed = []
+        for sms in sms_batch:
+            chats = self.route(sms)
+            if not chats:
+                logger.warning("No route and no default chat for an SMS on +%s (%s), it is not notified", sms.number, sms.range,
+                               extra={"range": sms.range, "number": sms.number})
+            for chat_id in chats:
+                routed.append(dataclasses.replace(sms, chat_id=chat_id))
+        return routed
+
+def load_router(path, default_chat):
+    """Build the Router from a JSON routes file ({"default": [...], "rules": [...]} or a list of rules)."""
+    config = {}
+    try:
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+    except Exception as e:
+        logger.error("Failed to load routes from %s: %s", path, e)
+    if isinstance(config, list):
+        config = {"rules": config}
+    default_chats = config.get("default") or ([default_chat] if default_chat else [])
+    router = Router(config.get("rules", []), [str(chat) for chat in default_chats])
+    logger.info("Loaded %s routing rules", len(config.get("rules", [])))
+    if not default_chats:
+        logger.warning("No default chat (CHAT_ID or \"default\" in the routes file): SMS matching no rule will not be notified")
+    return router
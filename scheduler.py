@@ -0,0 +1,209 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from collections import deque
+
+from transport import UPSTREAM_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, most urgent first
+MESSAGES, STATISTICS, COMMANDS, HOUSEKEEPING = range(4)
+PRIORITY_NAMES = ("messages", "statistics", "commands", "housekeeping")
+
+# Global request budget (requests per second and burst size; a rate of 0 disables the budget)
+UPSTREAM_RATE = float(os.getenv("UPSTREAM_RATE", "20"))
+UPSTREAM_BURST = float(os.getenv("UPSTREAM_BURST", "40"))
+
+# Concurrent requests per endpoint; override with UPSTREAM_LIMIT_<NAME>
+ENDPOINT_LIMITS = {
+    "login": 2,
+    "portal": 2,
+    "statistics": 2,
+    "numbers": 4,
+    "messages": 8,
+    "test_sms": 4,
+    "return": 2,
+    "active": 1,
+    "live_feed": 1,
+}
+
+def endpoint_limit(name):
+    """Return the concurrency cap of an upstream endpoint."""
+    override = os.getenv(f"UPSTREAM_LIMIT_{name.upper()}")
+    if override:
+        try:
+            return max(1, int(override))
+        except ValueError:
+            logger.warning("Ignoring invalid UPSTREAM_LIMIT_%s: %s", name.upper(), override)
+    return ENDPOINT_LIMITS.get(name, UPSTREAM_CONCURRENCY)
+
+class UpstreamScheduler:
+    """Single gate every upstream request goes through.
+
+    A request is started when a global concurrency slot, a slot of its
+    endpoint and a token of the request budget are all free. Waiting
+    requests sit in one heap per endpoint ordered by (priority, arrival), and
+    each grant picks the most urgent head among endpoints with spare
+    capacity, so a full endpoint never holds up others and a grant costs
+    O(endpoints). How long each priority class waited is kept for metrics.
+
+    Queues, slots and the refill timer belong to one event loop; they are
+    reset when the scheduler is first used from another loop.
+    """
+
+    def __init__(self, rate, burst, concurrency):
+        self.configured = (rate, burst, concurrency)
+        self.fraction = 1.0
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.concurrency = concurrency
+        self.tokens = self.burst
+        self.refilled = time.monotonic()
+        self.running = 0
+        self.running_by_endpoint = {}
+        self.limits = {}
+        self.queues = {}
+        self.sequence = itertools.count()
+        self.refill_timer = None
+        self.loop = None
+        # Bumped by reset(), so slots taken before it are not released into the new state
+        self.generation = 0
+        self.waits = [deque(maxlen=2048) for _ in PRIORITY_NAMES]
+        self.granted = [0] * len(PRIORITY_NAMES)
+
+    async def call(self, priority, endpoint, fn, *args):
+        """Run a blocking upstream call in a worker thread once the scheduler admits it."""
+        enqueued = time.monotonic()
+        await self._acquire(priority, endpoint)
+        generation = self.generation
+        self.waits[priority].append(time.monotonic() - enqueued)
+        self.granted[priority] += 1
+        try:
+            return await asyncio.to_thread(fn, *args)
+        finally:
+            if generation == self.generation:
+                self._release(endpoint)
+
+    async def map(self, priority, endpoint, calls):
+        """Run zero-argument blocking calls through the scheduler, preserving order."""
+        return await asyncio.gather(*(self.call(priority, endpoint, call) for call in calls))
+
+    def share(self, fraction):
+        """Scale the request budget and every concurrency cap to `fraction` of the configured ones.
+
+        Used when several processes (the poller and its shard workers) call
+        the same upstream, so together they stay within one budget. Caps
+        never drop below one request.
+        """
+        rate, burst, concurrency = self.configured
+        self.fraction = fraction
+        self.rate = rate * fraction
+        self.burst = max(1.0, burst * fraction)
+        self.tokens = min(self.tokens, self.burst)
+        self.concurrency = max(1, int(concurrency * fraction))
+        self.limits = {endpoint: self._limit(endpoint) for endpoint in self.limits}
+
+    def _limit(self, endpoint):
+        return max(1, int(endpoint_limit(endpoint) * self.fraction))
+
+    def reset(self):
+        """Drop the state bound to the current event loop: queued requests, slots in use and the refill timer."""
+        if self.refill_timer is not None:
+            self.refill_timer.cancel()
+            self.refill_timer = None
+        self.loop = None
+        self.generation += 1
+        self.running = 0
+        self.running_by_endpoint = {}
+        self.limits = {}
+        self.queues = {}
+
+    async def _acquire(self, priority, endpoint):
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.reset()
+            self.loop = loop
+        future = loop.create_future()
+        if endpoint not in self.queues:
+            self.queues[endpoint] = []
+            self.limits[endpoint] = self._limit(endpoint)
+            self.running_by_endpoint[endpoint] = 0
+        heapq.heappush(self.queues[endpoint], (priority, next(self.sequence), future))
+        generation = self.generation
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and generation == self.generation:
+                # Granted but the caller went away before using the slot
+                self._release(endpoint)
+            raise
+
+    def _release(self, endpoint):
+        self.running -= 1
+        self.running_by_endpoint[endpoint] -= 1
+        self._dispatch()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+
+    def _on_refill(self):
+        self.refill_timer = None
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.running < self.concurrency:
+            best = None
+            for endpoint, queue in self.queues.items():
+                while queue and queue[0][2].done():
+                    heapq.heappop(queue)
+                if queue and self.running_by_endpoint[endpoint] < self.limits[endpoint]:
+                    if best is None or queue[0] < self.queues[best][0]:
+                        best = endpoint
+            if best is None:
+                return
+            if self.rate > 0:
+                self._refill()
+                if self.tokens < 1:
+                    if self.refill_timer is None:
+                        delay = (1 - self.tokens) / self.rate
+                        self.refill_timer = asyncio.get_running_loop().call_later(delay, self._on_refill)
+                    return
+                self.tokens -= 1
+            _, _, future = heapq.heappop(self.queues[best])
+            self.running += 1
+            self.running_by_endpoint[best] += 1
+            future.set_result(None)
+
+    def queued(self):
+        return sum(1 for queue in self.queues.values() for _, _, future in queue if not future.done())
+
+    def wait_stats(self):
+        """Return {priority name: {"requests", "p50", "p95", "max"}} of recent queue waits in seconds."""
+        stats = {}
+        for priority, name in enumerate(PRIORITY_NAMES):
+            waits = sorted(self.waits[priority])
+            if not waits:
+                continue
+            stats[name] = {
+                "requests": self.granted[priority],
+                "p50": waits[len(waits) // 2],
+                "p95": waits[min(len(waits) - 1, int(len(waits) * 0.95))],
+                "max": waits[-1],
+            }
+        return stats
+
+    def summary(self):
+        parts = [
+            f"{name} n={s['requests']} p50={s['p50'] * 1000:.0f}ms p95={s['p95'] * 1000:.0f}ms max={s['max'] * 1000:.0f}ms"
+            for name, s in self.wait_stats().items()
+        ]
+        return "; ".join(parts) or "no requests"
+
+scheduler = UpstreamScheduler(UPSTREAM_RATE, UPSTREAM_BURST, UPSTREAM_CONCURRENCY)
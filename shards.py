@@ -0,0 +1,251 @@
+import asyncio
+import bisect
+import functools
+import hashlib
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from models import TrackedNumber
+from scheduler import MESSAGES, STATISTICS, scheduler
+
+logger = logging.getLogger(__name__)
+
+# Worker processes scanning ranges in parallel (0 scans in the poller's own process)
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "0"))
+# Points per worker on the hash ring; more points spread ranges more evenly
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", "64"))
+# Seconds a failed worker stays off the ring before it is given ranges again
+SHARD_RETRY_AFTER = float(os.getenv("SHARD_RETRY_AFTER", "60"))
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.sha1(key.encode("utf-8")).digest()[:8], "big")
+
+class HashRing:
+    """Consistent hash ring mapping range names to workers.
+
+    Each worker owns `vnodes` points on the ring and a range belongs to the
+    first point at or after its hash, so ranges appearing or disappearing
+    never move other ranges, and adding or removing a worker only moves the
+    ranges of its own points.
+    """
+
+    def __init__(self, nodes=(), vnodes=SHARD_VNODES):
+        self.vnodes = vnodes
+        self.points = []
+        self.hashes = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        for i in range(self.vnodes):
+            bisect.insort(self.points, (ring_hash(f"{node}#{i}"), node))
+        self.hashes = [point for point, _ in self.points]
+
+    def remove(self, node):
+        self.points = [(point, owner) for point, owner in self.points if owner != node]
+        self.hashes = [point for point, _ in self.points]
+
+    @property
+    def nodes(self):
+        return {node for _, node in self.points}
+
+    def node_for(self, key):
+        if not self.points:
+            raise LookupError("hash ring has no nodes")
+        return self.points[bisect.bisect_left(self.hashes, ring_hash(key)) % len(self.points)][1]
+
+    def assign(self, keys):
+        """Return {node: [keys]} for every node on the ring."""
+        assignment = {node: [] for node in self.nodes}
+        for key in keys:
+            assignment[self.node_for(key)].append(key)
+        return assignment
+
+class ShardWorker:
+    """Scanner living in a worker process, holding the tracker state of the ranges assigned to it."""
+
+    def __init__(self, workers):
+        # Imported here rather than at module level: main imports this module
+        import main
+        from logconfig import setup_logging
+        from transport import create_session
+
+        setup_logging()
+        self.main = main
+        self.session = create_session()
+        self.cookies = None
+        self.tracker = {}
+        self.loop = asyncio.new_event_loop()
+        # The request budget and concurrency caps are split evenly between the poller and the workers
+        scheduler.share(1 / (workers + 1))
+
+    def scan(self, cookies, csrf_token, to_date, range_names, handoff):
+        """Scan the assigned ranges; returns (new SMS, changed tracker entries by range, pages fetched).
+
+        `handoff` carries the tracker state of ranges newly assigned to this
+        worker; state of ranges no longer assigned is dropped.
+        """
+        self.tracker.update(handoff)
+        assigned = set(range_names)
+        for range_name in [r for r in self.tracker if r not in assigned]:
+            del self.tracker[range_name]
+        if cookies != self.cookies:
+            self.session.cookies.update(cookies)
+            self.cookies = cookies
+        return self.loop.run_until_complete(self._scan(csrf_token, to_date, range_names))
+
+    async def _scan(self, csrf_token, to_date, range_names):
+        main = self.main
+        number_responses = await scheduler.map(STATISTICS, "numbers", [
+            functools.partial(main.payload_5, self.session, csrf_token, to_date, range_name)
+            for range_name in range_names
+        ])
+        numbers_by_range = [main.parse_numbers(response.text) for response in number_responses]
+        message_responses = await scheduler.map(MESSAGES, "messages", [
+            functools.partial(main.payload_6, self.session, csrf_token, to_date, n.number, range_name)
+            for range_name, numbers in zip(range_names, numbers_by_range)
+            for n in numbers
+        ])
+
+        # Every page is fetched before any tracker entry changes, so a failed scan leaves the state as it was
+        new_sms, changed = [], {}
+        responses = iter(message_responses)
+        for range_name, numbers in zip(range_names, numbers_by_range):
+            tracked_numbers = self.tracker.setdefault(range_name, {})
+            for number_data in numbers:
+                response = next(responses)
+                tracker_entry = tracked_numbers.get(number_data.number)
+                is_new = tracker_entry is None or tracker_entry.last_seen is None
+                if tracker_entry is None:
+                    tracker_entry = tracked_numbers[number_data.number] = TrackedNumber(number_data.number_id, last_seen=time.time())
+                elif tracker_entry.last_seen is None:
+                    tracker_entry.last_seen = time.time()
+                new_messages, current_message_count = main.parse_number_messages(
+                    response.text, tracker_entry.last_digest, tracker_entry.message_count
+                )
+                detected = main.track_messages(tracker_entry, number_data.number, range_name, new_messages, current_message_count)
+                if detected or is_new:
+                    changed.setdefault(range_name, {})[number_data.number] = tracker_entry
+                new_sms.extend(detected)
+        return new_sms, changed, len(number_responses) + len(message_responses)
+
+# The ShardWorker of this process, when it is a shard worker
+_worker = None
+
+def _init_worker(workers):
+    global _worker
+    _worker = ShardWorker(workers)
+
+def _ping():
+    return os.getpid()
+
+def _scan_shard(cookies, csrf_token, to_date, range_names, handoff):
+    return _worker.scan(cookies, csrf_token, to_date, range_names, handoff)
+
+def merge_tracked(number_tracker, changed):
+    """Merge tracker entries changed by a worker into the poller's tracker, keeping its own `returned` flags."""
+    for range_name, entries in changed.items():
+        tracked_numbers = number_tracker.setdefault(range_name, {})
+        for number, entry in entries.items():
+            current = tracked_numbers.get(number)
+            if current is None:
+                tracked_numbers[number] = entry
+                continue
+            current.message_count = entry.message_count
+            current.last_messages = entry.last_messages
+            current.last_digest = entry.last_digest
+            if entry.last_seen is not None and (current.last_seen is None or entry.last_seen > current.last_seen):
+                current.last_seen = entry.last_seen
+
+class ShardPool:
+    """Parallel range scan over worker processes, driven by the poller.
+
+    The poller logs in once and each tick hands its ranges to the workers by
+    consistent hashing, along with the session cookies and CSRF token. Each
+    worker fetches and parses its ranges and keeps their tracker state, so
+    state only crosses processes when a range is handed to a worker that
+    does not hold it yet. Workers send back the SMS they detected and the
+    tracker entries that changed, which the poller merges into its own
+    tracker and delivers through its single outbox. A worker that fails is
+    taken off the ring for SHARD_RETRY_AFTER seconds and its ranges move to
+    the others. While the pool is open, the poller and each worker get an
+    equal share of the request budget and concurrency caps.
+    """
+
+    def __init__(self, workers, vnodes=SHARD_VNODES):
+        self.workers = workers
+        # Spawned, not forked: the poller has threads running
+        self.context = multiprocessing.get_context("spawn")
+        self.executors = {f"shard-{i}": self._spawn() for i in range(workers)}
+        self.ring = HashRing(self.executors, vnodes)
+        self.holding = {name: set() for name in self.executors}
+        self.failed_at = {}
+        self.pages = 0
+        scheduler.share(1 / (workers + 1))
+
+    def _spawn(self):
+        return ProcessPoolExecutor(max_workers=1, mp_context=self.context, initializer=_init_worker, initargs=(self.workers,))
+
+    async def start(self):
+        """Start every worker process now rather than on its first scan."""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(executor, _ping) for executor in self.executors.values()))
+
+    def _fail(self, name, error):
+        logger.error("Shard %s failed, its ranges are rescanned next tick: %s", name, error)
+        self.holding[name] = set()
+        if isinstance(error, BrokenProcessPool):
+            self.executors[name].shutdown(wait=False)
+            self.executors[name] = self._spawn()
+        if len(self.ring.nodes) > 1:
+            self.ring.remove(name)
+            self.failed_at[name] = time.monotonic()
+
+    def _rejoin(self):
+        now = time.monotonic()
+        for name, failed in list(self.failed_at.items()):
+            if now - failed >= SHARD_RETRY_AFTER:
+                del self.failed_at[name]
+                self.ring.add(name)
+                logger.info("Shard %s rejoined the ring", name)
+
+    def invalidate(self, range_names):
+        """Hand the poller's tracker state of `range_names` to their workers again on the next scan."""
+        for holding in self.holding.values():
+            holding.difference_update(range_names)
+
+    async def scan(self, session, csrf_token, to_date, ranges, number_tracker):
+        """Scan `ranges` across the workers; returns the SMS detected, merging tracker changes."""
+        self._rejoin()
+        cookies = dict(session.cookies.items())
+        assignment = self.ring.assign(r.range_name for r in ranges)
+        loop = asyncio.get_running_loop()
+        names = list(assignment)
+        results = await asyncio.gather(*(
+            loop.run_in_executor(
+                self.executors[name], _scan_shard, cookies, csrf_token, to_date, assignment[name],
+                {r: number_tracker.get(r, {}) for r in assignment[name] if r not in self.holding[name]},
+            )
+            for name in names
+        ), return_exceptions=True)
+
+        new_sms = []
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                self._fail(name, result)
+                continue
+            shard_sms, changed, pages = result
+            self.holding[name] = set(assignment[name])
+            merge_tracked(number_tracker, changed)
+            new_sms.extend(shard_sms)
+            self.pages += pages
+        return new_sms
+
+    def close(self):
+        for executor in self.executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        scheduler.share(1.0)
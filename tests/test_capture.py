@@ -0,0 +1,69 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+import main
+from capture import RecordingSession, ReplaySession, request_key
+
+class FakeResponse:
+    def __init__(self, url, text):
+        self.status_code = 200
+        self.url = url
+        self.headers = {"Content-Type": "application/json"}
+        self.text = text
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return json.loads(self.text)
+
+class FakeSession:
+    """Upstream session answering every GET with one DataTables page."""
+
+    cookies = {}
+
+    def __init__(self, text):
+        self.text = text
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        return FakeResponse(url, self.text)
+
+    def close(self):
+        pass
+
+class RequestKeyTest(unittest.TestCase):
+    def test_cache_buster_is_ignored(self):
+        first = request_key("GET", "https://portal.test/portal/sms/test/sms?app=WhatsApp&start=0&_=1700000000000")
+        second = request_key("GET", "https://portal.test/portal/sms/test/sms?app=WhatsApp&start=0&_=1700000999999")
+        self.assertEqual(first, second)
+
+    def test_query_dates_are_normalised(self):
+        first = request_key("GET", "https://portal.test/portal/sms", params={"from": "01/02/2025"})
+        second = request_key("GET", "https://portal.test/portal/sms", params={"from": "03/04/2026"})
+        self.assertEqual(first, second)
+
+    def test_other_parameters_still_distinguish_requests(self):
+        first = request_key("GET", "https://portal.test/portal/sms/test/sms?app=WhatsApp&start=0")
+        second = request_key("GET", "https://portal.test/portal/sms/test/sms?app=WhatsApp&start=25")
+        self.assertNotEqual(first, second)
+
+class ReplayTest(unittest.TestCase):
+    def test_payload_7_replays(self):
+        page = {"recordsFiltered": 1, "data": [{"range": "IVORY COAST 1", "originator": "WhatsApp"}]}
+        with tempfile.TemporaryDirectory() as state_dir:
+            path = os.path.join(state_dir, "capture.jsonl.gz")
+            recorder = RecordingSession(FakeSession(json.dumps(page)), path)
+            self.assertEqual(main.payload_7(recorder, "WhatsApp"), page)
+            recorder.writer.file.close()
+
+            # The `_` parameter of the replayed request differs from the recorded one
+            time.sleep(0.01)
+            replayer = ReplaySession(path, scale=0)
+            self.assertEqual(main.payload_7(replayer, "WhatsApp"), page)
+            self.assertEqual(sum(replayer.capture.misses.values()), 0)
+
+if __name__ == "__main__":
+    unittest.main()
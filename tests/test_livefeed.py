@@ -0,0 +1,112 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+import main
+from archive import Archive
+from livefeed import LiveFeed
+from models import TrackedNumber
+from outbox import Outbox
+from routing import load_router
+
+class FakeResponse:
+    def __init__(self, data):
+        self.status_code = 200
+        self.text = json.dumps(data)
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return json.loads(self.text)
+
+class FakeFeedSession:
+    """Live feed answering each long-poll with the next of the given responses."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.params = []
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        self.params.append(dict(params))
+        return FakeResponse(self.responses.pop(0))
+
+def event(message, timestamp):
+    return {"range": "IVORY COAST 1", "number": "22500000001", "message": message, "timestamp": timestamp, "revenue": "0.01"}
+
+def messages_page(messages):
+    """A number's SMS page in the portal's markup, newest first."""
+    rows = "".join(
+        "<tr><td>"
+        f'<div class="col-9 col-sm-6 text-center text-sm-start"><p>{message}</p></div>'
+        '<div class="col-3 col-sm-2 text-center text-sm-start"><span class="currency_cdr">0.01</span></div>'
+        f'<div class="col-12 col-sm-4 text-center text-sm-start"><p>{timestamp}</p></div>'
+        "</td></tr>"
+        for timestamp, message in messages
+    )
+    return f"<table><tbody>{rows}</tbody></table>"
+
+def full_poll(tracker_entry, page):
+    new_messages, current_message_count = main.parse_number_messages(page, tracker_entry.last_digest, tracker_entry.message_count)
+    return main.track_messages(tracker_entry, "22500000001", "IVORY COAST 1", new_messages, current_message_count)
+
+class LiveFeedTest(unittest.TestCase):
+    def test_first_poll_only_fetches_the_cursor(self):
+        feed = LiveFeed("https://portal.test/portal/live/feed", wait=0)
+        session = FakeFeedSession([
+            {"cursor": 1, "events": [event("Your code is 111111", "2025-01-01 10:00:00")]},
+            {"cursor": 2, "events": [event("Your code is 222222", "2025-01-01 10:01:00")]},
+        ])
+
+        async def run():
+            return await feed.poll(session, {}), await feed.poll(session, {})
+
+        first, second = asyncio.run(run())
+        self.assertEqual(first, [])
+        self.assertEqual([sms.message for sms in second], ["Your code is 222222"])
+        self.assertNotIn("cursor", session.params[0])
+        self.assertEqual(session.params[1]["cursor"], 1)
+
+class PushedThenPolledTest(unittest.TestCase):
+    def setUp(self):
+        self.state_dir = tempfile.TemporaryDirectory()
+        self.archive = Archive(os.path.join(self.state_dir.name, "archive.sqlite3"))
+        self.outbox = Outbox(os.path.join(self.state_dir.name, "outbox.sqlite3"))
+
+    def tearDown(self):
+        self.archive.db.close()
+        self.outbox.db.close()
+        self.state_dir.cleanup()
+
+    def test_feed_drop_then_full_poll(self):
+        older = ("2025-01-01 09:00:00", "Your code is 000000")
+        pushed = ("2025-01-01 10:00:00", "Your code is 123456")
+        tracker_entry = TrackedNumber("1001")
+        self.assertEqual(len(full_poll(tracker_entry, messages_page([older]))), 1)
+
+        # The feed pushes one SMS, then drops and the poller falls back to full polling
+        feed = LiveFeed("https://portal.test/portal/live/feed", wait=0)
+        feed.cursor = 0
+        session = FakeFeedSession([{"cursor": 1, "events": [event(pushed[1], pushed[0])]}])
+        number_tracker = {"IVORY COAST 1": {"22500000001": tracker_entry}}
+
+        async def push():
+            batch = await feed.poll(session, {})
+            await main.ingest_pushed_sms(
+                batch, number_tracker, archive=self.archive, router=load_router("", "1"), outbox=self.outbox, bot=None,
+            )
+
+        asyncio.run(push())
+        self.assertEqual(tracker_entry.message_count, 2)
+        self.assertEqual(tracker_entry.last_messages[0], pushed[1])
+        self.assertEqual(len(self.outbox.pending()), 1)
+
+        self.assertEqual(full_poll(tracker_entry, messages_page([pushed, older])), [])
+        later = ("2025-01-01 10:05:00", "Your code is 654321")
+        detected = full_poll(tracker_entry, messages_page([later, pushed, older]))
+        self.assertEqual([sms.message for sms in detected], [later[1]])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import time
+from array import array
+
+class RingSeries:
+    """Fixed-size ring of time buckets, each holding `fields` float totals.
+
+    Values live in one flat array('d') and bucket numbers in a parallel
+    array('q'); a slot whose bucket number is stale is treated as empty and
+    reset lazily on the next write, so memory never grows and nothing has to
+    sweep old buckets.
+    """
+
+    def __init__(self, resolution, slots, fields):
+        self.resolution = resolution
+        self.slots = slots
+        self.fields = fields
+        self.values = array('d', bytes(8 * slots * fields))
+        self.buckets = array('q', [-1]) * slots
+
+    def add(self, now, *values):
+        bucket = int(now // self.resolution)
+        offset = (bucket % self.slots) * self.fields
+        if self.buckets[bucket % self.slots] != bucket:
+            self.buckets[bucket % self.slots] = bucket
+            for i in range(self.fields):
+                self.values[offset + i] = 0.0
+        for i, value in enumerate(values):
+            self.values[offset + i] += value
+
+    def series(self, now, count, field):
+        """Return the last `count` buckets of a field, oldest first (empty buckets are 0)."""
+        current = int(now // self.resolution)
+        result = []
+        for bucket in range(current - min(count, self.slots) + 1, current + 1):
+            slot = bucket % self.slots
+            result.append(self.values[slot * self.fields + field] if self.buckets[slot] == bucket else 0.0)
+        return result
+
+    def total(self, now, count, field):
+        return sum(self.series(now, count, field))
+
+class RangeMetrics:
+    """Rolling per-range SMS and revenue history at minute and hour resolution.
+
+    Fed with each tick's parse_statistics result; the difference to the
+    previous tick is added to the current minute and hour buckets. Counts
+    that go down (the portal's daily window rolled over) restart the delta
+    from the new value.
+    """
+
+    COUNT, REVENUE = 0, 1
+
+    def __init__(self, minutes=60, hours=48):
+        self.minutes = minutes
+        self.hours = hours
+        self.per_minute = {}
+        self.per_hour = {}
+        self.last = {}
+
+    def update(self, ranges, now=None):
+        now = time.time() if now is None else now
+        for r in ranges:
+            name = r.range_name
+            previous = self.last.get(name)
+            self.last[name] = (r.count, r.revenue)
+            if previous is None:
+                # First sight of a range only sets the baseline
+                continue
+            count = r.count - previous[0]
+            revenue = r.revenue - previous[1]
+            if count < 0 or revenue < 0:
+                count, revenue = r.count, r.revenue
+            if not count and not revenue:
+                continue
+            if name not in self.per_minute:
+                self.per_minute[name] = RingSeries(60, self.minutes, 2)
+                self.per_hour[name] = RingSeries(3600, self.hours, 2)
+            self.per_minute[name].add(now, count, revenue)
+            self.per_hour[name].add(now, count, revenue)
+
+    def rate(self, range_name, minutes=5, now=None):
+        """SMS per minute for a range over the last `minutes` minutes."""
+        now = time.time() if now is None else now
+        series = self.per_minute.get(range_name)
+        return series.total(now, minutes, self.COUNT) / minutes if series else 0.0
+
+    def top(self, n=10, minutes=60, now=None):
+        """Return the n busiest ranges as [(range_name, sms, revenue)] over the last `minutes` minutes."""
+        now = time.time() if now is None else now
+        totals = [
+            (name, series.total(now, minutes, self.COUNT), series.total(now, minutes, self.REVENUE))
+            for name, series in self.per_minute.items()
+        ]
+        totals = [t for t in totals if t[1] or t[2]]
+        return sorted(totals, key=lambda t: t[1], reverse=True)[:n]
+
+    def revenue_per_hour(self, hours=24, range_name=None, now=None):
+        """Revenue per hour bucket, oldest first, for one range or all ranges combined."""
+        now = time.time() if now is None else now
+        hours = min(hours, self.hours)
+        if range_name is not None:
+            series = self.per_hour.get(range_name)
+            return series.series(now, hours, self.REVENUE) if series else [0.0] * hours
+        combined = [0.0] * hours
+        for series in self.per_hour.values():
+            for i, value in enumerate(series.series(now, hours, self.REVENUE)):
+                combined[i] += value
+        return combined
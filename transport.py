@@ -0,0 +1,129 @@
+import importlib.util
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Transport settings
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "0") == "1"
+UPSTREAM_POOL_CONNECTIONS = int(os.getenv("UPSTREAM_POOL_CONNECTIONS", "4"))
+UPSTREAM_POOL_MAXSIZE = int(os.getenv("UPSTREAM_POOL_MAXSIZE", "16"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", "8"))
+
+# Record every upstream exchange to a capture file, or replay one instead of going to the network
+UPSTREAM_RECORD = os.getenv("UPSTREAM_RECORD", "")
+UPSTREAM_REPLAY = os.getenv("UPSTREAM_REPLAY", "")
+UPSTREAM_REPLAY_SCALE = float(os.getenv("UPSTREAM_REPLAY_SCALE", "1"))
+
+# (connect, read) timeouts per endpoint; override with UPSTREAM_TIMEOUT_<NAME>="connect,read"
+ENDPOINT_TIMEOUTS = {
+    "login": (5, 30),
+    "portal": (5, 10),
+    "statistics": (5, 20),
+    "numbers": (5, 15),
+    "messages": (5, 15),
+    "test_sms": (5, 20),
+    "return": (5, 60),
+    "active": (5, 30),
+    "live_feed": (5, 35),
+}
+
+# Connection-specific headers are not allowed on HTTP/2 requests
+HTTP2_FORBIDDEN_HEADERS = {"connection", "keep-alive", "proxy-connection", "transfer-encoding", "upgrade"}
+
+def endpoint_timeout(name):
+    """Return the (connect, read) timeout tuple for an upstream endpoint."""
+    override = os.getenv(f"UPSTREAM_TIMEOUT_{name.upper()}")
+    if override:
+        try:
+            connect, read = (float(v) for v in override.split(","))
+            return connect, read
+        except ValueError:
+            logger.warning("Ignoring invalid UPSTREAM_TIMEOUT_%s: %s", name.upper(), override)
+    return ENDPOINT_TIMEOUTS[name]
+
+class Http2Session:
+    """requests.Session-compatible wrapper multiplexing calls over an HTTP/2 httpx.Client."""
+
+    def __init__(self, max_connections, max_keepalive_connections, keepalive_expiry):
+        import httpx
+
+        self._httpx = httpx
+        self.client = httpx.Client(
+            http2=True,
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+        )
+
+    @property
+    def cookies(self):
+        return self.client.cookies
+
+    def _timeout(self, timeout):
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            return self._httpx.Timeout(read, connect=connect)
+        return timeout
+
+    @staticmethod
+    def _headers(headers):
+        if not headers:
+            return headers
+        return {k: v for k, v in headers.items() if k.lower() not in HTTP2_FORBIDDEN_HEADERS}
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        return self.client.get(url, headers=self._headers(headers), params=params, timeout=self._timeout(timeout))
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        body = {"content": data} if isinstance(data, (str, bytes)) else {"data": data}
+        return self.client.post(url, headers=self._headers(headers), timeout=self._timeout(timeout), **body)
+
+    def close(self):
+        self.client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def create_session():
+    """Create the upstream session: HTTP/2 when enabled and available, else a sized HTTP/1.1 pool.
+
+    With UPSTREAM_REPLAY set, responses come from that capture instead; with
+    UPSTREAM_RECORD set, the session's exchanges are appended to that capture.
+    """
+    if UPSTREAM_REPLAY:
+        from capture import ReplaySession
+
+        return ReplaySession(UPSTREAM_REPLAY, scale=UPSTREAM_REPLAY_SCALE)
+    session = _create_network_session()
+    if UPSTREAM_RECORD:
+        from capture import RecordingSession
+
+        return RecordingSession(session, UPSTREAM_RECORD)
+    return session
+
+def _create_network_session():
+    if UPSTREAM_HTTP2:
+        if importlib.util.find_spec("httpx") and importlib.util.find_spec("h2"):
+            return Http2Session(
+                max_connections=UPSTREAM_POOL_MAXSIZE,
+                max_keepalive_connections=UPSTREAM_POOL_CONNECTIONS,
+                keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+            )
+        logger.warning("UPSTREAM_HTTP2 is set but httpx[http2] is not installed, falling back to requests over HTTP/1.1")
+
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=UPSTREAM_POOL_CONNECTIONS, pool_maxsize=UPSTREAM_POOL_MAXSIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session